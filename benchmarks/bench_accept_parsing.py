@@ -0,0 +1,145 @@
+"""Benchmark tokenizing and parsing Accept style headers.
+
+Compares tokenize_accept_header() and ContentNegotiator._parse_accept()
+with the split() and strip() based parsing they replace, for typical
+browser and API client headers, reporting how many times faster the new
+code is and the peak memory allocated while parsing each header. Timings
+alternate between old and new code and the median ratio is reported, so
+that the result is stable on a busy machine. Run from the repository
+root with:
+
+PYTHONPATH=. python benchmarks/bench_accept_parsing.py
+"""
+import statistics
+import timeit
+import tracemalloc
+
+from negotiator2 import ContentNegotiator, ContentType
+from negotiator2.negotiator import parse_cache, tokenize_accept_header
+
+ACCEPT_HEADERS = [
+    'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,'
+    'image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'application/json',
+    'text/turtle;q=1.0, application/rdf+xml;q=0.5, application/ld+json;q=0.5, */*;q=0.1',
+]
+HEADERS = ACCEPT_HEADERS + [
+    'en-US,en;q=0.9,de;q=0.8,fr;q=0.7,es;q=0.6,it;q=0.5,nl;q=0.4,pt;q=0.3,ja;q=0.2',
+]
+NUMBER = 1000
+ROUNDS = 30
+
+
+def split_tokenize(header):
+    """Previous tokenizing as (range, params, q, position) tuples.
+
+    This is the previous _split_accept_header() and _interpret_accept_field()
+    except that q is taken from the third component of "type;params;q".
+    """
+    parts = [a.strip() for a in header.split(",")]
+    position = 0
+    for part in parts:
+        position += 1
+        components = part.split(";")
+        range = components[0].strip()
+        params = None
+        q = None
+        if len(components) == 2:
+            if components[1].strip().startswith("q="):
+                q = float(components[1].strip()[2:])
+            else:
+                params = components[1].strip()
+        elif len(components) == 3:
+            params = components[1].strip()
+            q = float(components[2].strip()[2:])
+        yield (range, params, q, position)
+
+
+class SplitNegotiator(ContentNegotiator):
+    """ContentNegotiator with the previous _parse_accept()."""
+
+    def _parse_accept(self, accept):
+        parts = self._split_accept_header(accept)
+        unsorted = []
+        highest_q = 0.0
+        counter = 0
+        for part in parts:
+            counter += 1
+            type, params, q = self._interpret_accept_field(part, -1 * counter)
+            supertype, subtype = type.split("/", 1)
+            if q > highest_q:
+                highest_q = q
+            unsorted.append((ContentType.interned(supertype, subtype, params), q))
+        sorted = self._sort_by_q(unsorted, highest_q)
+        return self._levels(sorted)
+
+    def _split_accept_header(self, accept):
+        return [a.strip() for a in accept.split(",")]
+
+    def _interpret_accept_field(self, accept, default_q):
+        components = accept.split(";")
+        type = components[0].strip()
+        params = None
+        q = default_q
+        if len(components) == 2:
+            if components[1].strip().startswith("q="):
+                q = components[1].strip()[2:]
+            else:
+                params = components[1].strip()
+        elif len(components) == 3:
+            params = components[1].strip()
+            q = components[2].strip()[2:]
+        return (type, params, float(q))
+
+
+def tokenize_all(tokenize):
+    """Tokenize each of HEADERS, discarding the tokens."""
+    for header in HEADERS:
+        for token in tokenize(header):
+            pass
+
+
+def parse_all(cn):
+    """Parse each of ACCEPT_HEADERS with negotiator cn."""
+    for header in ACCEPT_HEADERS:
+        cn._parse_accept(header)
+
+
+def speedup(old, new):
+    """Median ratio of old to new time over alternating rounds."""
+    ratios = []
+    for n in range(ROUNDS):
+        t_old = timeit.timeit(old, number=NUMBER)
+        t_new = timeit.timeit(new, number=NUMBER)
+        ratios.append(t_old / t_new)
+    return statistics.median(ratios)
+
+
+def peak(func, header):
+    """Peak bytes allocated while running func(header), after a first run."""
+    func(header)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(header)
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size
+
+
+if __name__ == '__main__':
+    parse_cache.resize(0)
+    (old_cn, new_cn) = (SplitNegotiator(), ContentNegotiator())
+    for header in HEADERS:
+        assert list(split_tokenize(header)) == list(tokenize_accept_header(header))
+    for header in ACCEPT_HEADERS:
+        assert old_cn._parse_accept(header) == new_cn._parse_accept(header)
+    ratio = speedup(lambda: tokenize_all(split_tokenize), lambda: tokenize_all(tokenize_accept_header))
+    print("tokenize: %.2fx faster" % ratio)
+    ratio = speedup(lambda: parse_all(old_cn), lambda: parse_all(new_cn))
+    print("_parse_accept: %.2fx faster" % ratio)
+    for header in ACCEPT_HEADERS:
+        print("peak allocation for %d byte header: tokenize %dB -> %dB, _parse_accept %dB -> %dB" %
+              (len(header),
+               peak(lambda h: list(split_tokenize(h)), header),
+               peak(tokenize_accept_header, header),
+               peak(old_cn._parse_accept, header), peak(new_cn._parse_accept, header)))
@@ -0,0 +1,56 @@
+"""Benchmark the matching engines of ContentNegotiator.
+
+Compares the 'scan', 'sets' and 'bitmask' engines for servers offering
+increasing numbers of variants (content types x languages), negotiating a
+mix of typical browser and API client headers without the result cache.
+Run from the repository root with:
+
+PYTHONPATH=. python benchmarks/bench_engines.py
+"""
+import timeit
+
+from negotiator2 import AcceptParameters, ContentType, Language, CompiledContentNegotiator
+
+TYPES = ['text/html', 'application/xhtml+xml', 'application/json', 'application/ld+json',
+         'text/turtle', 'application/rdf+xml', 'application/n-triples', 'text/plain',
+         'text/csv', 'application/xml', 'application/pdf', 'image/png', 'image/jpeg',
+         'image/webp', 'application/atom+xml', 'text/markdown', 'application/zip',
+         'audio/mpeg', 'video/mp4', 'application/epub+zip']
+LANGUAGES = ['en', 'en-gb', 'en-us', 'de', 'fr', 'es', 'it', 'nl', 'pt', 'pt-br',
+             'ja', 'zh', 'ru', 'pl', 'sv']
+HEADERS = [
+    ('text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+     'en-US,en;q=0.9'),
+    ('application/json', 'de-DE, de;q=0.9, en;q=0.5'),
+    ('text/turtle;q=1.0, application/rdf+xml;q=0.5, */*;q=0.1', 'sv, fr;q=0.5'),
+    ('image/*, audio/*;q=0.5', 'ja'),
+    ('application/epub+zip, application/pdf;q=0.9', 'xx, *;q=0.1'),
+]
+NUMBER = 200
+
+
+def negotiator(num_types, num_languages, engine):
+    """CompiledContentNegotiator for num_types x num_languages variants."""
+    acceptable = [AcceptParameters(ContentType(t), Language(lang))
+                  for t in TYPES[:num_types] for lang in LANGUAGES[:num_languages]]
+    return CompiledContentNegotiator(acceptable[0], acceptable, engine=engine)
+
+
+def run(cn):
+    """Negotiate each of HEADERS."""
+    for (accept, accept_language) in HEADERS:
+        cn.negotiate(accept, accept_language)
+
+
+if __name__ == '__main__':
+    for (num_types, num_languages) in ((5, 2), (10, 10), (20, 15)):
+        times = {}
+        results = {}
+        for engine in ('scan', 'sets', 'bitmask'):
+            cn = negotiator(num_types, num_languages, engine)
+            results[engine] = [cn.negotiate(a, al) for (a, al) in HEADERS]
+            times[engine] = min(timeit.repeat(lambda: run(cn), number=NUMBER, repeat=3))
+        assert results['scan'] == results['sets'] == results['bitmask']
+        print("%d variants: %s" % (num_types * num_languages, ', '.join(
+            "%s %.1fus" % (engine, times[engine] * 1e6 / NUMBER / len(HEADERS))
+            for engine in ('scan', 'sets', 'bitmask'))))
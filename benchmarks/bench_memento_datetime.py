@@ -0,0 +1,38 @@
+"""Benchmark Memento datetime parsing and formatting.
+
+Compares memento_parse_datetime() and memento_datetime_string() with
+the datetime.strptime(..) and strftime(..) calls they replace. Run from
+the repository root with:
+
+PYTHONPATH=. python benchmarks/bench_memento_datetime.py
+"""
+from datetime import datetime
+import timeit
+
+from negotiator2.memento import TIME_FORMAT, memento_parse_datetime, memento_datetime_string, utc
+
+DATETIME_STR = 'Thu, 31 May 2007 20:35:00 GMT'
+DT = datetime(2007, 5, 31, 20, 35, 0, tzinfo=utc())
+NUMBER = 100000
+
+
+def strptime_parse(datetime_str):
+    """Previous implementation of memento_parse_datetime()."""
+    return datetime.strptime(datetime_str, TIME_FORMAT).replace(tzinfo=utc())
+
+
+def report(name, old, new):
+    """Print timings of old and new functions."""
+    t_old = min(timeit.repeat(old, number=NUMBER, repeat=3))
+    t_new = min(timeit.repeat(new, number=NUMBER, repeat=3))
+    print("%s: strptime/strftime %.2fus, negotiator2 %.2fus, %.1fx faster" %
+          (name, t_old * 1e6 / NUMBER, t_new * 1e6 / NUMBER, t_old / t_new))
+
+
+if __name__ == '__main__':
+    assert strptime_parse(DATETIME_STR) == memento_parse_datetime(DATETIME_STR)
+    assert DT.strftime(TIME_FORMAT) == memento_datetime_string(DT)
+    report('parse', lambda: strptime_parse(DATETIME_STR),
+           lambda: memento_parse_datetime(DATETIME_STR))
+    report('format', lambda: DT.strftime(TIME_FORMAT),
+           lambda: memento_datetime_string(DT))
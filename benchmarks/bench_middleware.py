@@ -0,0 +1,65 @@
+"""Benchmark the overhead of the negotiation middleware.
+
+Times calls to ASGINegotiationMiddleware and WSGINegotiationMiddleware
+around an application that does nothing, less the time to call the
+application directly (running the ASGI coroutines to completion without
+an event loop), for typical browser request headers seen before
+so that the middleware has the negotiation result remembered. Run from
+the repository root with:
+
+PYTHONPATH=. python benchmarks/bench_middleware.py
+"""
+import timeit
+
+from negotiator2 import AcceptParameters, ContentType, Language, CompiledContentNegotiator
+from negotiator2.middleware import ASGINegotiationMiddleware, WSGINegotiationMiddleware
+
+ACCEPT = 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'
+ACCEPT_LANGUAGE = 'en-US,en;q=0.9'
+ACCEPT_ENCODING = 'gzip, deflate, br'
+SCOPE = {'type': 'http', 'path': '/', 'headers': [
+    (b'host', b'example.org'),
+    (b'user-agent', b'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/119.0'),
+    (b'accept', ACCEPT.encode('latin-1')),
+    (b'accept-language', ACCEPT_LANGUAGE.encode('latin-1')),
+    (b'accept-encoding', ACCEPT_ENCODING.encode('latin-1')),
+    (b'connection', b'keep-alive'),
+    (b'upgrade-insecure-requests', b'1')]}
+ENVIRON = {'PATH_INFO': '/', 'HTTP_HOST': 'example.org', 'HTTP_ACCEPT': ACCEPT,
+           'HTTP_ACCEPT_LANGUAGE': ACCEPT_LANGUAGE, 'HTTP_ACCEPT_ENCODING': ACCEPT_ENCODING}
+NUMBER = 100000
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI application that does nothing."""
+    return None
+
+
+def wsgi_app(environ, start_response):
+    """WSGI application that does nothing."""
+    return None
+
+
+def run(coroutine):
+    """Run coroutine that does not wait for anything, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        pass
+
+
+def per_call(func):
+    """Best time in microseconds per call of func."""
+    return min(timeit.repeat(func, number=NUMBER, repeat=5)) * 1e6 / NUMBER
+
+
+if __name__ == '__main__':
+    acceptable = [AcceptParameters(ContentType(t), Language(lang))
+                  for t in ('text/html', 'application/json') for lang in ('en', 'de')]
+    cn = CompiledContentNegotiator(acceptable[0], acceptable, cache_size=1024)
+    asgi = ASGINegotiationMiddleware(asgi_app, cn)
+    wsgi = WSGINegotiationMiddleware(wsgi_app, cn)
+    base = per_call(lambda: run(asgi_app(SCOPE, None, None)))
+    print("ASGI overhead %.2fus per request" % (per_call(lambda: run(asgi(SCOPE, None, None))) - base))
+    base = per_call(lambda: wsgi_app(ENVIRON, None))
+    print("WSGI overhead %.2fus per request" % (per_call(lambda: wsgi(ENVIRON, None)) - base))
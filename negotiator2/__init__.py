@@ -2,6 +2,7 @@
 
 __version__ = '2.1.1'
 
-from .negotiator import AcceptParameters, ContentType, Language, ContentNegotiator
+from .negotiator import AcceptParameters, ContentType, Language, ContentNegotiator, CompiledContentNegotiator
 from .memento import BadTimeMap, TimeMap, memento_parse_datetime, memento_datetime_string
-from .util import conneg_on_accept, negotiate_on_datetime
+from .util import (conneg_on_accept, make_conneg_on_accept, precompressed_on_accept,
+                   negotiate_on_datetime, negotiate_on_datetimes)
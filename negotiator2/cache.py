@@ -0,0 +1,132 @@
+"""Bounded caches for negotiator2.
+
+Negotiation inputs in real traffic are highly repetitive: a small number of
+distinct Accept, Accept-Language and Accept-Datetime header strings cover
+almost all requests. The LRUCache here is used to remember the results of
+parsing and negotiation for those repeated inputs.
+"""
+import threading
+
+# Positions in the [previous, next, key, value] links of LRUCache
+_PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """Thread-safe mapping of bounded size with least-recently-used eviction.
+
+    Instance data:
+        maxsize - maximum number of entries held, the least recently used
+            entry is evicted when a new entry would exceed this. A maxsize
+            of 0 disables the cache: nothing is stored and every get() is a
+            miss
+        hits - number of get() calls that found an entry
+        misses - number of get() calls that did not find an entry
+        evictions - number of entries evicted to keep within maxsize
+
+    For example:
+
+    cache = LRUCache(maxsize=100)
+    value = cache.get(key)
+    if value is None:
+        value = expensive(key)
+        cache.put(key, value)
+    """
+
+    def __init__(self, maxsize=128):
+        """Initialize LRUCache object with given maxsize."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # entries are links [previous, next, key, value] keyed by key in
+        # _data, and in a circular doubly linked list through _root from
+        # the least recently used (_root[_NEXT]) to the most recently used
+        # (_root[_PREV]). This works with dictionaries that do not keep
+        # order, and OrderedDict which needs Python 2.7
+        self._data = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Value for key, or default if key is not in the cache."""
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            # move to the end to mark as most recently used
+            self._unlink(link)
+            self._append(link)
+            self.hits += 1
+            return link[_VALUE]
+
+    def put(self, key, value):
+        """Add or replace entry for key with value."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            link = self._data.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[_VALUE] = value
+            else:
+                link = [None, None, key, value]
+                self._data[key] = link
+            self._append(link)
+            self._evict(self.maxsize)
+
+    def clear(self):
+        """Remove all entries, the counters are not reset."""
+        with self._lock:
+            self._data.clear()
+            self._root[:] = [self._root, self._root, None, None]
+
+    def resize(self, maxsize):
+        """Change maxsize, evicting least recently used entries if necessary."""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict(max(maxsize, 0))
+
+    def _unlink(self, link):
+        """Remove link from the list."""
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+    def _append(self, link):
+        """Add link to the list as the most recently used."""
+        last = self._root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = self._root
+        last[_NEXT] = link
+        self._root[_PREV] = link
+
+    def _evict(self, size):
+        """Evict least recently used entries until there are at most size."""
+        while len(self._data) > size:
+            link = self._root[_NEXT]
+            self._unlink(link)
+            del self._data[link[_KEY]]
+            self.evictions += 1
+
+    def info(self):
+        """Dictionary of the size, maxsize and counters of the cache."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._data),
+                'maxsize': self.maxsize}
+
+    def __len__(self):
+        """Number of entries in the cache."""
+        return len(self._data)
+
+    def __contains__(self, key):
+        """True if key is in the cache, does not count as a hit or miss."""
+        return key in self._data
+
+    def __getstate__(self):
+        """State for pickling, the lock and entries are not included."""
+        return {'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        """Restore from pickled state as an empty cache."""
+        self.__init__(state['maxsize'])
@@ -21,22 +21,76 @@ Points to note:
 In Python it seems that the permissive way to parse various mail-type dates
 (ie. rfc822/2822) is with email.utils.parsedate(..). However, since the
 Memento version is very restrictive, it seems that datetime.datetime.strptime(..)
-provides a better method, accepting only the allowed form.
+provides a better method, accepting only the allowed form. The parser here
+uses the same regular expression that strptime(..) builds for TIME_FORMAT in
+the C locale, so accepts exactly the same strings, but avoids the locale
+handling and per-call format processing of strptime(..) which make it slow.
 """
 
-from datetime import datetime
+from array import array
+from bisect import bisect_left, insort
+import calendar
+import csv
+try:  # Python 3
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+from datetime import datetime, timedelta
+from itertools import islice
+import json
+import numbers
+import re
+try:
+    import numpy
+except ImportError:  # optional, used by TimeMap.best_versions()
+    numpy = None
 try:  # Python 3
     from datetime.timezone import utc
 except:  # Python 2
     from dateutil.tz import tzutc as utc
 
+try:
+    array('q')
+    INT64 = 'q'
+except ValueError:  # Python 2 has no 'q', 'l' is 64 bits on LP64 platforms
+    INT64 = 'l'
+
+UTC = utc()
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
 
 TIME_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
 
+DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+               'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+MONTH_NUMBERS = dict((m.lower(), n + 1) for (n, m) in enumerate(MONTH_NAMES))
+
+# The regular expression that datetime.strptime(..) uses for TIME_FORMAT in
+# the C locale. As with strptime(..) the day name is not checked against the
+# date, and day and month names are not case sensitive
+TIME_RE = re.compile(r'(mon|tue|wed|thu|fri|sat|sun),\s+'
+                     r'(3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])\s+'
+                     r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+'
+                     r'(\d\d\d\d)\s+'
+                     r'(2[0-3]|[0-1]\d|\d):([0-5]\d|\d):(6[0-1]|[0-5]\d|\d)\s+GMT',
+                     re.IGNORECASE)
+
 
 def memento_parse_datetime(datetime_str):
-    """Parse Memento datetime_str into datetime.datetime object."""
-    return datetime.strptime(datetime_str, TIME_FORMAT).replace(tzinfo=utc())
+    """Parse Memento datetime_str into datetime.datetime object.
+
+    Accepts and rejects exactly the same strings as
+    datetime.strptime(datetime_str, TIME_FORMAT) in the C locale, raising
+    ValueError for a bad datetime_str.
+    """
+    m = TIME_RE.match(datetime_str)
+    if (m is None or m.end() != len(datetime_str)):
+        raise ValueError("time data %r does not match format %r" % (datetime_str, TIME_FORMAT))
+    (a, d, b, y, hh, mm, ss) = m.groups()
+    # datetime(..) raises ValueError for bad dates and seconds 60 or 61
+    return datetime(int(y), MONTH_NUMBERS[b.lower()], int(d),
+                    int(hh), int(mm), int(ss), tzinfo=UTC)
 
 
 def memento_datetime_string(dt):
@@ -44,7 +98,9 @@ def memento_datetime_string(dt):
 
     N.B. Will disregard any timezone information.
     """
-    return dt.strftime(TIME_FORMAT)
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        DAY_NAMES[dt.weekday()], dt.day, MONTH_NAMES[dt.month - 1], dt.year,
+        dt.hour, dt.minute, dt.second)
 
 
 def links_line(context, rels, extra=None):
@@ -75,6 +131,251 @@ class BadTimeMap(Exception):
     pass
 
 
+class _MementoIndex(object):
+    """Sorted index over a dictionary of Memento URIs keyed by datetime.
+
+    Provides binary search over the Memento datetimes in a form used by
+    TimeMap.best_version(). Instance data:
+        mementos - the dictionary indexed
+        sorted_keys - sorted list of the keys of mementos
+    """
+
+    def __init__(self, mementos, sorted_keys=None):
+        """Initialize _MementoIndex for the dictionary mementos.
+
+        If the sorted list of keys of mementos is already known it
+        may be given as sorted_keys.
+        """
+        self.mementos = mementos
+        self.sorted_keys = sorted(mementos.keys()) if sorted_keys is None else sorted_keys
+
+    def key(self, dt):
+        """Key used in sorted_keys for datetime dt."""
+        return dt
+
+    def add(self, dt):
+        """Add datetime dt to sorted_keys, call before adding to mementos."""
+        if (dt not in self.mementos):
+            insort(self.sorted_keys, dt)
+
+    def datetime_at(self, i):
+        """Datetime of Memento at position i in sorted order."""
+        return self.sorted_keys[i]
+
+    def uri_at(self, i):
+        """URI of Memento at position i in sorted order."""
+        return self.mementos[self.sorted_keys[i]]
+
+    def __len__(self):
+        """Number of Mementos in index."""
+        return len(self.sorted_keys)
+
+
+def datetime_to_epoch(dt):
+    """Integer seconds since the epoch for datetime dt.
+
+    A naive datetime is taken to be UTC, sub-second accuracy is discarded.
+    """
+    return calendar.timegm(dt.utctimetuple())
+
+
+def epoch_to_datetime(seconds):
+    """UTC datetime.datetime object for integer seconds since the epoch."""
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def timestamp_to_epoch(ts):
+    """Integer seconds since the epoch for timestamp ts from a record.
+
+    The timestamp ts may be any of:
+      * a 14-digit string YYYYMMDDhhmmss as used in CDX files and Wayback
+        URIs, e.g. '20170808020808'
+      * a number, or other string of digits, of seconds since the epoch
+      * a datetime.datetime object
+      * a Memento datetime string, e.g. 'Tue, 08 Aug 2017 02:08:08 GMT'
+
+    Raises ValueError if ts is a string that cannot be parsed.
+    """
+    if (isinstance(ts, datetime)):
+        return datetime_to_epoch(ts)
+    if (isinstance(ts, numbers.Real)):
+        return int(ts)
+    ts = ts.strip()
+    if (ts.isdigit()):
+        if (len(ts) == 14):
+            # datetime(..) checks values are in range
+            dt = datetime(int(ts[0:4]), int(ts[4:6]), int(ts[6:8]),
+                          int(ts[8:10]), int(ts[10:12]), int(ts[12:14]))
+            return calendar.timegm(dt.timetuple())
+        return int(ts)
+    return datetime_to_epoch(memento_parse_datetime(ts))
+
+
+def read_records(records, format=None, uri_format=None):
+    """Iterator of (uri, timestamp) from records in format.
+
+    Formats are:
+      None - records is an iterable of (uri, timestamp) already
+      'csv' - records is an iterable of lines (e.g. a file opened in text
+          mode) of CSV with the URI in the first column and timestamp in
+          the second
+      'jsonl' - records is an iterable of lines of JSON objects with the
+          keys 'uri' and 'timestamp'
+      'cdx' - records is an iterable of lines in CDX format, with the
+          timestamp in the second field and original URI in the third. The
+          Memento URI is made using uri_format with keys timestamp and
+          original, e.g. 'http://archive.example.org/%(timestamp)s/%(original)s'
+
+    The timestamps are as accepted by timestamp_to_epoch().
+    """
+    if (format is None):
+        return iter(records)
+    elif (format == 'csv'):
+        return ((row[0], row[1]) for row in csv.reader(records) if row)
+    elif (format == 'jsonl'):
+        return _read_jsonl(records)
+    elif (format == 'cdx'):
+        if (uri_format is None):
+            raise ValueError("uri_format is required to read CDX records")
+        return _read_cdx(records, uri_format)
+    raise ValueError("Unknown record format %r" % (format))
+
+
+def _read_jsonl(records):
+    for line in records:
+        if (line.strip()):
+            obj = json.loads(line)
+            yield (obj['uri'], obj['timestamp'])
+
+
+def _read_cdx(records, uri_format):
+    for line in records:
+        fields = line.split()
+        # skip blank lines and the ' CDX N b a ...' header line
+        if (len(fields) < 3 or fields[0] == 'CDX'):
+            continue
+        yield (uri_format % {'timestamp': fields[1], 'original': fields[2]}, fields[1])
+
+
+class CompactMementos(MutableMapping):
+    """Compact storage of Memento URIs indexed by datetime.
+
+    Behaves as the dictionary TimeMap.mementos, and also provides the sorted
+    index used by TimeMap.best_version(), but stores the datetimes as
+    integer seconds since the epoch in a sorted array and the URIs as UTF-8
+    in a single buffer. On a 64-bit platform each Memento costs 24 bytes
+    (datetime, URI number and URI offset) plus the length of the URI in
+    UTF-8, compared with about 160 bytes plus the length of the URI with a
+    dictionary of datetime objects and strings (measured with CPython 3.11,
+    100k Mementos).
+
+    Datetimes are stored with one second accuracy, as in Memento, and
+    are returned as timezone-aware UTC datetimes. Replacing or deleting
+    a Memento does not recover the space used by the old URI.
+    """
+
+    def __init__(self, mementos=None):
+        """Initialize CompactMementos, copying any given mementos."""
+        self.sorted_keys = array(INT64)
+        self.uri_ids = array(INT64)
+        self.uri_offsets = array(INT64, [0])
+        self.uri_data = bytearray()
+        if (mementos):
+            # sort once rather than inserting each Memento in sorted order,
+            # later datetimes with the same key replace earlier ones as
+            # with __setitem__
+            uris = {}
+            for (dt, uri) in mementos.items():
+                uris[self.key(dt)] = uri
+            sorted_keys = sorted(uris)
+            self._load_sorted(sorted_keys, [uris[k] for k in sorted_keys])
+
+    @classmethod
+    def from_sorted(cls, sorted_keys, uris):
+        """CompactMementos from sorted_keys of epoch seconds and corresponding uris.
+
+        The keys must be sorted and without duplicates.
+        """
+        cm = cls()
+        cm._load_sorted(sorted_keys, uris)
+        return cm
+
+    def _load_sorted(self, sorted_keys, uris):
+        """Replace contents of empty CompactMementos with sorted_keys and uris."""
+        self.sorted_keys = array(INT64, sorted_keys)
+        self.uri_ids = array(INT64, range(len(uris)))
+        for uri in uris:
+            self.add_uri(uri)
+
+    def key(self, dt):
+        """Key used in sorted_keys for datetime dt."""
+        return datetime_to_epoch(dt)
+
+    def add(self, dt):
+        """No-op, the mapping is its own index."""
+        pass
+
+    def add_uri(self, uri):
+        """Add uri to the URI table and return its number."""
+        self.uri_data.extend(uri.encode('utf-8'))
+        self.uri_offsets.append(len(self.uri_data))
+        return len(self.uri_offsets) - 2
+
+    def uri(self, uri_id):
+        """URI string for uri_id."""
+        start = self.uri_offsets[uri_id]
+        return self.uri_data[start:self.uri_offsets[uri_id + 1]].decode('utf-8')
+
+    def datetime_at(self, i):
+        """Datetime of Memento at position i in sorted order."""
+        return epoch_to_datetime(self.sorted_keys[i])
+
+    def uri_at(self, i):
+        """URI of Memento at position i in sorted order."""
+        return self.uri(self.uri_ids[i])
+
+    def _position(self, dt):
+        k = self.key(dt)
+        i = bisect_left(self.sorted_keys, k)
+        if (i < len(self.sorted_keys) and self.sorted_keys[i] == k):
+            return i
+        raise KeyError(dt)
+
+    def __getitem__(self, dt):
+        """URI of Memento with datetime dt."""
+        return self.uri_at(self._position(dt))
+
+    def __setitem__(self, dt, uri):
+        """Add or replace Memento with datetime dt."""
+        k = self.key(dt)
+        i = bisect_left(self.sorted_keys, k)
+        uri_id = self.add_uri(uri)
+        if (i < len(self.sorted_keys) and self.sorted_keys[i] == k):
+            self.uri_ids[i] = uri_id
+        else:
+            self.sorted_keys.insert(i, k)
+            self.uri_ids.insert(i, uri_id)
+
+    def __delitem__(self, dt):
+        """Remove Memento with datetime dt."""
+        i = self._position(dt)
+        del self.sorted_keys[i]
+        del self.uri_ids[i]
+
+    def __iter__(self):
+        """Iterate over datetimes in sorted order."""
+        for k in self.sorted_keys:
+            yield epoch_to_datetime(k)
+
+    def __len__(self):
+        """Number of Mementos."""
+        return len(self.sorted_keys)
+
+    def items(self):
+        """List of (datetime, uri) in sorted order."""
+        return [(self.datetime_at(i), self.uri_at(i)) for i in range(len(self))]
+
+
 class TimeMap(object):
     """TimeMap class.
 
@@ -82,7 +383,11 @@ class TimeMap(object):
     (Seems that there is an error in the example, Figure 28, in that the "until"
     time of the TimeMap is before the date of the last Memento?)
 
-    Possibility of paged TimeMap documents is not supported at present.
+    Paged TimeMap documents (https://tools.ietf.org/html/rfc7089#section-4.3)
+    are supported by setting page_size. Each page lists the Original
+    Resource and TimeGate, the Mementos for that page, a "self" link to the
+    page and "timemap" links to the previous and next pages, all with "from"
+    and "until" datetimes.
 
     Instance data:
         original - URI of original
@@ -93,6 +398,18 @@ class TimeMap(object):
             to be used when deciding which version is best for a given
             datetime request. If not specified then the current datetime
             will be used in negotiation.
+        page_size - number of Mementos in each page of a paged TimeMap, or
+            None (default) for a single document
+        page_uri_format - format for the URI of each page of a paged TimeMap,
+            with keys timemap and page (number starting from 1)
+
+    If created with compact=True then mementos is a CompactMementos object
+    rather than a dictionary, which uses much less memory per Memento.
+
+    A sorted index of the Memento datetimes is kept so that best_version()
+    is a binary search. The index is updated incrementally by add_memento(),
+    and is rebuilt when mementos is replaced or changes size. Other
+    direct changes to the keys of mementos are not detected.
     """
 
     FORMATS = ['']
@@ -103,13 +420,74 @@ class TimeMap(object):
     LAST = 2
 
     def __init__(self, original=None, mementos=None, timegate=None,
-                 timemap=None, original_datetime=None):
+                 timemap=None, original_datetime=None, compact=False,
+                 page_size=None, page_uri_format='%(timemap)s?page=%(page)d'):
         """Initialize TimeMap."""
         self.original = original
-        self.mementos = mementos if mementos else {}
+        if (compact):
+            self.mementos = CompactMementos(mementos)
+        else:
+            self.mementos = mementos if mementos else {}
         self.timegate = timegate
         self.timemap = timemap
         self.original_datetime = None
+        self.page_size = page_size
+        self.page_uri_format = page_uri_format
+        self._index = None
+
+    def _memento_index(self):
+        """Sorted index of mementos, rebuilt if out of date."""
+        if (isinstance(self.mementos, CompactMementos)):
+            return self.mementos
+        if (self._index is None or self._index.mementos is not self.mementos or
+                len(self._index) != len(self.mementos)):
+            self._index = _MementoIndex(self.mementos)
+        return self._index
+
+    @classmethod
+    def from_records(cls, records, original=None, timegate=None, timemap=None,
+                     compact=False, format=None, uri_format=None, batch_size=10000):
+        """TimeMap with Mementos loaded in bulk from records.
+
+        The records are read as (uri, timestamp) by read_records() using
+        format and uri_format, so may be an iterable of tuples or a file
+        of CSV, JSON lines or CDX. Timestamps are as accepted by
+        timestamp_to_epoch(), e.g. 14-digit CDX timestamps or seconds since
+        the epoch.
+
+        Records are parsed in batches of batch_size and the sorted index is
+        built once at the end, which is much faster than add_memento() for
+        each record. As with add_memento(), a later record with the same
+        datetime as an earlier one replaces it.
+
+        Other arguments are as for TimeMap().
+        """
+        keys = array(INT64)
+        uris = []
+        it = read_records(records, format, uri_format)
+        while True:
+            batch = list(islice(it, batch_size))
+            if (not batch):
+                break
+            keys.extend([timestamp_to_epoch(ts) for (uri, ts) in batch])
+            uris.extend([uri for (uri, ts) in batch])
+        # sort is stable so of records with the same datetime the last is kept
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        sorted_keys = array(INT64)
+        sorted_uris = []
+        for (n, i) in enumerate(order):
+            if (n + 1 < len(order) and keys[order[n + 1]] == keys[i]):
+                continue
+            sorted_keys.append(keys[i])
+            sorted_uris.append(uris[i])
+        tm = cls(original=original, timegate=timegate, timemap=timemap)
+        if (compact):
+            tm.mementos = CompactMementos.from_sorted(sorted_keys, sorted_uris)
+        else:
+            dts = [epoch_to_datetime(k) for k in sorted_keys]
+            tm.mementos = dict(zip(dts, sorted_uris))
+            tm._index = _MementoIndex(tm.mementos, dts)
+        return tm
 
     def set_original(self, uri, datetime_str=None):
         """Set Original resource with given uri and (optional) datetime_str in map."""
@@ -121,39 +499,131 @@ class TimeMap(object):
 
     def add_memento(self, uri, datetime_str):
         """Add Memento with given uri and datetime_str to map."""
-        self.mementos[memento_parse_datetime(datetime_str)] = uri
+        dt = memento_parse_datetime(datetime_str)
+        self._memento_index().add(dt)
+        self.mementos[dt] = uri
+
+    def num_pages(self):
+        """Number of pages of the TimeMap, 1 if not paged."""
+        if (self.page_size is None):
+            return 1
+        return max(1, (len(self._memento_index()) + self.page_size - 1) // self.page_size)
+
+    def page_uri(self, page):
+        """URI of page number page of the TimeMap."""
+        return self.page_uri_format % {'timemap': self.timemap, 'page': page}
+
+    def serialize_link_format(self, page=None):
+        """String representation in "application/link-format" format.
+
+        If page is given then only that page (numbered from 1) of a paged
+        TimeMap is returned.
+        """
+        return ''.join(self.iter_link_format(encoding=None, page=page))
+
+    def iter_link_format(self, encoding='utf-8', chunk_size=65536, page=None):
+        """Iterator over "application/link-format" representation in chunks.
+
+        Yields chunks of about chunk_size characters, encoded with encoding
+        unless encoding is None in which case strings are yielded. Mementos
+        are listed in datetime order. Suitable for use as a streaming
+        response body, for example from a WSGI application:
 
-    def serialize_link_format(self):
-        """String representation in "application/link-format" format."""
-        lines = []
+        return tm.iter_link_format()
+
+        If page is given then only that page (numbered from 1) of a paged
+        TimeMap is generated.
+
+        Raises BadTimeMap immediately, before any chunk is generated, if
+        the TimeMap or page cannot be serialized.
+        """
         # MUST list the URI-R of the Original Resource that the TimeMap is
         # about;
         if (self.original is None):
             raise BadTimeMap('TimeMap MUST list the URI-R of the Original Resource')
+        if (page is not None):
+            if (self.page_size is None or self.timemap is None):
+                raise BadTimeMap('TimeMap must have page_size and timemap set for paging')
+            if (page < 1 or page > self.num_pages()):
+                raise BadTimeMap('TimeMap does not have page %s' % (str(page)))
+        return self._link_format_chunks(encoding, chunk_size, page)
+
+    def write_link_format(self, fh, encoding='utf-8', chunk_size=65536, page=None):
+        """Write "application/link-format" representation to file-like object fh.
+
+        Chunks are encoded with encoding, use encoding=None for a file
+        opened in text mode. If page is given then only that page of a
+        paged TimeMap is written.
+        """
+        for chunk in self.iter_link_format(encoding, chunk_size, page):
+            fh.write(chunk)
+
+    def _link_format_chunks(self, encoding, chunk_size, page):
+        """Generate chunks of lines joined with separators."""
+        buf = []
+        size = 0
+        sep = ''
+        for line in self._link_format_lines(page):
+            buf.append(sep)
+            buf.append(line)
+            size += len(line) + 2
+            sep = ',\n'
+            if (size >= chunk_size):
+                chunk = ''.join(buf)
+                yield chunk if encoding is None else chunk.encode(encoding)
+                buf = []
+                size = 0
+        if (buf):
+            chunk = ''.join(buf)
+            yield chunk if encoding is None else chunk.encode(encoding)
+
+    def _page_extra(self, index, start, end):
+        """Dict of type, from and until attributes for Mementos start to end-1."""
+        extra = {'type': 'application/link-format'}
+        if (end > start):
+            extra['from'] = memento_datetime_string(index.datetime_at(start))
+            extra['until'] = memento_datetime_string(index.datetime_at(end - 1))
+        return extra
+
+    def _link_format_lines(self, page=None):
+        """Generate links_line() strings for the TimeMap or page of it."""
         original_rels = ['original']
         if (self.timegate == self.original):
             original_rels.append('timegate')
-        lines.append(links_line(self.original, original_rels, None))
+        yield links_line(self.original, original_rels, None)
         # MUST list the URI-M and archival datetime of each Memento for the
         # Original Resource known to the server, preferably in a single
         # document, or, alternatively in multiple documents that can be
         # gathered by following contained links with a "timemap" Relation
         # Type;
-        for (datetime, uri_m) in self.mementos.items():
-            lines.append(links_line(uri_m, ['memento'],
-                         {'datetime': memento_datetime_string(datetime)}))
+        index = self._memento_index()
+        (start, end) = (0, len(index))
+        if (page is not None):
+            start = (page - 1) * self.page_size
+            end = min(start + self.page_size, end)
+        for i in range(start, end):
+            yield links_line(index.uri_at(i), ['memento'],
+                             {'datetime': memento_datetime_string(index.datetime_at(i))})
         # SHOULD list the URI-G of one or more TimeGates for the Original
         # Resource known to the responding server;
         if (self.timegate is not None and self.timegate != self.original):
-            lines.append(links_line(self.timegate, ['timegate'], None))
+            yield links_line(self.timegate, ['timegate'], None)
         # SHOULD, for self-containment, list the URI-T of the TimeMap
         # itself;
         if (self.timemap is not None):
-            # FIXME - add from and until
-            lines.append(links_line(self.timemap, ['self'], None))
+            if (page is None):
+                yield links_line(self.timemap, ['self'], self._page_extra(index, start, end))
+            else:
+                yield links_line(self.page_uri(page), ['self'], self._page_extra(index, start, end))
+                # link to the previous and next pages, each page is a slice of the index
+                if (page > 1):
+                    yield links_line(self.page_uri(page - 1), ['timemap'],
+                                     self._page_extra(index, start - self.page_size, start))
+                if (page < self.num_pages()):
+                    yield links_line(self.page_uri(page + 1), ['timemap'],
+                                     self._page_extra(index, end, min(end + self.page_size, len(index))))
         # MUST unambiguously type listed resources as being Original
         # Resource, TimeGate, Memento, or TimeMap.
-        return ',\n'.join(lines)
 
     def triples(self):
         """RDF representation of TimeMap as a list of triple tuples.
@@ -227,33 +697,92 @@ class TimeMap(object):
             TimeMap.CLOSEST - Select the version with closest datetime
             TimeMap.LAST - Select the last version (ignoring dt)
         """
-        # Make dict of combined original and mementos
-        versions = dict(self.mementos)
+        index = self._memento_index()
+        original_key = self._original_key(index, now)
+        if (method == self.LAST):
+            return self._last_version(index, original_key)
+        key = index.key(dt)
+        return self._choose_version(index, bisect_left(index.sorted_keys, key), key, method, original_key)
+
+    def best_versions(self, dts, method=None, now=None):
+        """List of URIs of the versions best matching each datetime in dts via method.
+
+        Gives the same results as calling best_version() for each datetime
+        in turn, but resolves them together: the datetimes are sorted and
+        located in a single pass over the sorted Mementos, or with
+        numpy.searchsorted() for compact TimeMaps if NumPy is available.
+        The URIs are returned in the order of dts.
+        """
+        index = self._memento_index()
+        original_key = self._original_key(index, now)
+        keys = [index.key(dt) for dt in dts]
+        if (method == self.LAST):
+            return [self._last_version(index, original_key)] * len(keys)
+        sorted_keys = index.sorted_keys
+        if (numpy is not None and isinstance(index, CompactMementos)):
+            positions = numpy.searchsorted(numpy.frombuffer(sorted_keys, dtype=numpy.int64),
+                                           numpy.array(keys, dtype=numpy.int64)).tolist()
+        else:
+            positions = [0] * len(keys)
+            i = 0
+            for n in sorted(range(len(keys)), key=keys.__getitem__):
+                i = bisect_left(sorted_keys, keys[n], i)
+                positions[n] = i
+        return [self._choose_version(index, i, key, method, original_key)
+                for (i, key) in zip(positions, keys)]
+
+    def _original_key(self, index, now):
+        """Key of the original resource in index, or None if there is no original.
+
+        The original resource is considered as a version along with the
+        mementos, taking precedence over a memento with the same datetime.
+        Raises BadTimeMap if there are no versions.
+        """
+        original_key = None
         if (self.original is not None):
             now = datetime.utcnow() if now is None else now
             now = now.replace(tzinfo=utc())  # ensure now is sortable with memento datetimes
             original_dt = now if self.original_datetime is None else self.original_datetime
-            versions[original_dt] = self.original
-        if (len(versions) == 0):
+            original_key = index.key(original_dt)
+        if (len(index) == 0 and original_key is None):
             raise BadTimeMap("No versions available for negotiation.")
-        dts = sorted(versions.keys())
-        if (method == self.LAST):
-            return(versions[dts[-1]])
-        # Work through datetimes of versions in order to
-        # find the best match
-        last_d = None
-        for d in dts:
-            if (d == dt):
-                return versions[d]
-            elif (d > dt):
-                # Have d > dt > last_d -- return last_d or d version?
-                if (last_d is None):
-                    return versions[d]
-                elif (method == self.CLOSEST):
-                    return versions[last_d if ((dt - last_d) < (d - dt)) else d]
-                else:
-                    return versions[last_d]
-            last_d = d
-        # All version datetimes are before the requested datetime,
-        # return the lastest
-        return versions[d]
+        return original_key
+
+    def _last_version(self, index, original_key):
+        """URI of the last version, the original if it is not before the last memento."""
+        if (original_key is not None and
+                (len(index) == 0 or original_key >= index.sorted_keys[-1])):
+            return self.original
+        return index.uri_at(len(index) - 1)
+
+    def _choose_version(self, index, i, key, method, original_key):
+        """URI of the version best matching key via method.
+
+        Uses position i, which is where key would be inserted in the
+        sorted_keys of the index, to select between the versions either side
+        including the original resource with original_key if not None.
+        """
+        # Find the versions before and at or after key
+        (prev_key, prev_uri) = (None, None)
+        if (i > 0):
+            (prev_key, prev_uri) = (index.sorted_keys[i - 1], index.uri_at(i - 1))
+        (next_key, next_uri) = (None, None)
+        if (i < len(index)):
+            (next_key, next_uri) = (index.sorted_keys[i], index.uri_at(i))
+        if (original_key is not None):
+            if (original_key >= key):
+                if (next_key is None or original_key <= next_key):
+                    (next_key, next_uri) = (original_key, self.original)
+            elif (prev_key is None or original_key >= prev_key):
+                (prev_key, prev_uri) = (original_key, self.original)
+        if (next_key is None):
+            # All version datetimes are before the requested datetime,
+            # return the lastest
+            return prev_uri
+        elif (next_key == key or prev_key is None):
+            return next_uri
+        # Have next_key > key > prev_key -- return prev or next version?
+        elif (method == self.CLOSEST):
+            return prev_uri if ((key - prev_key) < (next_key - key)) else next_uri
+        else:
+            return prev_uri
@@ -0,0 +1,188 @@
+"""ASGI and WSGI middleware for content negotiation.
+
+ASGINegotiationMiddleware wraps an ASGI application and
+WSGINegotiationMiddleware wraps a WSGI application. For each HTTP request
+they negotiate over the Accept headers with the ContentNegotiator for the
+request path, put the result in the ASGI scope or WSGI environ as
+'negotiator2.result', and add a Vary header to the response listing the
+headers that can change the result. For example:
+
+    cn = CompiledContentNegotiator(acceptable=[AcceptParameters(ContentType("text/html")),
+                                               AcceptParameters(ContentType("application/json"))])
+    app = ASGINegotiationMiddleware(app, cn)
+
+and then in the application:
+
+    accept_parameters = scope['negotiator2.result']
+
+Negotiators are created once and reused for every request, so should be
+CompiledContentNegotiator objects. The middleware remembers the results for
+up to MAX_RESULTS recent combinations of header values, so that a
+request with headers seen before costs a dictionary lookup on the raw
+header values, and header values are only decoded for negotiation.
+
+This module is not imported by the negotiator2 package, import it with
+"from negotiator2.middleware import ASGINegotiationMiddleware". The ASGI
+middleware uses async def, so the module, including the WSGI middleware,
+requires Python 3.5 or later. Its tests use asyncio.run() and are skipped
+before Python 3.7.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.WARN)
+
+# Key of the negotiation result in the ASGI scope or WSGI environ
+RESULT_KEY = 'negotiator2.result'
+
+# Number of results for different headers remembered by each middleware,
+# the remembered results are forgotten when this is reached
+MAX_RESULTS = 1024
+
+# Dimension of AcceptParameters and the header negotiated, in the order of
+# the arguments of ContentNegotiator.negotiate()
+_DIMENSION_HEADERS = (('content_type', 'Accept'), ('language', 'Accept-Language'),
+                      ('encoding', 'Accept-Encoding'), ('charset', 'Accept-Charset'),
+                      ('packaging', 'Accept-Packaging'))
+
+# Position in the arguments of negotiate() keyed by the lower case header
+# name as in an ASGI scope, and WSGI environ key for each argument
+_ASGI_HEADERS = dict((name.lower().encode('ascii'), n) for (n, (dimension, name)) in enumerate(_DIMENSION_HEADERS))
+_WSGI_HEADERS = tuple('HTTP_' + name.upper().replace('-', '_') for (dimension, name) in _DIMENSION_HEADERS)
+
+
+def vary_header(negotiator):
+    """Value for the Vary header of responses negotiated by negotiator, or None.
+
+    Lists the headers for the dimensions in which the acceptable
+    AcceptParameters of negotiator have more than one value, as only
+    those headers can change the result.
+    """
+    names = []
+    for (dimension, name) in _DIMENSION_HEADERS:
+        if (len(set(getattr(ap, dimension) for ap in negotiator.acceptable)) > 1):
+            names.append(name)
+    return ', '.join(names) if names else None
+
+
+def _negotiate(negotiator, headers):
+    """Result of negotiator for the list of negotiate() arguments headers.
+
+    Returns default_accept_parameters of negotiator if the headers cannot
+    be parsed.
+    """
+    try:
+        return negotiator.negotiate(*headers)
+    except Exception as e:
+        log.debug("negotiator2 middleware: Ignored: %s", e)
+        return negotiator.default_accept_parameters
+
+
+class _NegotiationMiddleware(object):
+    """Base for the middleware, selects the negotiator for each path."""
+
+    def __init__(self, app, negotiator=None, routes=None):
+        """Initialize middleware for application app.
+
+        negotiator is the ContentNegotiator used for requests, and routes
+        is an optional dictionary of ContentNegotiator for particular
+        paths, used instead of negotiator. Requests for other paths are
+        passed to app unchanged if negotiator is None.
+        """
+        self.app = app
+        self._results = {}
+        self._default = (negotiator, self._vary(negotiator))
+        self._routes = {}
+        if (routes is not None):
+            for (path, cn) in routes.items():
+                self._routes[path] = (cn, self._vary(cn))
+
+    def _vary(self, negotiator):
+        """Vary header value for negotiator in the form used by the middleware."""
+        return None if negotiator is None else vary_header(negotiator)
+
+
+class ASGINegotiationMiddleware(_NegotiationMiddleware):
+    """ASGI middleware adding the negotiation result to the scope.
+
+    See module documentation. The scope passed to the application is a copy
+    with the result added as 'negotiator2.result', and the Vary header is
+    added to the http.response.start message. Connections other than HTTP
+    (e.g. websocket and lifespan) are passed through unchanged.
+    """
+
+    def _vary(self, negotiator):
+        """Vary header value for negotiator as bytes."""
+        vary = super(ASGINegotiationMiddleware, self)._vary(negotiator)
+        return None if vary is None else vary.encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        """Handle ASGI connection."""
+        if (scope['type'] != 'http'):
+            await self.app(scope, receive, send)
+            return
+        (negotiator, vary) = self._routes.get(scope['path'], self._default)
+        if (negotiator is None):
+            await self.app(scope, receive, send)
+            return
+        raw = [None, None, None, None, None]
+        for (name, value) in scope['headers']:
+            n = _ASGI_HEADERS.get(name)
+            if (n is not None):
+                # repeated headers are combined as a comma separated list
+                raw[n] = value if raw[n] is None else raw[n] + b', ' + value
+        key = (negotiator, raw[0], raw[1], raw[2], raw[3], raw[4])
+        result = self._results.get(key, self._results)
+        if (result is self._results):
+            # not seen before, decode the headers and negotiate
+            result = _negotiate(negotiator, [None if value is None else value.decode('latin-1') for value in raw])
+            if (len(self._results) >= MAX_RESULTS):
+                self._results.clear()
+            self._results[key] = result
+        scope = dict(scope)
+        scope[RESULT_KEY] = result
+        if (vary is not None):
+            send = self._send_with_vary(send, vary)
+        await self.app(scope, receive, send)
+
+    def _send_with_vary(self, send, vary):
+        """ASGI send callable adding header Vary: vary to send."""
+        async def send_with_vary(message):
+            if (message['type'] == 'http.response.start'):
+                message = dict(message)
+                message['headers'] = list(message.get('headers', ())) + [(b'vary', vary)]
+            await send(message)
+        return send_with_vary
+
+
+class WSGINegotiationMiddleware(_NegotiationMiddleware):
+    """WSGI middleware adding the negotiation result to the environ.
+
+    See module documentation. The result is added to the environ as
+    'negotiator2.result', and the Vary header is added to the headers
+    passed to start_response.
+    """
+
+    def __call__(self, environ, start_response):
+        """Handle WSGI request, returns the response from the application."""
+        (negotiator, vary) = self._routes.get(environ.get('PATH_INFO', ''), self._default)
+        if (negotiator is None):
+            return self.app(environ, start_response)
+        headers = [environ.get(key) for key in _WSGI_HEADERS]
+        key = (negotiator, headers[0], headers[1], headers[2], headers[3], headers[4])
+        result = self._results.get(key, self._results)
+        if (result is self._results):
+            result = _negotiate(negotiator, headers)
+            if (len(self._results) >= MAX_RESULTS):
+                self._results.clear()
+            self._results[key] = result
+        environ[RESULT_KEY] = result
+        if (vary is not None):
+            start_response = self._start_response_with_vary(start_response, vary)
+        return self.app(environ, start_response)
+
+    def _start_response_with_vary(self, start_response, vary):
+        """WSGI start_response callable adding header Vary: vary to start_response."""
+        def start_response_with_vary(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [('Vary', vary)], exc_info)
+        return start_response_with_vary
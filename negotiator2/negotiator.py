@@ -8,13 +8,192 @@ decisions based on the HTTP accept headers."
 
 See README for more information.
 """
+from collections import deque
+import heapq
+import itertools
 import logging
+import pickle
+import re
+import time
+
+from .cache import LRUCache
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARN)
 
+# marker for a missing cache entry, as None is a valid negotiation result
+_MISSING = object()
+
+# Cache of analysed Accept and Accept-Language header strings shared by all
+# negotiators in the process. Keys are (header name, raw header string) and
+# values are the immutable analysed structures returned by the
+# ContentNegotiator._analyse_* methods. Use parse_cache.resize(n) to change
+# the size, or parse_cache.info() to see how effective it is
+parse_cache = LRUCache(1024)
+
+# Pool of shared ContentType and Language objects created when parsing headers,
+# so that the same media range or language tag in different headers is one
+# object. Keys are (class, attribute values...). Use intern_pool.info() to see
+# the hit and eviction counts, or intern_pool.resize(n) to change the size
+intern_pool = LRUCache(1024)
+
+# Names of the header arguments of ContentNegotiator.negotiate(), in order
+HEADER_ARGUMENTS = ('accept', 'accept_language', 'accept_encoding', 'accept_charset', 'accept_packaging')
+_HEADER_ARGUMENT_POSITIONS = dict((name, n) for (n, name) in enumerate(HEADER_ARGUMENTS))
+
+# Default limits on the work done by ContentNegotiator for one negotiation
+MAX_HEADER_LENGTH = 4096
+MAX_ENTRIES = 64
+MAX_COMBINATIONS = 4096
+LIMIT_ACTIONS = ('truncate', 'default')
+
+
+class _LimitExceeded(Exception):
+    """A negotiation limit was exceeded and limit_action is 'default'."""
+
+    pass
+
+
+# Clock used for the timings in NegotiationTrace
+_timer = getattr(time, 'perf_counter', time.time)
+
+# One element of an Accept style header (RFC 7231 sec 5.3) that may contain
+# quoted strings: a range, its parameters, and an optional weight followed
+# by accept extensions, then a comma or the end. Quoted strings are kept
+# whole so that commas and semicolons within them do not split the header.
+# Leading whitespace and commas are skipped, so empty list elements are
+# ignored. The pattern can always continue to the next comma, so every
+# string is matched as a sequence of elements and malformed parts end up in
+# the range, parameters or weight. Loops are unrolled to avoid backtracking
+_QUOTED = r'"[^"\\]*(?:\\[\s\S]?[^"\\]*)*"?'
+_PARAMETER = r'[^,;"]*(?:' + _QUOTED + r'[^,;"]*)*'
+_ELEMENT_RE = re.compile(
+    r'[\s,]*(?P<range>[^,;]*)'
+    r'(?P<params>(?:;(?!\s*[qQ]\s*=)' + _PARAMETER + r')*)'
+    r'(?:;\s*[qQ]\s*(?P<q>=[^,;]*)(?:;' + _PARAMETER + r')*)?'
+    r'(?:,|$)')
+_PARAMETER_RE = re.compile(r';\s*(' + _PARAMETER + r')')
+
+
+def tokenize_accept_header(header):
+    """List of (range, params, q, position) for each element of an Accept style header.
+
+    Works in a single pass over header. For each non-empty element, range is
+    the media range or language range, params is None or the parameters
+    before any weight without whitespace around the semicolons (e.g.
+    "level=1;charset=utf-8"), q is None or the weight as a float, and position
+    counts the elements from 1. Accept extensions after the weight are
+    ignored. Raises ValueError if a weight is not a number.
+
+    Headers without quoted strings, which is almost all of them, are split
+    with string methods, which is faster than the regular expression
+    needed to keep quoted strings whole. A list is returned rather than a
+    generator because the callers use every element and building the list
+    directly is faster.
+    """
+    if '"' in header:
+        return _tokenize_quoted(header)
+    return _tokenize(header)
+
+
+def _tokenize(header):
+    """Tokenize header which has no quoted strings."""
+    tokens = []
+    position = 0
+    for element in header.split(','):
+        (range, sep, params) = element.partition(';')
+        range = range.strip()
+        if not sep:
+            if range:
+                position += 1
+                tokens.append((range, None, None, position))
+            continue
+        position += 1
+        if not range:
+            continue
+        if params.startswith('q=') and ';' not in params:
+            # the usual case of just a weight
+            tokens.append((range, None, float(params[2:]), position))
+            continue
+        q = None
+        before = []
+        for param in params.split(';'):
+            (name, eq, value) = param.partition('=')
+            if eq and name.strip() in ('q', 'Q'):
+                q = float(value)
+                break
+            before.append(param.strip())
+        tokens.append((range, ';'.join(before) if before else None, q, position))
+    return tokens
+
+
+def _tokenize_quoted(header):
+    """Tokenize header which may have quoted strings."""
+    tokens = []
+    position = 0
+    for (range, params, q) in _ELEMENT_RE.findall(header):
+        range = range.rstrip()
+        if not range:
+            if params or q:
+                position += 1
+            continue
+        position += 1
+        if not params:
+            params = None
+        elif params.count(';') == 1:
+            params = params[1:].strip()
+        else:
+            params = ';'.join(p.rstrip() for p in _PARAMETER_RE.findall(params))
+        # findall gives '' for a missing weight, float() allows whitespace
+        tokens.append((range, params, float(q[1:]) if q else None, position))
+    return tokens
+
+
+# Set attribute on an immutable _ValueType during initialization
+_set = object.__setattr__
+
+
+class _ValueType(object):
+    """Base for immutable value types.
+
+    Subclasses define __slots__ for their attributes and in __init__ set
+    them, and _key to the tuple of the attribute values, with _set().
+    Equality and hashing are based on _key. Instances cannot be changed
+    after creation, and subclasses define __reduce__ so that they can be
+    pickled and copied.
+    """
+
+    __slots__ = ('_key', '_hash')
 
-class AcceptParameters(object):
+    def __eq__(self, other):
+        """Equality of attribute values, only defined for objects of the same class."""
+        if not isinstance(other, self.__class__):
+            return NotImplemented
+        return self._key == other._key
+
+    def __ne__(self, other):
+        """Inequality of attribute values, needed for Python 2."""
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        """Hash of attribute values, computed on first use."""
+        try:
+            return self._hash
+        except AttributeError:
+            _set(self, '_hash', hash(self._key))
+            return self._hash
+
+    def __setattr__(self, name, value):
+        """Prevent changes after creation."""
+        raise AttributeError(self.__class__.__name__ + " is immutable, cannot set " + name)
+
+    def __delattr__(self, name):
+        """Prevent changes after creation."""
+        raise AttributeError(self.__class__.__name__ + " is immutable, cannot delete " + name)
+
+
+class AcceptParameters(_ValueType):
     """AcceptParameters class.
 
     AcceptParameters represents all of the possible aspects of Content
@@ -41,15 +220,25 @@ class AcceptParameters(object):
     For example:
 
     ap = AcceptParameters(ContentType("text/html"), Language("en"))
+
+    AcceptParameters objects are immutable and hashable, and are equal if
+    all of their parameters are equal.
     """
 
+    __slots__ = ('content_type', 'language', 'encoding', 'charset', 'packaging')
+
     def __init__(self, content_type=None, language=None, encoding=None, charset=None, packaging=None):
         """Initialize AcceptParameters object."""
-        self.content_type = content_type
-        self.language = language
-        self.encoding = encoding
-        self.charset = charset
-        self.packaging = packaging
+        _set(self, 'content_type', content_type)
+        _set(self, 'language', language)
+        _set(self, 'encoding', encoding)
+        _set(self, 'charset', charset)
+        _set(self, 'packaging', packaging)
+        _set(self, '_key', (content_type, language, encoding, charset, packaging))
+
+    def __reduce__(self):
+        """Pickle as constructor arguments."""
+        return (self.__class__, self._key)
 
     def matches(self, other, ignore_language_variants=False, as_client=True, packaging_wildcard=False):
         """Match on accept parameters.
@@ -99,10 +288,6 @@ class AcceptParameters(object):
         mf = "(& " + params + ")"
         return mf
 
-    def __eq__(self, other):
-        """Equality test based on canonical string."""
-        return self.media_format() == other.media_format()
-
     def __str__(self):
         """Human readable string."""
         s = "AcceptParameters:: "
@@ -123,15 +308,19 @@ class AcceptParameters(object):
         return str(self)
 
 
-class Language(object):
+class Language(_ValueType):
     """Class to represent a language code as per the conneg spec.
 
     Languages can have a main language term and a language variant.
     For example:
         en  - English
         en-gb   - British English
+
+    Language objects are immutable and hashable.
     """
 
+    __slots__ = ('language', 'variant')
+
     def __init__(self, range=None, language=None, variant=None):
         """Initialize Language object.
 
@@ -144,10 +333,28 @@ class Language(object):
                 lang = Language(language="de")
         """
         if range is not None:
-            self.language, self.variant = self._from_range(range)
-        else:
-            self.language = language
-            self.variant = variant
+            language, variant = self._from_range(range)
+        _set(self, 'language', language)
+        _set(self, 'variant', variant)
+        _set(self, '_key', (language, variant))
+
+    @classmethod
+    def interned(cls, language=None, variant=None):
+        """Shared Language for language and variant from intern_pool.
+
+        Returns the same object for the same values while they remain in the
+        pool, rather than creating a new Language each time.
+        """
+        key = (cls, language, variant)
+        lang = intern_pool.get(key)
+        if lang is None:
+            lang = cls(language=language, variant=variant)
+            intern_pool.put(key, lang)
+        return lang
+
+    def __reduce__(self):
+        """Pickle as constructor arguments."""
+        return (self.__class__, (None, self.language, self.variant))
 
     def matches(self, other, ignore_language_variants=False, as_client=True):
         """Match on languages.
@@ -180,18 +387,15 @@ class Language(object):
         return l_match and v_match
 
     def _from_range(self, range):
-        """Parse the lang and variant from the supplied range."""
-        lang_parts = range.split("-")
+        """Parse the lang and variant from the supplied range.
+
+        The variant is everything after the first "-", so "en-gb-oed" is
+        language "en" with variant "gb-oed".
+        """
+        lang_parts = range.split("-", 1)
         if len(lang_parts) == 1:
             return lang_parts[0], None
-        elif len(lang_parts) == 2:
-            lang = lang_parts[0]
-            sublang = lang_parts[1]
-            return lang, sublang
-
-    def __eq__(self, other):
-        """Equality test based on string representations."""
-        return str(self) == str(other)
+        return lang_parts[0], lang_parts[1]
 
     def __str__(self):
         """Human readable string."""
@@ -205,13 +409,15 @@ class Language(object):
         return str(self)
 
 
-class ContentType(object):
+class ContentType(_ValueType):
     """ContentType class.
 
     Class to represent a content type (mimetype) requested through
-    content negotiation.
+    content negotiation. ContentType objects are immutable and hashable.
     """
 
+    __slots__ = ('type', 'subtype', 'params')
+
     def __init__(self, mimetype=None, type=None, subtype=None, params=None):
         """Initialize ContentType object.
 
@@ -232,29 +438,51 @@ class ContentType(object):
         So, for example:
         application/atom+xml;type=entry => type="application", subtype="atom+xml", params="type=entry"
         """
-        self.type = None
-        self.subtype = None
-        self.params = None
-
         if mimetype is not None:
-            self.from_mimetype(mimetype)
-        else:
-            self.type = type
-            self.subtype = subtype
-            self.params = params
+            (type, subtype, params) = self._parse_mimetype(mimetype)
+        _set(self, 'type', type)
+        _set(self, 'subtype', subtype)
+        _set(self, 'params', params)
+        _set(self, '_key', (type, subtype, params))
 
-    def from_mimetype(self, mimetype):
-        """Construct this object from the mimetype.
+    @classmethod
+    def from_mimetype(cls, mimetype):
+        """Construct a ContentType object from the mimetype.
 
         The mimetype is expected to be of the form
         <supertype>/<subtype>[;<params>]
         """
+        return cls(mimetype)
+
+    @classmethod
+    def interned(cls, type=None, subtype=None, params=None):
+        """Shared ContentType for type, subtype and params from intern_pool.
+
+        Returns the same object for the same values while they remain in the
+        pool, rather than creating a new ContentType each time.
+        """
+        key = (cls, type, subtype, params)
+        ct = intern_pool.get(key)
+        if ct is None:
+            ct = cls(type=type, subtype=subtype, params=params)
+            intern_pool.put(key, ct)
+        return ct
+
+    @staticmethod
+    def _parse_mimetype(mimetype):
+        """Tuple of (type, subtype, params) from the mimetype."""
+        (type, subtype, params) = (None, None, None)
         parts = mimetype.split(";")
         if len(parts) == 2:
-            self.type, self.subtype = parts[0].split("/", 1)
-            self.params = parts[1]
+            type, subtype = parts[0].split("/", 1)
+            params = parts[1]
         elif len(parts) == 1:
-            self.type, self.subtype = parts[0].split("/", 1)
+            type, subtype = parts[0].split("/", 1)
+        return (type, subtype, params)
+
+    def __reduce__(self):
+        """Pickle as constructor arguments."""
+        return (self.__class__, (None, self.type, self.subtype, self.params))
 
     def mimetype(self):
         """Turn the content type into its mimetype representation."""
@@ -292,10 +520,6 @@ class ContentType(object):
                   self.params == other.params)
         return tmatch and smatch and pmatch
 
-    def __eq__(self, other):
-        """Equality based on mimetype."""
-        return self.mimetype() == other.mimetype()
-
     def __str__(self):
         """Human readable string."""
         return self.mimetype()
@@ -308,6 +532,76 @@ class ContentType(object):
 # Main Content Negotiation Objects
 ##################################
 
+class NegotiationTrace(object):
+    """Record of how a negotiation result was reached.
+
+    Returned by ContentNegotiator.explain(), or negotiate(..., trace=True).
+    Instance data:
+        headers - dictionary of the header strings negotiated, keyed by the
+            argument names of negotiate()
+        analysed - dictionary of the analysed client preferences for each
+            dimension, keyed as in weights. Each is None or a tuple of
+            (q, values) in descending q. Empty if the defaults were used
+            because no headers were given
+        levels - list of (weighted q, combinations, positions) for each
+            level of client preference considered, in the order considered,
+            where positions are those in acceptable of the server variants
+            matching any of the combinations of AcceptParameters
+        tie_break - how the result was chosen: 'client' if one server
+            variant matched at the first level with any match, 'server' if
+            several did and the first in acceptable was taken, 'default' if
+            no headers were given, 'limit' if a limit was exceeded and
+            default_accept_parameters used, or None if there was no agreement
+        result - the AcceptParameters negotiated, or None
+        timings - dictionary of seconds spent in each phase: 'parse' for
+            analysing the headers (including parse cache lookups), 'combine'
+            for generating the levels of preference, 'match' for matching
+            them with acceptable, and 'total'
+    """
+
+    def __init__(self, headers=None):
+        """Initialize NegotiationTrace for dictionary headers."""
+        self.headers = headers if headers is not None else {}
+        self.analysed = {}
+        self.levels = []
+        self.tie_break = None
+        self.result = None
+        self.timings = {'parse': 0.0, 'combine': 0.0, 'match': 0.0, 'total': 0.0}
+
+    def as_dict(self):
+        """Dictionary of the trace using only strings, numbers, lists and dictionaries.
+
+        Suitable for serialization as JSON, e.g. to log sampled negotiations.
+        """
+        analysed = {}
+        for (dimension, levels) in self.analysed.items():
+            analysed[dimension] = None if levels is None else [[q, [str(v) for v in values]] for (q, values) in levels]
+        return {'headers': dict(self.headers),
+                'analysed': analysed,
+                'levels': [{'q': q, 'combinations': [str(c) for c in combinations], 'positions': list(positions)}
+                           for (q, combinations, positions) in self.levels],
+                'tie_break': self.tie_break,
+                'result': None if self.result is None else str(self.result),
+                'timings': dict(self.timings)}
+
+    def _timed(self, preferences):
+        """Generate from preferences adding the time taken to timings['combine']."""
+        preferences = iter(preferences)
+        while True:
+            start = _timer()
+            try:
+                level = next(preferences)
+            except StopIteration:
+                self.timings['combine'] += _timer() - start
+                return
+            self.timings['combine'] += _timer() - start
+            yield level
+
+    def __repr__(self):
+        """Representation of trace with result and number of levels considered."""
+        return "NegotiationTrace(result=%r, levels=%d, tie_break=%r)" % (self.result, len(self.levels), self.tie_break)
+
+
 class ContentNegotiator(object):
     """Class to manage content negotiation.
 
@@ -387,7 +681,9 @@ class ContentNegotiator(object):
     AcceptParameters:: Content Type: text/html;Language: de;
     """
 
-    def __init__(self, default_accept_parameters=None, acceptable=[], weights=None, ignore_language_variants=False):
+    def __init__(self, default_accept_parameters=None, acceptable=[], weights=None, ignore_language_variants=False,
+                 cache_size=0, engine='sets', max_header_length=MAX_HEADER_LENGTH, max_entries=MAX_ENTRIES,
+                 max_combinations=MAX_COMBINATIONS, limit_action='truncate'):
         """Initialize ContentNegotiator object.
 
         There are 4 parameters which must be set in order to start content negotiation
@@ -398,26 +694,168 @@ class ContentNegotiator(object):
         - weights - the relative weights to apply to the different accept headers
         - ignore_language_variants - whether the content negotiator should ignore language
             variants overall
+
+        and optionally
+        - cache_size - the number of negotiation results to remember, keyed on the raw
+            header strings, so that repeated requests skip parsing and matching. The
+            default of 0 disables the cache. See cache_info() and clear_cache()
+        - engine - how client preferences are matched with acceptable: 'sets' (the default)
+            indexes acceptable with sets of positions, 'bitmask' indexes with integer
+            bitmasks which is faster for large numbers of variants, and 'scan' checks
+            each of acceptable in turn. All give the same results
+
+        and to bound the work done for headers from broken or malicious clients
+        - max_header_length - the maximum length of each Accept style header string
+        - max_entries - the maximum number of ranges used from each Accept style header
+        - max_combinations - the maximum number of combinations of client preferences
+            (AcceptParameters) that are matched with acceptable
+        - limit_action - what to do when a limit is exceeded: 'truncate' (the default)
+            negotiates with the elements of the header before max_header_length, the
+            max_entries ranges with the highest q, and the first max_combinations
+            combinations in descending q. 'default' returns default_accept_parameters
+        Any limit may be None for no limit. See limit_info() for the number of times
+        each limit has been exceeded.
         """
+        self._cache = LRUCache(cache_size)
+        self._limit_counts = {'header_length': 0, 'entries': 0, 'combinations': 0}
+        self.max_header_length = max_header_length
+        self.max_entries = max_entries
+        self.max_combinations = max_combinations
+        self.limit_action = limit_action
+        self.engine = engine
         self.acceptable = acceptable
         self.default_accept_parameters = default_accept_parameters
         self.weights = weights if weights is not None else {'content_type': 1.0, 'language': 1.0, 'charset': 1.0, 'encoding': 1.0, 'packaging': 1.0}
         self.ignore_language_variants = ignore_language_variants
 
-        if ("content_type" not in self.weights):
-            self.weights["content_type"] = 1.0
-        if ("language" not in self.weights):
-            self.weights["language"] = 1.0
-        if ("charset" not in self.weights):
-            self.weights["charset"] = 1.0
-        if ("encoding" not in self.weights):
-            self.weights["encoding"] = 1.0
-        if ("packaging" not in self.weights):
-            self.weights["packaging"] = 1.0
+    # Changing any of the configuration invalidates cached negotiation results. Note
+    # that changes made in place, e.g. appending to acceptable or updating a value in
+    # weights, are not detected and require a call to clear_cache()
+
+    @property
+    def acceptable(self):
+        """List of AcceptParameters acceptable to the server, in order of preference."""
+        return self._acceptable
+
+    @acceptable.setter
+    def acceptable(self, acceptable):
+        self._acceptable = acceptable
+        self.clear_cache()
+
+    @property
+    def default_accept_parameters(self):
+        """AcceptParameters to use when no accept headers are given."""
+        return self._default_accept_parameters
+
+    @default_accept_parameters.setter
+    def default_accept_parameters(self, default_accept_parameters):
+        self._default_accept_parameters = default_accept_parameters
+        self.clear_cache()
+
+    @property
+    def weights(self):
+        """Dictionary of relative weights to apply to the different accept headers."""
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights):
+        if ("content_type" not in weights):
+            weights["content_type"] = 1.0
+        if ("language" not in weights):
+            weights["language"] = 1.0
+        if ("charset" not in weights):
+            weights["charset"] = 1.0
+        if ("encoding" not in weights):
+            weights["encoding"] = 1.0
+        if ("packaging" not in weights):
+            weights["packaging"] = 1.0
+        self._weights = weights
+        self.clear_cache()
+
+    @property
+    def engine(self):
+        """Name of the engine used to match client preferences with acceptable."""
+        return self._engine
+
+    @engine.setter
+    def engine(self, engine):
+        if (engine not in ENGINES):
+            raise ValueError("Unknown engine %r, must be one of %s" % (engine, ', '.join(sorted(ENGINES))))
+        self._engine = engine
+        self.clear_cache()
+
+    @property
+    def ignore_language_variants(self):
+        """Whether to ignore language variants in negotiation."""
+        return self._ignore_language_variants
+
+    @ignore_language_variants.setter
+    def ignore_language_variants(self, ignore_language_variants):
+        self._ignore_language_variants = ignore_language_variants
+        self.clear_cache()
+
+    @property
+    def max_header_length(self):
+        """Maximum length of each Accept style header string, or None."""
+        return self._max_header_length
+
+    @max_header_length.setter
+    def max_header_length(self, max_header_length):
+        self._max_header_length = max_header_length
+        self.clear_cache()
+
+    @property
+    def max_entries(self):
+        """Maximum number of ranges used from each Accept style header, or None."""
+        return self._max_entries
+
+    @max_entries.setter
+    def max_entries(self, max_entries):
+        self._max_entries = max_entries
+        self.clear_cache()
+
+    @property
+    def max_combinations(self):
+        """Maximum number of combinations of client preferences matched, or None."""
+        return self._max_combinations
+
+    @max_combinations.setter
+    def max_combinations(self, max_combinations):
+        self._max_combinations = max_combinations
+        self.clear_cache()
+
+    @property
+    def limit_action(self):
+        """What to do when a limit is exceeded, 'truncate' or 'default'."""
+        return self._limit_action
+
+    @limit_action.setter
+    def limit_action(self, limit_action):
+        if (limit_action not in LIMIT_ACTIONS):
+            raise ValueError("Unknown limit_action %r, must be one of %s" % (limit_action, ', '.join(LIMIT_ACTIONS)))
+        self._limit_action = limit_action
+        self.clear_cache()
+
+    def limit_info(self):
+        """Dictionary of the number of times each limit has been exceeded.
+
+        Keys are 'header_length', 'entries' and 'combinations'.
+        """
+        return dict(self._limit_counts)
+
+    def cache_info(self):
+        """Dictionary of size and hit, miss and eviction counts of the result cache."""
+        return self._cache.info()
+
+    def clear_cache(self):
+        """Discard all cached negotiation results and the match table."""
+        self._cache.clear()
+        self._index = None
+        self._offered_values = None
 
     def negotiate(self, accept=None, accept_language=None,
                   accept_encoding=None, accept_charset=None,
-                  accept_packaging=None):
+                  accept_packaging=None, trace=False):
         """Content negotiate over the supplied HTTP headers.
 
         Main method for carrying out content negotiation over the supplied
@@ -428,37 +866,302 @@ class ContentNegotiator(object):
 
         - accept - HTTP Header: Accept; for example "text/html;q=1.0, text/plain;q=0.4"
         - accept_language - HTTP Header: Accept-Language; for example "en, de;q=0.8"
-        - accept_encoding - HTTP Header: Accept-Encoding; not currently supported in negotiation
-        - accept_charset - HTTP Header: Accept-Charset; not currently supported in negotiation
+        - accept_encoding - HTTP Header: Accept-Encoding; for example "br, gzip;q=0.8"
+        - accept_charset - HTTP Header: Accept-Charset; for example "utf-8, iso-8859-1;q=0.5"
         - accept_packaging - HTTP Header: Accept-Packaging (from SWORD 2.0); a URI only, no q values
 
-        If verbose=True, then this will print to stdout
+        If the negotiator was created with a cache_size then the result is
+        remembered, and later calls with identical header strings return
+        the same result without parsing or matching. Results for headers
+        longer than max_header_length are not remembered.
+
+        If trace is True then the NegotiationTrace from explain() is
+        returned instead of the result.
         """
+        if trace:
+            return self.explain(accept, accept_language, accept_encoding, accept_charset, accept_packaging)
         if accept is None and accept_language is None and accept_encoding is None and accept_charset is None and accept_packaging is None:
             # if it is not available just return the defaults
             return self.default_accept_parameters
-        log.info("Accept: " + str(accept))
-        log.info("Accept-Language: " + str(accept_language))
-        log.info("Accept-Packaging: " + str(accept_packaging))
+        key = (accept, accept_language, accept_encoding, accept_charset, accept_packaging)
+        if self._cache.maxsize > 0:
+            accept_parameters = self._cache.get(key, _MISSING)
+            if accept_parameters is not _MISSING:
+                return accept_parameters
+        headers = key
+        if self._max_header_length is not None:
+            try:
+                headers = self._limit_header_length(key)
+            except _LimitExceeded:
+                return self.default_accept_parameters
+        accept_parameters = self._negotiate(*headers)
+        if self._cache.maxsize > 0 and headers is key:
+            # results for headers that are too long are not cached, so that
+            # they cannot fill the cache with long keys
+            self._cache.put(key, accept_parameters)
+        return accept_parameters
+
+    def explain(self, accept=None, accept_language=None,
+                accept_encoding=None, accept_charset=None,
+                accept_packaging=None):
+        """NegotiationTrace recording how negotiate() reaches its result for these headers.
+
+        Takes the same header arguments as negotiate(). The trace includes
+        the analysed headers, the levels of client preference considered and
+        the server variants matching at each, how the result was chosen, and
+        the time taken in each phase. The result cache is not used, so the
+        timings are for a full negotiation, but the parse cache is.
+        """
+        trace = NegotiationTrace(dict(zip(HEADER_ARGUMENTS, (accept, accept_language, accept_encoding,
+                                                             accept_charset, accept_packaging))))
+        start = _timer()
+        if accept is None and accept_language is None and accept_encoding is None and accept_charset is None and accept_packaging is None:
+            trace.result = self.default_accept_parameters
+            trace.tie_break = 'default'
+        else:
+            headers = (accept, accept_language, accept_encoding, accept_charset, accept_packaging)
+            try:
+                if self._max_header_length is not None:
+                    headers = self._limit_header_length(headers)
+            except _LimitExceeded:
+                trace.result = self.default_accept_parameters
+                trace.tie_break = 'limit'
+            else:
+                trace.result = self._negotiate(*headers, trace=trace)
+        trace.timings['total'] = _timer() - start
+        return trace
+
+    def negotiate_many(self, headers, processes=None, chunk_size=1000, cache_size=1024):
+        """Generate the negotiation result for each of an iterable of header dictionaries.
+
+        Each dictionary in headers gives the header strings for one
+        negotiation, keyed either by the argument names of negotiate()
+        (e.g. 'accept_language') or by the HTTP header names (e.g.
+        'Accept-Language', in any case). Other keys are ignored. The results
+        are generated in the order of headers, and headers is read lazily so
+        that long inputs such as log files need not be held in memory.
+
+        Identical sets of header strings are negotiated once, the results
+        for the last cache_size distinct sets are remembered for the
+        duration of the call.
+
+        If processes is greater than 1 then the negotiation is spread over a
+        concurrent.futures.ProcessPoolExecutor with that many workers, each
+        task being up to chunk_size sets of headers. At most two tasks per
+        worker are outstanding at any time. The negotiator must be picklable
+        to be sent to the workers. Where concurrent.futures is not available
+        (Python 2 without the futures package) the negotiation is done in
+        this process.
+        """
+        results = LRUCache(cache_size)
+        if (processes is not None and processes > 1):
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+            except ImportError:
+                log.debug("negotiate_many: concurrent.futures not available, not using processes")
+                processes = None
+        if (processes is None or processes <= 1):
+            for h in headers:
+                key = self._header_key(h)
+                accept_parameters = results.get(key, _MISSING)
+                if accept_parameters is _MISSING:
+                    accept_parameters = self.negotiate(*key)
+                    results.put(key, accept_parameters)
+                yield accept_parameters
+            return
+        headers = iter(headers)
+        pending = deque()
+        # the negotiator is sent with each task, pickled once here
+        pickled = pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            while True:
+                keys = [self._header_key(h) for h in itertools.islice(headers, chunk_size)]
+                if keys:
+                    # results already known, and the distinct keys to negotiate
+                    known = {}
+                    todo = []
+                    for key in keys:
+                        if key not in known:
+                            known[key] = results.get(key, _MISSING)
+                            if known[key] is _MISSING:
+                                todo.append(key)
+                    future = executor.submit(_negotiate_many_chunk, pickled, todo) if todo else None
+                    pending.append((keys, known, todo, future))
+                while pending and (not keys or len(pending) > 2 * processes):
+                    (chunk_keys, known, todo, future) = pending.popleft()
+                    if future is not None:
+                        for (key, position) in zip(todo, future.result()):
+                            known[key] = self._result_from_position(position)
+                            results.put(key, known[key])
+                    for key in chunk_keys:
+                        yield known[key]
+                if not keys:
+                    break
+
+    def _header_key(self, headers):
+        """Tuple of negotiate() arguments from dictionary headers."""
+        key = [None] * len(HEADER_ARGUMENTS)
+        for (name, value) in headers.items():
+            n = _HEADER_ARGUMENT_POSITIONS.get(name.lower().replace('-', '_'))
+            if n is not None:
+                key[n] = value
+        return tuple(key)
+
+    def _result_position(self, accept_parameters):
+        """Picklable reference to negotiation result accept_parameters.
+
+        The position in acceptable, -1 for default_accept_parameters or
+        None for no result. Used to return results from worker processes
+        as the same objects as held by this negotiator.
+        """
+        if accept_parameters is None:
+            return None
+        if accept_parameters is self.default_accept_parameters:
+            return -1
+        for (i, ap) in enumerate(self.acceptable):
+            if ap is accept_parameters:
+                return i
+        raise ValueError("Result is not in acceptable")
+
+    def _result_from_position(self, position):
+        """Negotiation result from reference made by _result_position()."""
+        if position is None:
+            return None
+        if position == -1:
+            return self.default_accept_parameters
+        return self.acceptable[position]
+
+    def _limit_exceeded(self, limit):
+        """Count that limit was exceeded, raise _LimitExceeded if limit_action is 'default'."""
+        self._limit_counts[limit] += 1
+        if log.isEnabledFor(logging.INFO):
+            log.info("Limit %s exceeded", limit)
+        if self._limit_action == 'default':
+            raise _LimitExceeded(limit)
+
+    def _limit_header_length(self, headers):
+        """Tuple of negotiate() arguments headers with Accept style headers within max_header_length.
+
+        A header that is too long is cut at the last comma before
+        max_header_length so that only whole elements are kept, followed by
+        any elements refused with q=0 from the part cut off, so that a limit
+        cannot make refused values acceptable. A header with no whole element
+        within max_header_length and no refusals is treated as missing. The
+        packaging header is a single URI and is not changed.
+        """
+        limit = self._max_header_length
+        (accept, accept_language, accept_encoding, accept_charset) = headers[:4]
+        if ((accept is None or len(accept) <= limit) and
+                (accept_language is None or len(accept_language) <= limit) and
+                (accept_encoding is None or len(accept_encoding) <= limit) and
+                (accept_charset is None or len(accept_charset) <= limit)):
+            return headers
+        self._limit_exceeded('header_length')
+        limited = []
+        for h in headers[:4]:
+            if h is not None and len(h) > limit:
+                cut = h.rfind(',', 0, limit + 1)
+                elements = [h[:cut]] if cut > 0 else []
+                for (range, params, q, position) in tokenize_accept_header(h[cut + 1:]):
+                    if q is not None and q <= 0.0:
+                        elements.append(range + (';' + params if params else '') + ';q=0')
+                h = ', '.join(elements) if elements else None
+            limited.append(h)
+        return tuple(limited) + headers[4:]
+
+    def _limit_entries(self, analysed):
+        """Analysed header analysed with at most max_entries values, keeping those with the highest q.
+
+        A last level with q 0.0 of values refused by the client is always
+        kept and is not counted, so that a limit cannot make refused values
+        acceptable.
+        """
+        limit = self._max_entries
+        if analysed is None or limit is None:
+            return analysed
+        refused = ()
+        if analysed and analysed[-1][0] <= 0.0:
+            refused = analysed[-1:]
+            analysed = analysed[:-1]
+        if sum(len(values) for (q, values) in analysed) <= limit:
+            return analysed + refused
+        self._limit_exceeded('entries')
+        limited = []
+        for (q, values) in analysed:
+            if limit <= 0:
+                break
+            limited.append((q, values[:limit]))
+            limit -= len(values)
+        return tuple(limited) + refused
+
+    def _negotiate(self, accept, accept_language, accept_encoding, accept_charset, accept_packaging,
+                   trace=None):
+        """Content negotiate over the supplied HTTP headers, without the cache.
+
+        If trace is a NegotiationTrace then the analysed headers, the levels
+        of preference considered and the phase timings are recorded in it.
+        Applies the max_entries and max_combinations limits, and returns
+        default_accept_parameters if one is exceeded and limit_action is
+        'default'.
+        """
+        try:
+            return self._negotiate_analysed(accept, accept_language, accept_encoding, accept_charset,
+                                            accept_packaging, trace)
+        except _LimitExceeded:
+            if trace is not None:
+                trace.tie_break = 'limit'
+            return self.default_accept_parameters
+
+    def _negotiate_analysed(self, accept, accept_language, accept_encoding, accept_charset, accept_packaging,
+                            trace):
+        """Analyse the headers and match, for _negotiate()."""
+        info = log.isEnabledFor(logging.INFO)
+        if info:
+            log.info("Accept: %s", accept)
+            log.info("Accept-Language: %s", accept_language)
+            log.info("Accept-Packaging: %s", accept_packaging)
 
         # get us back a dictionary keyed by q value which tells us the
         # order of preference that the client has requested
-        accept_analysed = self._analyse_accept(accept)
-        lang_analysed = self._analyse_language(accept_language)
-        encoding_analysed = self._analyse_encoding(accept_encoding)
-        charset_analysed = self._analyse_charset(accept_charset)
+        if trace is not None:
+            start = _timer()
+        accept_analysed = self._limit_entries(self._analyse_accept(accept))
+        lang_analysed = self._limit_entries(self._analyse_language(accept_language))
+        encoding_analysed = self._limit_entries(self._analyse_encoding(accept_encoding))
+        charset_analysed = self._limit_entries(self._analyse_charset(accept_charset))
         packaging_analysed = self._analyse_packaging(accept_packaging)
-        log.info("Accept Analysed: " + str(accept_analysed))
-        log.info("Language Analysed: " + str(lang_analysed))
-        log.info("Packaging Analysed: " + str(packaging_analysed))
+        if info:
+            log.info("Accept Analysed: %s", accept_analysed)
+            log.info("Language Analysed: %s", lang_analysed)
+            log.info("Packaging Analysed: %s", packaging_analysed)
+        if trace is not None:
+            trace.timings['parse'] = _timer() - start
+            trace.analysed = {'content_type': accept_analysed, 'language': lang_analysed,
+                              'encoding': encoding_analysed, 'charset': charset_analysed,
+                              'packaging': packaging_analysed}
+
+        if (accept_analysed is None and lang_analysed is None and encoding_analysed is None and
+                charset_analysed is None and packaging_analysed is None):
+            # only headers for encodings or charsets that the server does not offer were given, these are
+            # ignored so the result is as for no headers
+            if trace is not None:
+                trace.tie_break = 'default'
+            return self.default_accept_parameters
 
-        # now combine these results into one list of preferred accepts
-        preferences = self._list_acceptable(self.weights, accept_analysed, lang_analysed, encoding_analysed, charset_analysed, packaging_analysed)
-        log.info("Preference List: " + str(preferences))
+        # now combine these results into a sequence of preferred accepts, generated lazily
+        # with the highest weighted q first
+        preferences = self._list_acceptable(self._weights, accept_analysed, lang_analysed, encoding_analysed, charset_analysed, packaging_analysed)
 
         # go through the analysed formats and cross reference them with the acceptable formats
-        accept_parameters = self._get_acceptable(preferences, self.acceptable)
-        log.info("Acceptable: " + str(accept_parameters))
+        if trace is not None:
+            preferences = trace._timed(preferences)
+            start = _timer()
+        refused = self._refused(accept_analysed, lang_analysed)
+        accept_parameters = self._get_acceptable(preferences, self.acceptable, trace, refused)
+        if trace is not None:
+            trace.timings['match'] = _timer() - start - trace.timings['combine']
+        if info:
+            log.info("Acceptable: %s", accept_parameters)
 
         # return the acceptable type.  If this is None (which get_acceptable can return), then the caller
         # will know that we failed to negotiate a type and should 415 the client
@@ -466,125 +1169,357 @@ class ContentNegotiator(object):
 
     def _list_acceptable(self, weights, content_types=None, languages=None,
                          encodings=None, charsets=None, packaging=None):
-        log.debug("Relative weights: " + str(weights))
-        if content_types is None:
-            content_types = {0.0: [None]}
-        if languages is None:
-            languages = {0.0: [None]}
-        if encodings is None:
-            encodings = {0.0: [None]}
-        if charsets is None:
-            charsets = {0.0: [None]}
-        if packaging is None:
-            packaging = {0.0: [None]}
-        log.debug("Matrix of options:")
-        log.debug("Content Types: " + str(content_types))
-        log.debug("Languages: " + str(languages))
-        log.debug("Encodings: " + str(encodings))
-        log.debug("Charsets: " + str(charsets))
-        log.debug("Packaging: " + str(packaging))
-        unsorted = []
-        # create an accept_parameter for each first precedence field
-        # FIXME: this is hideous, but recursive programming is making my head
-        # hurt so screw it.
-        for q1, vals1 in content_types.items():
-            for v1 in vals1:
-                for q2, vals2 in languages.items():
-                    for v2 in vals2:
-                        for q3, vals3 in encodings.items():
-                            for v3 in vals3:
-                                for q4, vals4 in charsets.items():
-                                    for v4 in vals4:
-                                        for q5, vals5 in packaging.items():
-                                            wq = ((weights['content_type'] * q1) + (weights['language'] * q2) +
-                                                  (weights['encoding'] * q3) + (weights['charset'] * q4) +
-                                                  (weights['packaging'] * q5))
-                                            for v5 in vals5:
-                                                ap = AcceptParameters(v1, v2, v3, v4, v5)
-                                                unsorted.append((ap, wq))
-        sorted = self._sort_by_q(unsorted, 0.0)
-        return sorted
+        """Generate combinations of client preferences in descending weighted q.
+
+        Each of content_types, languages, encodings, charsets and packaging is
+        either None or a sequence of (q, values) tuples, as returned by the
+        _analyse_* methods. Yields (wq, [AcceptParameters, ...]) tuples
+        where wq is the weighted sum of the q values of the combination, in
+        descending order of wq and grouping all combinations with the same wq.
+
+        Rather than building every combination up front, the combinations of
+        q levels are enumerated best-first with a heap over the per-dimension
+        lists sorted by weighted q. The consumer can stop as soon as a level
+        gives a match, so the unused combinations are never created.
+        Combinations with a weighted q of zero or less are not acceptable and
+        are not generated, nor are the values of a last level with q 0.0
+        which lists refused values. At most max_combinations AcceptParameters are
+        generated.
+        """
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Relative weights: %s", weights)
+            log.debug("Matrix of options:")
+            log.debug("Content Types: %s", content_types)
+            log.debug("Languages: %s", languages)
+            log.debug("Encodings: %s", encodings)
+            log.debug("Charsets: %s", charsets)
+            log.debug("Packaging: %s", packaging)
+        # for each dimension make a list of (weighted q, values) sorted with
+        # the highest weighted q first
+        dimensions = []
+        for (name, prefs) in (('content_type', content_types), ('language', languages),
+                              ('encoding', encodings), ('charset', charsets),
+                              ('packaging', packaging)):
+            if prefs is None:
+                prefs = ((0.0, (None,)),)
+            elif prefs and prefs[-1][0] <= 0.0:
+                # values refused with q=0 are excluded when matching
+                prefs = prefs[:-1]
+            w = weights[name]
+            if not prefs:
+                # nothing acceptable in this dimension (e.g. all q=0)
+                return
+            dimensions.append(sorted([(w * q, vals) for (q, vals) in prefs],
+                                     key=lambda wv: wv[0], reverse=True))
+        # best-first enumeration of the combinations of levels. Each entry in
+        # the heap is (-wq, levels) where levels is a tuple of the index into
+        # each dimension. The successors of a combination differ by moving one
+        # dimension to its next lower level and so never have a higher wq
+        start = (0,) * len(dimensions)
+        heap = [(-self._weighted_q(dimensions, start), start)]
+        seen = set([start])
+        limit = self._max_combinations
+        count = 0
+        while heap:
+            wq = -heap[0][0]
+            if wq <= 0.0:
+                return
+            combinations = []
+            # collect all combinations of levels at this wq, pushing successors
+            # before checking the top of the heap so that successors with the
+            # same wq are included in this group
+            while heap and -heap[0][0] == wq:
+                levels = heapq.heappop(heap)[1]
+                combinations.append(levels)
+                for d in range(len(levels)):
+                    if levels[d] + 1 < len(dimensions[d]):
+                        successor = levels[:d] + (levels[d] + 1,) + levels[d + 1:]
+                        if successor not in seen:
+                            seen.add(successor)
+                            heapq.heappush(heap, (-self._weighted_q(dimensions, successor), successor))
+            possibilities = []
+            for levels in combinations:
+                for (v1, v2, v3, v4, v5) in itertools.product(*[dimensions[d][l][1] for (d, l) in enumerate(levels)]):
+                    if count == limit:
+                        self._limit_exceeded('combinations')
+                        if possibilities:
+                            yield (wq, possibilities)
+                        return
+                    count += 1
+                    possibilities.append(AcceptParameters(v1, v2, v3, v4, v5))
+            yield (wq, possibilities)
+
+    def _refused(self, accept_analysed, lang_analysed):
+        """Tuple of (content types, languages) refused with q=0 in analysed headers, or None if there are none."""
+        refused = []
+        for analysed in (accept_analysed, lang_analysed):
+            if analysed and analysed[-1][0] <= 0.0:
+                refused.append(analysed[-1][1])
+            else:
+                refused.append(())
+        return tuple(refused) if refused[0] or refused[1] else None
+
+    def _weighted_q(self, dimensions, levels):
+        """Weighted q for the combination of levels across dimensions."""
+        wq = 0.0
+        for (d, l) in enumerate(levels):
+            wq += dimensions[d][l][0]
+        return wq
 
     def _analyse_packaging(self, accept):
         if accept is None:
             return None
         # if the header is not none, then it should be a straightforward
         # uri, with no q value, so our return is simple:
-        return {1.0: [accept]}
+        return ((1.0, (accept,)),)
 
     def _analyse_encoding(self, accept):
-        return None
+        """Analyse the Accept-Encoding header string from the HTTP headers.
+
+        Return a tuple of (q, (encoding, ...)) in the same form as
+        _analyse_accept(), where the encodings are those of the server
+        variants in acceptable that the header accepts. A server encoding of
+        None is the identity encoding, which is acceptable at a q lower than
+        any other unless it is refused with identity;q=0, or *;q=0 without
+        identity. Returns None, so that the header is ignored, if the server
+        offers no encodings and the header does not refuse identity.
+        """
+        if accept is None:
+            return None
+        offered = self._offered()
+        levels = offered.encoding_table.get(accept)
+        if levels is None:
+            key = ('accept-encoding', accept)
+            parsed = parse_cache.get(key)
+            if parsed is None:
+                parsed = self._parse_codings(accept)
+                parse_cache.put(key, parsed)
+            levels = self._offered_levels(parsed, offered.encodings, offered.encoding_names, 'identity')
+            if len(offered.encoding_table) < offered.table_size:
+                offered.encoding_table[accept] = levels
+        if levels and offered.encodings == (None,):
+            return None
+        return levels
 
     def _analyse_charset(self, accept):
-        return None
+        """Analyse the Accept-Charset header string from the HTTP headers.
+
+        Return a tuple of (q, (charset, ...)) in the same form as
+        _analyse_encoding() for the charsets of the server variants. A
+        server charset of None means that a charset does not apply to the
+        variant, which is acceptable at the highest q of the header. Returns
+        None, so that the header is ignored, if the server offers no
+        charsets.
+        """
+        if accept is None:
+            return None
+        offered = self._offered()
+        if offered.charsets == (None,):
+            return None
+        levels = offered.charset_table.get(accept)
+        if levels is None:
+            key = ('accept-charset', accept)
+            parsed = parse_cache.get(key)
+            if parsed is None:
+                parsed = self._parse_codings(accept)
+                parse_cache.put(key, parsed)
+            levels = self._offered_levels(parsed, offered.charsets, offered.charset_names, None)
+            if len(offered.charset_table) < offered.table_size:
+                offered.charset_table[accept] = levels
+        return levels
+
+    def _parse_codings(self, accept):
+        """Parse Accept-Encoding or Accept-Charset header string accept.
+
+        Returns (levels, star_q, named) where levels is a tuple of (q,
+        (name, ...)) for the lower case names with q greater than 0, highest
+        q first, star_q is the q of "*" or None if it is not given, and named
+        is a frozenset of all names given including those with q=0. Names
+        without a q value have q=1.0 as, unlike media ranges, their order
+        does not express a preference.
+        """
+        levels = {}
+        star_q = None
+        named = set()
+        for (range, params, q, position) in tokenize_accept_header(accept):
+            name = range.lower()
+            if q is None:
+                q = 1.0
+            if name == "*":
+                star_q = q
+                continue
+            named.add(name)
+            if q > 0.0:
+                self.insert(levels, q, name)
+        return (self._levels(levels), star_q, frozenset(named))
+
+    def _offered(self):
+        """_OfferedCodings for acceptable, rebuilt if acceptable has changed.
+
+        As for _variant_index(), the memoized levels for each header are
+        kept between negotiations and changes made in place to acceptable
+        are picked up.
+        """
+        acceptable = tuple(self.acceptable)
+        offered = self._offered_values
+        if offered is None or offered.acceptable != acceptable:
+            offered = _OfferedCodings(acceptable)
+            self._offered_values = offered
+        return offered
+
+    def _offered_levels(self, parsed, values, by_name, none_name):
+        """Levels of server values accepted by header parsed with _parse_codings().
+
+        by_name is a dictionary of the lists of values for each lower case
+        name, from _OfferedCodings. Names are compared with the server
+        values without regard to case, and "*" matches the values not named
+        in the header. A value of None is matched by none_name, or if
+        none_name is None it is always acceptable at the highest q.
+        """
+        (levels, star_q, named) = parsed
+        offered = {}
+        for (q, names) in levels:
+            for name in names:
+                for value in by_name.get(name, ()):
+                    self.insert(offered, q, value)
+        if star_q is not None and star_q > 0.0:
+            for (name, name_values) in by_name.items():
+                if name not in named:
+                    for value in name_values:
+                        self.insert(offered, star_q, value)
+        if none_name is None:
+            if None in values:
+                self.insert(offered, levels[0][0] if levels else 1.0, None)
+        elif none_name not in named and star_q is None:
+            # implicitly acceptable, but less preferred than any named
+            for value in by_name.get(none_name, ()):
+                self.insert(offered, levels[-1][0] / 2.0 if levels else 1.0, value)
+        return self._levels(offered)
 
     def _analyse_language(self, accept):
+        """Analyse the Accept-Language header string from the HTTP headers.
+
+        Return a tuple of (q, (<Language>, ...)) in the same form as
+        _analyse_accept(). Results are shared through parse_cache.
+        """
         if accept is None:
             return None
-        parts = self._split_accept_header(accept)
+        key = ('accept-language', accept)
+        analysed = parse_cache.get(key)
+        if analysed is None:
+            analysed = self._parse_language(accept)
+            parse_cache.put(key, analysed)
+        return analysed
+
+    def _parse_language(self, accept):
         highest_q = 0.0
-        counter = 0
         unsorted = []
-        for part in parts:
-            counter += 1
-            lang, sublang, q = self._interpret_accept_language_field(part, -1 * counter)
-            if q > highest_q:
+        refused = []
+        for (range, params, q, position) in tokenize_accept_header(accept):
+            # parameters are not defined for language ranges and are ignored
+            # the range can be a language, or a language-sublanguage
+            # pair (like en, or en-gb)
+            lang_parts = range.split("-", 1)
+            sublang = lang_parts[1] if len(lang_parts) == 2 else None
+            language = Language.interned(lang_parts[0], sublang)
+            if q is None:
+                q = -1.0 * position
+            elif q <= 0.0:
+                # q=0 means not acceptable, the range is kept to exclude
+                # the languages it matches from less specific ranges
+                refused.append(language)
+                continue
+            elif q > highest_q:
                 highest_q = q
-            unsorted.append((Language(language=lang, variant=sublang), q))
+            unsorted.append((language, q))
         sorted = self._sort_by_q(unsorted, highest_q)
 
-        # now we have a dictionary keyed by q value which we can return
-        return sorted
+        # now we have a dictionary keyed by q value which we return as levels
+        return self._levels(sorted, refused)
 
     def _analyse_accept(self, accept):
         """Analyse the Accept header string from the HTTP headers.
 
-        Return a structured dictionary with each content types grouped
-        by their common q values, thus:
+        Return a structured tuple with each content types grouped
+        by their common q values, highest q first, thus:
 
-        dict = {
-            1.0 : [<ContentType>, <ContentType>],
-            0.8 : [<ContentType],
-            0.5 : [<ContentType>, <ContentType>]
-        }
+        (
+            (1.0, (<ContentType>, <ContentType>)),
+            (0.8, (<ContentType>,)),
+            (0.5, (<ContentType>, <ContentType>))
+        )
 
         This method will guarantee that every content type has some q value associated with it, even if this was not
         supplied in the original Accept header; it will be inferred based on the rules of content negotiation
+
+        The same header string is often seen many times and by different negotiators, so the analysis is
+        remembered in the module level parse_cache. The result is a tuple so that it can be shared safely
         """
         if accept is None:
             return None
-
-        # the accept header is a list of content types and q values, in a comma separated list
-        parts = self._split_accept_header(accept)
-
-        # set up some registries for the coming analysis.  unsorted will hold each part of the accept header following
-        # its analysis, but without respect to its position in the preferences list.  highest_q and counter will be
-        # recorded during this first run so that we can use them to sort the list later
-        unsorted = []
+        key = ('accept', accept)
+        analysed = parse_cache.get(key)
+        if analysed is None:
+            analysed = self._parse_accept(accept)
+            parse_cache.put(key, analysed)
+        return analysed
+
+    def _parse_accept(self, accept):
+        # the accept header is a list of media ranges, each with optional parameters and q value, in a comma
+        # separated list. Set up some registries for the coming analysis.  by_q will hold the content types with an
+        # explicit q value keyed by q, and implicit those without one along with their position in the list.
+        # highest_q will be recorded during this first run so that we can place the implicit ones above it later
+        by_q = {}
+        implicit = []
+        refused = []
         highest_q = 0.0
-        counter = 0
+        interned = ContentType.interned
 
         # go through each possible content type and analyse it along with its q value
-        for part in parts:
-            # count the part number that we are working on, starting from 1
-            counter += 1
-            type, params, q = self._interpret_accept_field(part, -1 * counter)
-            supertype, subtype = type.split("/", 1)
-            if q > highest_q:
-                highest_q = q
+        for (range, params, q, position) in tokenize_accept_header(accept):
+            (supertype, slash, subtype) = range.partition("/")
+            if not slash:
+                raise ValueError("Bad media range %s in Accept header" % (range))
+            content_type = interned(supertype, subtype, params)
+            if q is None:
+                # if there is no q we record the position in the list of this part. This allows us to later see
+                # the order in which the parts with no q value were listed, which is important
+                implicit.append((content_type, position))
+            elif q <= 0.0:
+                # q=0 means not acceptable, the range is kept to exclude the content types it matches from less
+                # specific ranges, so that "text/html;q=0, */*" accepts anything but text/html
+                refused.append(content_type)
+            else:
+                if q > highest_q:
+                    highest_q = q
+                if q in by_q:
+                    by_q[q].append(content_type)
+                else:
+                    by_q[q] = [content_type]
+
+        # once we've finished the analysis we know the highest explicitly requested q. The content types without
+        # a q value go in the gap between it and 1.0, each at the fraction 1/position of the gap above it, as in
+        # _sort_by_q(). Note that the gap may be 0.0
+        for (content_type, position) in implicit:
+            q = highest_q + (1.0 - highest_q) * (1.0 / position)
+            if q in by_q:
+                by_q[q].append(content_type)
+            else:
+                by_q[q] = [content_type]
 
-            # at the end of the analysis we have all of the components with or without their default values, so we
-            # just record the analysed version for the time being as a tuple in the unsorted array
-            unsorted.append((ContentType(type=supertype, subtype=subtype, params=params), q))
+        # now we have a dictionary keyed by q value which we return as levels
+        return self._levels(by_q, refused)
 
-        # once we've finished the analysis we'll know what the highest explicitly requested q will be.  This may leave
-        # us with a gap between 1.0 and the highest requested q, into which we will want to put the content types which
-        # did not have explicitly assigned q values.  Here we calculate the size of that gap, so that we can use it
-        # later on in positioning those elements.  Note that the gap may be 0.0.
-        sorted = self._sort_by_q(unsorted, highest_q)
+    def _levels(self, d, refused=None):
+        """Tuple of (q, tuple of values) from dict d keyed by q, highest q first.
 
-        # now we have a dictionary keyed by q value which we can return
-        return sorted
+        If refused is a non-empty list of values given with q=0 they are
+        added as a last level with q 0.0.
+        """
+        levels = tuple((q, tuple(d[q])) for q in sorted(d.keys(), reverse=True))
+        if refused:
+            levels += ((0.0, tuple(refused)),)
+        return levels
 
     def _sort_by_q(self, unsorted, q_max):
         # set up a dictionary to hold our sorted results. The dictionary
@@ -608,57 +1543,6 @@ class ContentNegotiator(object):
         # now we have a dictionary keyed by q value which we can return
         return sorted
 
-    def _split_accept_header(self, accept):
-        return [a.strip() for a in accept.split(",")]
-
-    def _interpret_accept_language_field(self, accept, default_q):
-        components = accept.split(";")
-        lang = None
-        sublang = None
-        q = default_q
-        # the first part can be a language, or a language-sublanguage
-        # pair (like en, or en-gb)
-        langs = components[0].strip()
-        lang_parts = langs.split("-")
-        if len(lang_parts) == 1:
-            lang = lang_parts[0]
-        elif len(lang_parts) == 2:
-            lang = lang_parts[0]
-            sublang = lang_parts[1]
-        if len(components) == 2:
-
-            q = components[1].strip()[2:]  # strip the "q=" from the start of the q value
-        return (lang, sublang, float(q))
-
-    def _interpret_accept_field(self, accept, default_q):
-        # the components of the part can be "type;params;q" "type;params",
-        # "type;q" or just "type"
-        components = accept.split(";")
-        # the first part is always the type (see above comment)
-        type = components[0].strip()
-        # create some default values for the other parts.  If there is no params, we will use None, if there is
-        # no q we will use a negative number multiplied by the position in the list of this part.  This allows us
-        # to later see the order in which the parts with no q value were listed, which is important
-        params = None
-        q = default_q
-        # There are then 3 possibilities remaining to check for: "type;q",
-        # "type;params" and "type;params;q" ("type" is already handled by
-        # the default cases set up above)
-        if len(components) == 2:
-            # "type;q" or "type;params"
-            if components[1].strip().startswith("q="):
-                # "type;q"
-                q = components[1].strip()[2:]  # strip the "q=" from the start of the q value
-            else:
-                # "type;params"
-                params = components[1].strip()
-        elif len(components) == 3:
-            # "type;params;q"
-            params = components[1].strip()
-            q = components[1].strip()[2:]  # strip the "q=" from the start of the q value
-
-        return (type, params, float(q))
-
     def insert(self, d, q, v):
         """Insert v with q value into dict d.
 
@@ -678,15 +1562,78 @@ class ContentNegotiator(object):
         - target:   A list of AcceptParameters objects to try to match the source against
         Returns the matching AcceptParameters from the target list, or None if no such match
         """
-        for ap in target:
-            if source.matches(ap, ignore_language_variants=self.ignore_language_variants):
-                # matches are symmetrical, so source.matches(ap) == ap.matches(source) so way round is irrelevant
-                # we return the target's content type, as this is considered the definitive list of allowed
-                # content types, while the source may contain wildcards
-                return ap
-        return None
+        i = self._match_position(source, target)
+        return None if i is None else target[i]
+
+    def _variant_index(self):
+        """_VariantIndex over acceptable, rebuilt if acceptable has changed.
+
+        The index holds the memoized table of server variants matching each
+        client media range and language range seen, so is kept between
+        negotiations. Comparing with the indexed copy of acceptable is a
+        quick identity check of each item, and means that changes made in
+        place to acceptable are picked up.
+        """
+        acceptable = tuple(self.acceptable)
+        index = self._index
+        if index is None or index.acceptable != acceptable:
+            index = ENGINES[self.engine](acceptable, self.ignore_language_variants)
+            self._index = index
+        return index
+
+    def _match_position(self, source, target, refused=None):
+        """Position of the first AcceptParameters in target matching source, or None."""
+        return self._match_function(target, refused)(source)
+
+    def _match_function(self, target, refused=None):
+        """Function giving the position of the first AcceptParameters in target matching its argument, or None.
+
+        Uses the index when target is the acceptable list. The index is
+        looked up once here, so the function is used to match every client
+        preference in a negotiation without checking acceptable for changes
+        each time.
+
+        If refused is a tuple of (content types, languages) refused by the
+        client with q=0 then AcceptParameters matching a refused range are
+        not matched by a less specific client range, see _is_refused().
+        """
+        if target is self.acceptable and ENGINES[self._engine] is not None:
+            index = self._variant_index()
+            if refused is None:
+                return index.match_position
+            return lambda source: index.match_position_refused(source, refused[0], refused[1])
+        ignore_language_variants = self.ignore_language_variants
+
+        def match_position(source):
+            for i, ap in enumerate(target):
+                if (source.matches(ap, ignore_language_variants=ignore_language_variants) and
+                        (refused is None or not self._is_refused(source, ap, refused))):
+                    # matches are symmetrical, so source.matches(ap) == ap.matches(source) so way round is irrelevant
+                    # we return the target's position, as the target is considered the definitive list of allowed
+                    # content types, while the source may contain wildcards
+                    return i
+            return None
+        return match_position
 
-    def _get_acceptable(self, client, server):
+    def _is_refused(self, source, ap, refused):
+        """Whether server AcceptParameters ap is refused for client AcceptParameters source.
+
+        It is if it matches a content type or language in refused that is
+        at least as specific as that of source. For example text/html;q=0
+        refuses text/html for */* and text/*, but *;q=0 does not refuse en
+        for en.
+        """
+        (content_types, languages) = refused
+        for ct in content_types:
+            if _specificity(ct) >= _specificity(source.content_type) and ct.matches(ap.content_type):
+                return True
+        for lang in languages:
+            if (_specificity(lang) >= _specificity(source.language) and
+                    lang.matches(ap.language, self.ignore_language_variants)):
+                return True
+        return False
+
+    def _get_acceptable(self, client, server, trace=None, refused=None):
         """Work out most acceptable format for client and server.
 
         Take the client content negotiation requirements and the server's
@@ -697,54 +1644,388 @@ class ContentNegotiator(object):
         q value) then the server's preference is taken into account.
 
         Returns an AcceptParameters object represening the mutually acceptable content type, or None if no agreement could
-        be reached.
+        be reached. If trace is a NegotiationTrace then each level of client preference considered is recorded in it.
+        Server variants refused by the client with q=0 are excluded as described in _match_function().
         """
-        log.info("Client: " + str(client))
-        log.info("Server: " + str(server))
-
-        # get the client requirement keys sorted with the highest q first (the server is a list which should be
-        # in order of preference already)
-        ckeys = sorted(client.keys(), reverse=True)
+        info = log.isEnabledFor(logging.INFO)
+        if info:
+            log.info("Server: %s", server)
+        match_position = self._match_function(server, refused)
 
         # the rule for determining what to return is that "the client's preference always wins", so we look for the
         # highest q ranked item that the server is capable of returning.  We only take into account the server's
         # preference when the client has two equally weighted preferences - in that case we take the server's
         # preferred content type
-        for q in ckeys:
-            # for each q in order starting at the highest
-            possibilities = client[q]
+        for (q, possibilities) in client:
+            # for each q in order starting at the highest (client is a sequence of (q, [AcceptParameters, ...])
+            # in descending order of q as generated by _list_acceptable())
+            if info:
+                log.info("Client: %s:%s", q, possibilities)
             allowable = []
             for p in possibilities:
                 # for each accept parameter with the same q value
 
                 # find out if the possibility p matches anything in the server.  This uses the AcceptParameter's
                 # matches() method which will take into account wildcards, so content types like */* will match
-                # appropriately.  We get back from this the concrete AcceptParameter as specified by the server
-                # if there is a match, so we know the result contains no unintentional wildcards
-                match = self._contains_match(p, server)
-                if match is not None:
+                # appropriately.  We get back from this the position of the concrete AcceptParameter as specified
+                # by the server if there is a match, so we know the result contains no unintentional wildcards
+                i = match_position(p)
+                if i is not None:
                     # if there is a match, register it
-                    allowable.append(match)
+                    allowable.append(i)
 
-            log.info("Allowable: " + str(q) + ":" + str(allowable))
+            if info:
+                log.info("Allowable: %s:%s", q, [server[i] for i in allowable])
+            if trace is not None:
+                trace.levels.append((q, tuple(possibilities), tuple(allowable)))
 
             # we now know if there are 0, 1 or many allowable content types at this q value
             if len(allowable) == 0:
                 # we didn't find anything, so keep looking at the next q value
                 continue
-            elif len(allowable) == 1:
-                # we found exactly one match, so this is our content type to use
-                return allowable[0]
-            else:
-                # we found multiple supported content types at this q value, so now we need to choose the server's
-                # preference
-                for i in range(len(server)):
-                    # iterate through the server explicitly by numerical position
-                    if server[i] in allowable:
-                        # when we find our first content type in the allowable list, it is the highest ranked server content
-                        # type that is allowable, so this is our type
-                        return server[i]
+            # we found one or more supported content types at this q value, so we choose the server's preference,
+            # which is the allowable content type with the lowest position in the server list
+            if trace is not None:
+                trace.tie_break = 'server' if len(set(allowable)) > 1 else 'client'
+            return server[min(allowable)]
 
         # we've got to here without returning anything, which means that the client and server can't come to
         # an agreement on what content type they want and can deliver.  There's nothing more we can do!
         return None
+
+
+# Negotiator used by negotiate_many() in a worker process, and the pickled
+# form it was loaded from
+_worker_negotiator = None
+_worker_pickled = None
+
+
+def _negotiate_many_chunk(pickled, keys):
+    """List of result positions for each tuple of negotiate() arguments in keys.
+
+    pickled is the pickled negotiator. It is loaded once in each worker
+    process and kept for later tasks with the same negotiator, rather than
+    set with an initializer which ProcessPoolExecutor has only from Python
+    3.7.
+    """
+    global _worker_negotiator, _worker_pickled
+    if pickled != _worker_pickled:
+        _worker_negotiator = pickle.loads(pickled)
+        _worker_pickled = pickled
+    return [_worker_negotiator._result_position(_worker_negotiator.negotiate(*key)) for key in keys]
+
+
+class _OfferedCodings(object):
+    """The encodings and charsets of the server's acceptable AcceptParameters.
+
+    encodings and charsets are tuples of the distinct values in order of
+    first use, and encoding_names and charset_names map the lower case
+    names used in headers to lists of the values they match, with
+    'identity' for the encoding None. The levels of server values accepted
+    by each Accept-Encoding and Accept-Charset header string are memoized in
+    encoding_table and charset_table, each holding at most table_size
+    entries.
+    """
+
+    table_size = 256
+
+    def __init__(self, acceptable):
+        """Find the encodings and charsets of the list acceptable."""
+        self.acceptable = tuple(acceptable)
+        encodings = []
+        charsets = []
+        for ap in self.acceptable:
+            if ap.encoding not in encodings:
+                encodings.append(ap.encoding)
+            if ap.charset not in charsets:
+                charsets.append(ap.charset)
+        self.encodings = tuple(encodings)
+        self.charsets = tuple(charsets)
+        self.encoding_names = self._by_name(self.encodings, 'identity')
+        self.charset_names = self._by_name(self.charsets, None)
+        self.encoding_table = {}
+        self.charset_table = {}
+
+    def _by_name(self, values, none_name):
+        """Dictionary of lists of values keyed by lower case name, with none_name for None."""
+        by_name = {}
+        for value in values:
+            if value is None:
+                if none_name is not None:
+                    by_name.setdefault(none_name, []).append(value)
+            else:
+                by_name.setdefault(value.lower(), []).append(value)
+        return by_name
+
+
+def _specificity(value):
+    """Number of parts of client ContentType or Language range value that are not wildcards.
+
+    Used to decide whether a range refused with q=0 applies to the server
+    variants matched by another range, RFC 7231 sec 5.3.2. None, for a
+    header that was not given, is the least specific.
+    """
+    if value is None:
+        return -1
+    if isinstance(value, ContentType):
+        return (value.type != "*") + (value.subtype != "*") + (value.params is not None)
+    if value.language == "*":
+        return 0
+    return 1 + (value.variant is not None)
+
+
+class _VariantIndex(object):
+    """Lookup index over the server's list of acceptable AcceptParameters.
+
+    Each dimension of the server variants (type, subtype, params, language,
+    encoding, charset and packaging) is indexed by value into sets of
+    positions in the server list, with separate buckets for server-side
+    wildcards. Matching a client AcceptParameters is then a matter of
+    intersecting the sets for each dimension and taking the lowest position,
+    which gives the same answer as scanning the list with
+    AcceptParameters.matches() but without visiting every variant.
+
+    The positions matching each client ContentType and Language are
+    memoized in a match table, so repeated client ranges such as text/html
+    or */* are looked up once per index. Each table holds at most
+    table_size entries, after which new ranges are computed each time.
+    """
+
+    table_size = 1024
+
+    def __init__(self, acceptable, ignore_language_variants=False):
+        """Build index over the list acceptable."""
+        self.acceptable = tuple(acceptable)
+        self.ignore_language_variants = ignore_language_variants
+        self.all = self._positions(range(len(self.acceptable)))
+        self.empty = self._positions(())
+        types, subtypes, params, langs, variants = {}, {}, {}, {}, {}
+        encodings, charsets, packagings = {}, {}, {}
+        has_ct, has_lang = set(), set()
+        for i, ap in enumerate(self.acceptable):
+            ct = ap.content_type
+            if ct is not None:
+                has_ct.add(i)
+                types.setdefault(ct.type, set()).add(i)
+                subtypes.setdefault(ct.subtype, set()).add(i)
+                params.setdefault(ct.params, set()).add(i)
+            lang = ap.language
+            if lang is not None:
+                has_lang.add(i)
+                langs.setdefault(lang.language, set()).add(i)
+                variants.setdefault((lang.language, lang.variant), set()).add(i)
+            encodings.setdefault(ap.encoding, set()).add(i)
+            charsets.setdefault(ap.charset, set()).add(i)
+            packagings.setdefault(ap.packaging, set()).add(i)
+        self.has_ct = self._positions(has_ct)
+        self.has_lang = self._positions(has_lang)
+        self.types = self._freeze(types)
+        self.subtypes = self._freeze(subtypes)
+        self.params = self._freeze(params)
+        self.langs = self._freeze(langs)
+        self.variants = self._freeze(variants)
+        self.encodings = self._freeze(encodings)
+        self.charsets = self._freeze(charsets)
+        self.packagings = self._freeze(packagings)
+        # wildcard buckets: server variants with * type, subtype or language,
+        # and with no params, match any corresponding client value
+        self.type_wild = self.types.get("*", self.empty)
+        self.subtype_wild = self.subtypes.get("*", self.empty)
+        self.params_wild = self.params.get(None, self.empty)
+        self.lang_wild = self.langs.get("*", self.empty)
+        # match tables keyed by client ContentType and Language
+        self.content_type_table = {}
+        self.language_table = {}
+
+    def _freeze(self, d):
+        return dict((k, self._positions(v)) for (k, v) in d.items())
+
+    def _positions(self, positions):
+        """Set of positions in the form used by this index."""
+        return frozenset(positions)
+
+    def _lowest(self, positions):
+        """Lowest of non-empty set of positions."""
+        return min(positions)
+
+    def content_type_positions(self, ct):
+        """Positions of server variants matching client ContentType ct, memoized."""
+        if ct is None:
+            return self.all
+        positions = self.content_type_table.get(ct)
+        if positions is None:
+            positions = self._content_type_positions(ct)
+            if len(self.content_type_table) < self.table_size:
+                self.content_type_table[ct] = positions
+        return positions
+
+    def _content_type_positions(self, ct):
+        if ct.type == "*":
+            t = self.has_ct
+        else:
+            t = self.types.get(ct.type, self.empty) | self.type_wild
+        if ct.subtype == "*":
+            s = self.has_ct
+        else:
+            s = self.subtypes.get(ct.subtype, self.empty) | self.subtype_wild
+        if ct.params is None:
+            p = self.has_ct
+        else:
+            p = self.params.get(ct.params, self.empty) | self.params_wild
+        return t & s & p
+
+    def language_positions(self, lang):
+        """Positions of server variants matching client Language lang, memoized."""
+        if lang is None:
+            return self.all
+        positions = self.language_table.get(lang)
+        if positions is None:
+            positions = self._language_positions(lang)
+            if len(self.language_table) < self.table_size:
+                self.language_table[lang] = positions
+        return positions
+
+    def _language_positions(self, lang):
+        if lang.language == "*":
+            return self.has_lang
+        if lang.variant is None:
+            # a client language with no variant matches all server variants
+            matched = self.langs.get(lang.language, self.empty)
+        else:
+            matched = self.variants.get((lang.language, lang.variant), self.empty)
+            if self.ignore_language_variants:
+                matched = matched | self.variants.get((lang.language, None), self.empty)
+        return matched | self.lang_wild
+
+    def match_position(self, ap):
+        """Lowest position of a server variant matching client AcceptParameters ap, or None."""
+        positions = (self.encodings.get(ap.encoding, self.empty) &
+                     self.charsets.get(ap.charset, self.empty) &
+                     self.packagings.get(ap.packaging, self.empty))
+        if positions:
+            positions = positions & self.content_type_positions(ap.content_type)
+        if positions:
+            positions = positions & self.language_positions(ap.language)
+        return self._lowest(positions) if positions else None
+
+    def match_position_refused(self, ap, content_types, languages):
+        """match_position() excluding server variants refused by the client.
+
+        Variants matching any of the ContentType content_types or Language
+        languages refused by the client that is at least as specific as the
+        corresponding range of ap are excluded.
+        """
+        positions = (self.encodings.get(ap.encoding, self.empty) &
+                     self.charsets.get(ap.charset, self.empty) &
+                     self.packagings.get(ap.packaging, self.empty) &
+                     self.content_type_positions(ap.content_type) &
+                     self.language_positions(ap.language))
+        for ct in content_types:
+            if positions and _specificity(ct) >= _specificity(ap.content_type):
+                positions = self._without(positions, self.content_type_positions(ct))
+        for lang in languages:
+            if positions and _specificity(lang) >= _specificity(ap.language):
+                positions = self._without(positions, self.language_positions(lang))
+        return self._lowest(positions) if positions else None
+
+    def _without(self, positions, excluded):
+        """Set of positions not in excluded."""
+        return positions - excluded
+
+
+class _BitmaskIndex(_VariantIndex):
+    """_VariantIndex with sets of positions held as integer bitmasks.
+
+    Bit i of a mask is set if the server variant at position i is in the
+    set, so intersections are integer ANDs and the lowest position, which
+    is the server's preference, is the lowest set bit. For large numbers of
+    variants this is faster and more compact than frozensets.
+    """
+
+    def _positions(self, positions):
+        """Bitmask with the bit for each of positions set."""
+        mask = 0
+        for i in positions:
+            mask |= 1 << i
+        return mask
+
+    def _lowest(self, positions):
+        """Lowest set bit of non-zero mask positions."""
+        return (positions & -positions).bit_length() - 1
+
+    def _without(self, positions, excluded):
+        """Mask of positions not in excluded."""
+        return positions & ~excluded
+
+
+# Matching engines for ContentNegotiator, None is a scan of acceptable
+ENGINES = {'sets': _VariantIndex, 'bitmask': _BitmaskIndex, 'scan': None}
+
+
+class CompiledContentNegotiator(ContentNegotiator):
+    """Immutable ContentNegotiator with a precomputed match index.
+
+    Takes the same arguments as ContentNegotiator and gives the same
+    results, but is intended to be built once (e.g. at application startup)
+    for a fixed list of acceptable server variants. The acceptable list is
+    indexed by each dimension when the negotiator is created, and as it
+    cannot change there is no need to check for changes when negotiating.
+
+    Because the index depends on the configuration, the public attributes
+    (acceptable, default_accept_parameters, weights, ignore_language_variants,
+    engine and the limits) cannot be changed after creation. Build a new
+    negotiator instead.
+    """
+
+    def __init__(self, default_accept_parameters=None, acceptable=[], weights=None, ignore_language_variants=False,
+                 cache_size=0, engine='sets', max_header_length=MAX_HEADER_LENGTH, max_entries=MAX_ENTRIES,
+                 max_combinations=MAX_COMBINATIONS, limit_action='truncate'):
+        """Initialize CompiledContentNegotiator object, see ContentNegotiator."""
+        super(CompiledContentNegotiator, self).__init__(
+            default_accept_parameters=default_accept_parameters,
+            acceptable=tuple(acceptable),
+            weights=dict(weights) if weights is not None else None,
+            ignore_language_variants=ignore_language_variants,
+            cache_size=cache_size,
+            engine=engine,
+            max_header_length=max_header_length,
+            max_entries=max_entries,
+            max_combinations=max_combinations,
+            limit_action=limit_action)
+        self._compile()
+        self._frozen = True
+
+    @property
+    def weights(self):
+        """Copy of the dictionary of relative weights, changing it has no effect."""
+        return dict(self._weights)
+
+    @weights.setter
+    def weights(self, weights):
+        ContentNegotiator.weights.fset(self, weights)
+
+    def _compile(self):
+        """Build the index and offered codings over acceptable used for every negotiation."""
+        if ENGINES[self.engine] is not None:
+            self._index = ENGINES[self.engine](self.acceptable, self.ignore_language_variants)
+        self._offered_values = _OfferedCodings(self.acceptable)
+
+    def _variant_index(self):
+        """_VariantIndex built when the negotiator was created, acceptable cannot change."""
+        return self._index
+
+    def _offered(self):
+        """_OfferedCodings built when the negotiator was created."""
+        return self._offered_values
+
+    def clear_cache(self):
+        """Discard all cached negotiation results and the match table."""
+        super(CompiledContentNegotiator, self).clear_cache()
+        if getattr(self, '_frozen', False):
+            self._compile()
+
+    def __setattr__(self, name, value):
+        """Prevent changes to configuration after creation."""
+        if getattr(self, '_frozen', False) and not name.startswith('_'):
+            raise AttributeError("CompiledContentNegotiator is immutable, cannot set " + name)
+        super(CompiledContentNegotiator, self).__setattr__(name, value)
@@ -0,0 +1,242 @@
+"""Memory-mapped on-disk store of TimeMaps.
+
+A store file holds a collection of TimeMaps keyed by the URI-R of their
+Original Resource. It is written once with write_timemap_store() and then
+opened read-only with TimeMapStore, which uses mmap so that the data is
+not read into memory or deserialized. Lookups are binary searches over
+the mapped file, and the pages of the file are shared between all
+processes that open it (e.g. pre-fork workers) through the page cache.
+TimeMapStore uses memoryview.cast() and so requires Python 3.
+
+File layout (all integers are 64-bit in the byte order of the writer,
+which is recorded in the header):
+
+    header - magic, byte order and the counts and offsets of each section
+    maps - one record per TimeMap sorted by URI-R: URI-R string number,
+        first memento number, memento count, original datetime, TimeGate
+        string number, TimeMap string number, two reserved
+    keys - memento datetimes as seconds since the epoch, sorted within
+        each TimeMap
+    uri_ids - string number of the URI of each memento
+    string offsets - start of each string in the string data, plus the end
+    string data - all URIs encoded as UTF-8
+"""
+from array import array
+import mmap
+import struct
+import sys
+
+from .memento import (INT64, TimeMap, CompactMementos,
+                      datetime_to_epoch, epoch_to_datetime)
+
+MAGIC = b'NG2TMAP1'
+HEADER = struct.Struct('=8s8s8q')
+MAP_FIELDS = 8
+# value for no original datetime or no TimeGate or TimeMap URI
+NONE_DATETIME = -2 ** 63
+NONE_STRING = -1
+
+
+def write_timemap_store(filename, timemaps):
+    """Write store file filename with the TimeMaps in iterable timemaps.
+
+    Each TimeMap must have an original URI, which must be different for
+    each TimeMap, and is used as the key in the store. Memento datetimes
+    are stored with one second accuracy.
+    """
+    strings = {}
+    string_list = []
+
+    def string_id(s):
+        if (s is None):
+            return NONE_STRING
+        if (s not in strings):
+            strings[s] = len(string_list)
+            string_list.append(s.encode('utf-8'))
+        return strings[s]
+
+    maps = []
+    keys = array(INT64)
+    uri_ids = array(INT64)
+    for tm in timemaps:
+        if (tm.original is None):
+            raise ValueError("TimeMap must have an original URI to be stored")
+        index = tm._memento_index()
+        first = len(keys)
+        for i in range(len(index)):
+            k = datetime_to_epoch(index.datetime_at(i))
+            if (len(keys) > first and keys[-1] == k):
+                # same second as previous memento, keep the later one
+                uri_ids[-1] = string_id(index.uri_at(i))
+            else:
+                keys.append(k)
+                uri_ids.append(string_id(index.uri_at(i)))
+        original_dt = NONE_DATETIME
+        if (tm.original_datetime is not None):
+            original_dt = datetime_to_epoch(tm.original_datetime)
+        maps.append([string_id(tm.original), first, len(keys) - first, original_dt,
+                     string_id(tm.timegate), string_id(tm.timemap), 0, 0])
+    maps.sort(key=lambda m: string_list[m[0]])
+    for (a, b) in zip(maps, maps[1:]):
+        if (a[0] == b[0]):
+            raise ValueError("Duplicate original URI %s in TimeMaps" % (string_list[a[0]].decode('utf-8')))
+    map_data = array(INT64)
+    for m in maps:
+        map_data.extend(m)
+    string_offsets = array(INT64, [0])
+    for s in string_list:
+        string_offsets.append(string_offsets[-1] + len(s))
+    # sections follow header in order
+    maps_offset = HEADER.size
+    keys_offset = maps_offset + 8 * len(map_data)
+    uri_ids_offset = keys_offset + 8 * len(keys)
+    string_offsets_offset = uri_ids_offset + 8 * len(uri_ids)
+    string_data_offset = string_offsets_offset + 8 * len(string_offsets)
+    with open(filename, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, sys.byteorder.encode('ascii'),
+                             len(maps), len(keys), len(string_list),
+                             maps_offset, keys_offset, uri_ids_offset,
+                             string_offsets_offset, string_data_offset))
+        for a in (map_data, keys, uri_ids, string_offsets):
+            fh.write(a.tobytes())
+        for s in string_list:
+            fh.write(s)
+
+
+class StoredMementos(CompactMementos):
+    """Read-only CompactMementos backed by slices of a memory-mapped store."""
+
+    def __init__(self, sorted_keys, uri_ids, uri_offsets, uri_data):
+        """Initialize StoredMementos with memoryviews from TimeMapStore."""
+        self.sorted_keys = sorted_keys
+        self.uri_ids = uri_ids
+        self.uri_offsets = uri_offsets
+        self.uri_data = uri_data
+
+    def uri(self, uri_id):
+        """URI string for uri_id."""
+        return self.uri_data[self.uri_offsets[uri_id]:self.uri_offsets[uri_id + 1]].tobytes().decode('utf-8')
+
+    def __setitem__(self, dt, uri):
+        """Not supported, StoredMementos are read-only."""
+        raise TypeError("Stored TimeMaps are read-only")
+
+    def __delitem__(self, dt):
+        """Not supported, StoredMementos are read-only."""
+        raise TypeError("Stored TimeMaps are read-only")
+
+
+class TimeMapStore(object):
+    """Read-only access to a store file written by write_timemap_store().
+
+    For example:
+
+    store = TimeMapStore('timemaps.store')
+    tm = store.get('http://example.org/R')
+    if tm is not None:
+        uri = tm.best_version(dt)
+
+    The TimeMaps returned are TimeMap objects with mementos held in the
+    mapped file, so best_version(), serialize_link_format() and triples()
+    work as usual but the TimeMaps cannot be changed.
+    """
+
+    def __init__(self, filename):
+        """Open store file filename."""
+        with open(filename, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if (len(self._mmap) < HEADER.size or self._mmap[:len(MAGIC)] != MAGIC):
+            self._mmap.close()
+            raise ValueError("%s is not a TimeMap store file" % (filename))
+        (magic, byteorder, self.num_timemaps, num_mementos, num_strings,
+         maps_offset, keys_offset, uri_ids_offset, string_offsets_offset,
+         string_data_offset) = HEADER.unpack_from(self._mmap, 0)
+        if (byteorder.rstrip(b'\0').decode('ascii') != sys.byteorder):
+            self._mmap.close()
+            raise ValueError("%s was written with different byte order" % (filename))
+        self._view = memoryview(self._mmap)
+        self._maps = self._int64s(maps_offset, self.num_timemaps * MAP_FIELDS)
+        self._keys = self._int64s(keys_offset, num_mementos)
+        self._uri_ids = self._int64s(uri_ids_offset, num_mementos)
+        self._string_offsets = self._int64s(string_offsets_offset, num_strings + 1)
+        self._string_data = self._view[string_data_offset:]
+
+    def _int64s(self, offset, n):
+        return self._view[offset:offset + 8 * n].cast(INT64)
+
+    def _string(self, string_id):
+        if (string_id == NONE_STRING):
+            return None
+        return self._string_data[self._string_offsets[string_id]:
+                                 self._string_offsets[string_id + 1]].tobytes().decode('utf-8')
+
+    def _find(self, original):
+        """Position of TimeMap for original in the maps, or None."""
+        target = original.encode('utf-8')
+        (lo, hi) = (0, self.num_timemaps)
+        while (lo < hi):
+            mid = (lo + hi) // 2
+            string_id = self._maps[mid * MAP_FIELDS]
+            s = self._string_data[self._string_offsets[string_id]:
+                                  self._string_offsets[string_id + 1]].tobytes()
+            if (s < target):
+                lo = mid + 1
+            else:
+                hi = mid
+        if (lo < self.num_timemaps and self._string(self._maps[lo * MAP_FIELDS]) == original):
+            return lo
+        return None
+
+    def get(self, original, default=None):
+        """TimeMap for Original Resource URI-R original, or default if not in store."""
+        n = self._find(original)
+        if (n is None):
+            return default
+        (original_id, first, count, original_dt, timegate_id,
+         timemap_id) = self._maps[n * MAP_FIELDS:n * MAP_FIELDS + 6].tolist()
+        tm = TimeMap(original=original, timegate=self._string(timegate_id),
+                     timemap=self._string(timemap_id))
+        if (original_dt != NONE_DATETIME):
+            tm.original_datetime = epoch_to_datetime(original_dt)
+        tm.mementos = StoredMementos(self._keys[first:first + count],
+                                     self._uri_ids[first:first + count],
+                                     self._string_offsets, self._string_data)
+        return tm
+
+    def __getitem__(self, original):
+        """TimeMap for Original Resource URI-R original, KeyError if not in store."""
+        tm = self.get(original)
+        if (tm is None):
+            raise KeyError(original)
+        return tm
+
+    def __contains__(self, original):
+        """True if there is a TimeMap for original in the store."""
+        return self._find(original) is not None
+
+    def __len__(self):
+        """Number of TimeMaps in the store."""
+        return self.num_timemaps
+
+    def __iter__(self):
+        """Iterate over the URI-Rs of the TimeMaps in the store, in sorted order."""
+        for n in range(self.num_timemaps):
+            yield self._string(self._maps[n * MAP_FIELDS])
+
+    def close(self):
+        """Close the store.
+
+        Raises BufferError if any TimeMaps from the store are still in use.
+        """
+        for v in (self._maps, self._keys, self._uri_ids, self._string_offsets,
+                  self._string_data, self._view):
+            v.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        """Enter context, returns the store."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit context, closes the store."""
+        self.close()
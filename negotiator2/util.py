@@ -1,12 +1,27 @@
 """Unility functions for negotiator2."""
 
-from .negotiator import AcceptParameters, ContentType, ContentNegotiator
+from .cache import LRUCache
+from .negotiator import AcceptParameters, ContentType, CompiledContentNegotiator
 from .memento import TimeMap, memento_parse_datetime
 import logging
+import os.path
+import time
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARN)
 
+# Precompressed siblings of static files used by precompressed_on_accept(),
+# as (encoding, filename suffix) in order of server preference
+PRECOMPRESSED = (('br', '.br'), ('zstd', '.zst'), ('gzip', '.gz'))
+
+# Default number of seconds for which precompressed_on_accept() uses its
+# record of which files exist
+PRECOMPRESSED_TTL = 5.0
+
+# Clock for the expiry of remembered files, not affected by changes to the
+# system time where available
+_clock = getattr(time, 'monotonic', time.time)
+
 
 def conneg_on_accept(supported_types, accept_header):
     """Do content negotiation on content type only.
@@ -22,22 +37,168 @@ def conneg_on_accept(supported_types, accept_header):
     Return:
 
     mimetype - Best match to client preference or default type.
+
+    The negotiation function for each distinct list of supported_types
+    is built once by make_conneg_on_accept() and kept in a registry of
+    bounded size, so repeated calls for the same types do not repeat
+    the setup.
+    """
+    default_type = supported_types[0]
+    if (accept_header is None or accept_header == ''):
+        return(default_type)
+    key = tuple(supported_types)
+    conneg = _conneg_registry.get(key)
+    if (conneg is None):
+        conneg = make_conneg_on_accept(key)
+        _conneg_registry.put(key, conneg)
+    return(conneg(accept_header))
+
+
+# Registry of functions from make_conneg_on_accept() used by conneg_on_accept(),
+# keyed on the tuple of supported types
+_conneg_registry = LRUCache(256)
+
+
+def make_conneg_on_accept(supported_types, cache_size=256):
+    """Make function to do content negotiation on content type only.
+
+    Arguments:
+
+    supported_types - List of one or more server supported types given
+        in order of server preference. The first is the default type.
+
+    cache_size - Number of results to remember, keyed on the Accept
+        header string.
+
+    Return:
+
+    conneg - Function taking the client provided HTTP Accept header (may
+        be empty or None) and returning the best match mimetype to
+        client preference or default type, exactly as conneg_on_accept()
+        would for the same supported_types.
+
+    For example:
+
+    conneg = make_conneg_on_accept(['text/html', 'application/json'])
+    mimetype = conneg(accept_header)
     """
     default_type = supported_types[0]
     try:
-        if (accept_header is None or accept_header == ''):
-            return(default_type)
         default_params = AcceptParameters(ContentType(default_type))
         acceptable = []
         for t in supported_types:
             acceptable.append(AcceptParameters(ContentType(t)))
-        cn = ContentNegotiator(default_params, acceptable)
-        acceptable = cn.negotiate(accept=accept_header)
-        if (acceptable is not None):
-            return(acceptable.content_type.mimetype())
+        cn = CompiledContentNegotiator(default_params, acceptable)
     except Exception as e:
-        logging.debug("conneg_on_accept: Ignored: " + str(e))
-    return(default_type)
+        log.debug("make_conneg_on_accept: Ignored: %s", e)
+        cn = None
+    results = LRUCache(cache_size)
+
+    def conneg(accept_header):
+        if (accept_header is None or accept_header == '' or cn is None):
+            return(default_type)
+        mimetype = results.get(accept_header)
+        if (mimetype is None):
+            mimetype = default_type
+            try:
+                acceptable = cn.negotiate(accept=accept_header)
+                if (acceptable is not None):
+                    mimetype = acceptable.content_type.mimetype()
+            except Exception as e:
+                log.debug("conneg_on_accept: Ignored: %s", e)
+            results.put(accept_header, mimetype)
+        return(mimetype)
+
+    return(conneg)
+
+
+def precompressed_on_accept(path, accept_encoding_header, ttl=PRECOMPRESSED_TTL):
+    """Do content negotiation over precompressed versions of a static file.
+
+    Arguments:
+
+    path - Path of the static file. Precompressed versions are siblings
+        with the suffixes in PRECOMPRESSED, e.g. path + '.br' for Brotli.
+
+    accept_encoding_header - Client provided HTTP Accept-Encoding header
+        (may be None).
+
+    ttl - Number of seconds to remember which files exist.
+
+    Return:
+
+    (filename, encoding) - The file to send and the encoding for the
+        Content-Encoding header, or None for path itself. Returns None if
+        none of the files is acceptable, or none exist.
+
+    Which of path and its siblings exist is remembered, as is the result
+    for each path and header, and used if checked less than ttl seconds
+    ago, so that a repeated request costs one cache lookup rather than a
+    stat of each file. Files added or removed are seen once the ttl has
+    passed. The server prefers the encodings in the order of PRECOMPRESSED,
+    then path itself.
+    """
+    key = (path, accept_encoding_header)
+    now = _clock()
+    cached = _precompressed_results.get(key)
+    if (cached is not None and now - cached[0] < ttl):
+        return(cached[1])
+    (checked, encodings) = _precompressed_files(path, now, ttl)
+    result = None
+    if (encodings):
+        cn = _precompressed_negotiator(encodings)
+        try:
+            acceptable = cn.negotiate(accept_encoding=accept_encoding_header)
+        except Exception as e:
+            log.debug("precompressed_on_accept: Ignored: %s", e)
+            acceptable = cn.default_accept_parameters
+        if (acceptable is not None):
+            result = (path + _PRECOMPRESSED_SUFFIXES[acceptable.encoding], acceptable.encoding)
+    # checked when the files were so that changes are seen together
+    _precompressed_results.put(key, (checked, result))
+    return(result)
+
+
+_PRECOMPRESSED_SUFFIXES = dict(PRECOMPRESSED)
+_PRECOMPRESSED_SUFFIXES[None] = ''
+
+# Caches used by precompressed_on_accept(): (time checked, tuple of encodings
+# of the files that exist) keyed by path, and (time files checked, result)
+# keyed by (path, Accept-Encoding header)
+_precompressed_file_cache = LRUCache(4096)
+_precompressed_results = LRUCache(4096)
+
+# Negotiators used by precompressed_on_accept(), keyed by the tuple of
+# encodings available. There are few distinct tuples so this is not bounded
+_precompressed_negotiators = {}
+
+
+def _precompressed_files(path, now, ttl):
+    """(time checked, tuple of encodings of path and siblings that exist).
+
+    Encodings are in the order of PRECOMPRESSED, with None for path itself
+    last. The files are checked again if last checked ttl or more seconds
+    before now.
+    """
+    cached = _precompressed_file_cache.get(path)
+    if (cached is None or now - cached[0] >= ttl):
+        encodings = [encoding for (encoding, suffix) in PRECOMPRESSED if os.path.isfile(path + suffix)]
+        if (os.path.isfile(path)):
+            encodings.append(None)
+        cached = (now, tuple(encodings))
+        _precompressed_file_cache.put(path, cached)
+    return(cached)
+
+
+def _precompressed_negotiator(encodings):
+    """CompiledContentNegotiator over the tuple of encodings available."""
+    cn = _precompressed_negotiators.get(encodings)
+    if (cn is None):
+        acceptable = [AcceptParameters(encoding=encoding) for encoding in encodings]
+        default_params = acceptable[-1] if None in encodings else None
+        cn = CompiledContentNegotiator(default_params, acceptable, cache_size=256)
+        _precompressed_negotiators[encodings] = cn
+    return(cn)
 
 
 def negotiate_on_datetime(timemap, accept_datetime_header, method=None):
@@ -58,10 +219,55 @@ def negotiate_on_datetime(timemap, accept_datetime_header, method=None):
         be the last version in the TimeMap (usually the Memento Orginal
         Resource).
     """
-    try:
-        dt = memento_parse_datetime(accept_datetime_header)
-    except Exception as e:
-        logging.debug("negotiate_on_datetime: Ignored bad Accept-Datetime: " + str(e))
-        dt = None  # will not be used
+    dt = _accept_datetime(accept_datetime_header)
+    if (dt is None):
         method = TimeMap.LAST
     return timemap.best_version(dt, method)
+
+
+def negotiate_on_datetimes(timemap, accept_datetime_headers, method=None):
+    """Do Memento Datetime negotiation for a sequence of Accept-Datetime headers.
+
+    Arguments:
+
+    timemap - A TimeMap object with information about Original Resource and
+        all Mementos available
+    accept_datetime_headers - Sequence of values of Accept-Datetime headers
+    method - Method to be used by TimeMap.best_versions() to find the best
+        version for each datetime.
+
+    Return:
+
+    memento_uris - List of the URIs of the best Memento for each header, in
+        the order of accept_datetime_headers. As with negotiate_on_datetime(),
+        the URI for a header with any problems is the last version in the
+        TimeMap.
+    """
+    dts = [_accept_datetime(header) for header in accept_datetime_headers]
+    good = [n for (n, dt) in enumerate(dts) if dt is not None]
+    uris = [None] * len(dts)
+    for (n, uri) in zip(good, timemap.best_versions([dts[n] for n in good], method)):
+        uris[n] = uri
+    if (len(good) < len(dts)):
+        last = timemap.best_version(None, TimeMap.LAST)
+        for n in range(len(dts)):
+            if (dts[n] is None):
+                uris[n] = last
+    return uris
+
+
+def _accept_datetime(accept_datetime_header):
+    """Datetime from Accept-Datetime header, or None if it cannot be parsed."""
+    dt = _accept_datetime_cache.get(accept_datetime_header)
+    try:
+        if (dt is None):
+            dt = memento_parse_datetime(accept_datetime_header)
+            _accept_datetime_cache.put(accept_datetime_header, dt)
+    except Exception as e:
+        log.debug("negotiate_on_datetime: Ignored bad Accept-Datetime: %s", e)
+    return dt
+
+
+# Cache of datetimes parsed from Accept-Datetime header values, used by
+# negotiate_on_datetime()
+_accept_datetime_cache = LRUCache(1024)
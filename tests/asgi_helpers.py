@@ -0,0 +1,31 @@
+"""ASGI application and send callable for the middleware tests.
+
+These use async def and asyncio.run(), so this module is only imported by
+tests/test_middleware.py with Python 3.7 or later.
+"""
+import asyncio
+
+
+class ASGIRecorder(object):
+    """ASGI application and send callable recording what they are called with."""
+
+    def __init__(self, calls, sent):
+        """Initialize ASGIRecorder appending scopes to calls and messages to sent."""
+        self.calls = calls
+        self.sent = sent
+
+    async def app(self, scope, receive, send):
+        """ASGI application recording the scope and sending a response."""
+        self.calls.append(scope)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-length', b'0')]})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def send(self, message):
+        """ASGI send recording the response start messages."""
+        await asyncio.sleep(0)
+        if (message['type'] == 'http.response.start'):
+            self.sent.append(message)
+
+    def request(self, mw, scope):
+        """Run ASGI middleware mw for a request with scope in an event loop."""
+        asyncio.run(mw(scope, None, self.send))
@@ -0,0 +1,66 @@
+"""Cache tests."""
+import pickle
+import unittest
+
+from negotiator2.cache import LRUCache
+
+
+class TestAll(unittest.TestCase):
+    """TestAll class to run tests."""
+
+    def test01_get_put(self):
+        """Test get and put with counters."""
+        c = LRUCache(maxsize=2)
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.get('a', 'default'), 'default')
+        c.put('a', 1)
+        self.assertEqual(c.get('a'), 1)
+        self.assertTrue('a' in c)
+        self.assertEqual(len(c), 1)
+        self.assertEqual(c.info(), {'hits': 1, 'misses': 2, 'evictions': 0, 'size': 1, 'maxsize': 2})
+
+    def test02_eviction(self):
+        """Test least recently used entry is evicted."""
+        c = LRUCache(maxsize=2)
+        c.put('a', 1)
+        c.put('b', 2)
+        c.get('a')  # b is now least recently used
+        c.put('c', 3)
+        self.assertTrue('a' in c)
+        self.assertFalse('b' in c)
+        self.assertTrue('c' in c)
+        self.assertEqual(c.evictions, 1)
+        c.resize(1)
+        self.assertEqual(len(c), 1)
+        self.assertTrue('c' in c)
+        self.assertEqual(c.evictions, 2)
+        c.clear()
+        self.assertEqual(len(c), 0)
+        # replacing a value makes it most recently used, and the order is
+        # kept after clear()
+        c.resize(3)
+        for key in 'abcab':
+            c.put(key, key)
+        c.put('a', 'A')
+        c.put('d', 'd')
+        self.assertEqual(sorted(c._data), ['a', 'b', 'd'])
+        self.assertEqual(c.get('a'), 'A')
+        c.resize(1)
+        self.assertEqual(sorted(c._data), ['a'])
+
+    def test03_disabled(self):
+        """Test maxsize 0 stores nothing."""
+        c = LRUCache(maxsize=0)
+        c.put('a', 1)
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.get('a'), None)
+
+    def test04_pickle(self):
+        """Test pickle gives empty cache of same size."""
+        c = LRUCache(maxsize=5)
+        c.put('a', 1)
+        c2 = pickle.loads(pickle.dumps(c))
+        self.assertEqual(c2.maxsize, 5)
+        self.assertEqual(len(c2), 0)
+        c2.put('b', 2)
+        self.assertEqual(c2.get('b'), 2)
@@ -4,10 +4,13 @@ try:  # Python 3
     from datetime.timezone import utc
 except:  # Python 2
     from dateutil.tz import tzutc as utc
+import io
 import re
 import unittest
 
 from negotiator2 import BadTimeMap, TimeMap, memento_parse_datetime, memento_datetime_string
+from negotiator2 import memento
+from negotiator2.memento import timestamp_to_epoch
 
 
 class TestAll(unittest.TestCase):
@@ -44,6 +47,29 @@ class TestAll(unittest.TestCase):
                          "Wed, 23 Sep 2009 22:15:29 GMT")
         self.assertEqual(memento_datetime_string(datetime(2001, 2, 3, 4, 5, 6)),
                          "Sat, 03 Feb 2001 04:05:06 GMT")
+        self.assertEqual(memento_datetime_string(datetime(999, 12, 31, 23, 59, 59)),
+                         "Tue, 31 Dec 0999 23:59:59 GMT")
+        self.assertEqual(memento_datetime_string(datetime(2017, 11, 3, 1, 2, 3, tzinfo=utc())),
+                         "Fri, 03 Nov 2017 01:02:03 GMT")
+
+    def test03_memento_parse_datetime_as_strptime(self):
+        """Test datetime parsing accepts and rejects same strings as strptime."""
+        for s in ["Thu, 31 May 2007 20:35:00 GMT", "thu, 31 may 2007 20:35:00 gmt",
+                  "Thu,  1 May 2007 20:35:00 GMT", "Thu, 1 May 2007 2:3:4 GMT",
+                  "Thu,\t01 May 2007 20:35:00\nGMT", "Thu, 31 May 2007 20:35:60 GMT",
+                  "Thu, 31 May 2007 20:35:61 GMT", "Thu, 31 May 2007 20:35:62 GMT",
+                  "Thu, 31 Feb 2007 20:35:00 GMT", "Thu, 00 May 2007 20:35:00 GMT",
+                  "Thu, 31 May 0000 20:35:00 GMT", "Thu, 31 May 207 20:35:00 GMT",
+                  "Thu, 31 May 2007 24:35:00 GMT", "Thu, 31 May 2007 20:35:00 GMT ",
+                  " Thu, 31 May 2007 20:35:00 GMT", "Thu, 31 May 2007 20:35:00 GMT\n",
+                  "Thursday, 31 May 2007 20:35:00 GMT", "Thu 31 May 2007 20:35:00 GMT"]:
+            try:
+                expected = datetime.strptime(s, '%a, %d %b %Y %H:%M:%S GMT').replace(tzinfo=utc())
+            except ValueError:
+                self.assertRaises(ValueError, memento_parse_datetime, s)
+            else:
+                self.assertEqual(memento_parse_datetime(s), expected)
+        self.assertRaises(TypeError, memento_parse_datetime, None)
 
     def test10_timemap_init(self):
         """Test TimeMap initialiation and instance vars."""
@@ -114,3 +140,178 @@ class TestAll(unittest.TestCase):
         tm.timegate = 'URI-TG2'
         self.assertEqual(len(tm.triples()), n + 3)  # TimeGate should add 3 triples
         self.assertTrue(('URI-M1', 'http://mementoweb.org/ns#timegate', 'URI-TG2', False) in tm.triples())
+
+    def test14_best_version_index(self):
+        """Test sorted index used by best_version."""
+        tm = TimeMap()
+        for d in range(28, 0, -3):
+            tm.add_memento("URI-M%02d" % d, "Sat, %02d Feb 2001 04:05:06 GMT" % d)
+        self.assertEqual(tm._memento_index().sorted_keys, sorted(tm.mementos.keys()))
+        dt = datetime(2001, 2, 10, tzinfo=utc())
+        self.assertEqual(tm.best_version(dt), "URI-M07")
+        self.assertEqual(tm.best_version(dt, TimeMap.CLOSEST), "URI-M10")
+        self.assertEqual(tm.best_version(dt, TimeMap.LAST), "URI-M28")
+        # incremental update
+        tm.add_memento("URI-M09", "Fri, 09 Feb 2001 04:05:06 GMT")
+        self.assertEqual(tm.best_version(dt), "URI-M09")
+        # replacing memento at same datetime
+        tm.add_memento("URI-M09b", "Fri, 09 Feb 2001 04:05:06 GMT")
+        self.assertEqual(tm.best_version(dt), "URI-M09b")
+        # direct changes to mementos are picked up
+        tm.mementos[datetime(2001, 2, 9, 23, tzinfo=utc())] = "URI-M09c"
+        self.assertEqual(tm.best_version(dt), "URI-M09c")
+        tm.mementos = {datetime(2001, 2, 1, tzinfo=utc()): "URI-X"}
+        self.assertEqual(tm.best_version(dt), "URI-X")
+        # original at same datetime as memento takes precedence
+        tm.set_original("URI-R", "Thu, 01 Feb 2001 00:00:00 GMT")
+        self.assertEqual(tm.best_version(dt), "URI-R")
+        self.assertEqual(tm.best_version(dt, TimeMap.LAST), "URI-R")
+
+    def test15_compact_mementos(self):
+        """Test TimeMap with compact storage."""
+        tm = TimeMap(compact=True)
+        self.assertEqual(len(tm.mementos), 0)
+        self.assertEqual(tm.mementos, {})
+        tm.add_memento("URI-M2", "Sat, 03 Feb 2001 04:05:06 GMT")
+        tm.add_memento("URI-M1", "Fri, 02 Feb 2001 04:05:06 GMT")
+        tm.add_memento("URI-M3", "Sun, 04 Feb 2001 04:05:06 GMT")
+        self.assertEqual(len(tm.mementos), 3)
+        self.assertEqual(tm.mementos[datetime(2001, 2, 3, 4, 5, 6, tzinfo=utc())], "URI-M2")
+        self.assertEqual(list(tm.mementos.values()), ["URI-M1", "URI-M2", "URI-M3"])
+        self.assertRaises(KeyError, tm.mementos.__getitem__, datetime(2001, 2, 3, tzinfo=utc()))
+        tm.add_memento("URI-M2\u00e9", "Sat, 03 Feb 2001 04:05:06 GMT")
+        self.assertEqual(len(tm.mementos), 3)
+        self.assertEqual(tm.mementos[datetime(2001, 2, 3, 4, 5, 6, tzinfo=utc())], "URI-M2\u00e9")
+        del tm.mementos[datetime(2001, 2, 3, 4, 5, 6, tzinfo=utc())]
+        self.assertEqual(len(tm.mementos), 2)
+        dt = datetime(2001, 2, 3, tzinfo=utc())
+        self.assertEqual(tm.best_version(dt), "URI-M1")
+        self.assertEqual(tm.best_version(dt, TimeMap.CLOSEST), "URI-M1")
+        self.assertEqual(tm.best_version(dt, TimeMap.LAST), "URI-M3")
+        tm.set_original("URI-R")
+        self.assertEqual(tm.best_version(dt, TimeMap.LAST), "URI-R")
+        self.assertTrue(re.search(r'''<URI-M3>\n  ;rel="memento"\n  ;datetime="Sun, 04 Feb 2001 04:05:06 GMT"''',
+                                  tm.serialize_link_format()))
+        self.assertTrue(('URI-M1', 'http://mementoweb.org/ns#memento-datetime', 'Fri, 02 Feb 2001 04:05:06 GMT', True) in tm.triples())
+        # copy from dictionary
+        tm2 = TimeMap(mementos=dict(tm.mementos), compact=True)
+        self.assertEqual(tm2.mementos, tm.mementos)
+        tm2 = TimeMap(mementos=dict(reversed(tm.mementos.items())), compact=True)
+        self.assertEqual(list(tm2.mementos.sorted_keys), sorted(tm.mementos.sorted_keys))
+        self.assertEqual(tm2.mementos.items(), tm.mementos.items())
+
+    def test16_iter_link_format(self):
+        """Test streaming link format serialization."""
+        tm = TimeMap()
+        self.assertRaises(BadTimeMap, tm.iter_link_format)
+        tm.set_original("URI-R")
+        tm.timegate = "URI-TG"
+        tm.timemap = "URI-TM"
+        for d in range(28, 0, -1):
+            tm.add_memento("URI-M%02d" % d, "Sat, %02d Feb 2001 04:05:06 GMT" % d)
+        s = tm.serialize_link_format()
+        # mementos in datetime order
+        self.assertTrue(s.index("URI-M01") < s.index("URI-M02") < s.index("URI-M28"))
+        chunks = list(tm.iter_link_format(chunk_size=200))
+        self.assertTrue(len(chunks) > 5)
+        self.assertTrue(isinstance(chunks[0], bytes))
+        self.assertEqual(b''.join(chunks).decode('utf-8'), s)
+        self.assertEqual(''.join(tm.iter_link_format(encoding=None)), s)
+        fh = io.BytesIO()
+        tm.write_link_format(fh, chunk_size=100)
+        self.assertEqual(fh.getvalue().decode('utf-8'), s)
+
+    def test17_paged_link_format(self):
+        """Test paged link format serialization."""
+        tm = TimeMap("URI-R", timemap="URI-TM", page_size=10)
+        for d in range(1, 26):
+            tm.add_memento("URI-M%02d" % d, "Sat, %02d Feb 2001 04:05:06 GMT" % d)
+        self.assertEqual(tm.num_pages(), 3)
+        self.assertEqual(tm.page_uri(2), "URI-TM?page=2")
+        # whole TimeMap has from and until on self link
+        self.assertTrue(re.search(r'''<URI-TM>\n  ;rel="self"\n  ;from="Thu, 01 Feb 2001 04:05:06 GMT"\n  ;type="application/link-format"\n  ;until="Sun, 25 Feb 2001 04:05:06 GMT"''',
+                                  tm.serialize_link_format()))
+        p1 = tm.serialize_link_format(page=1)
+        self.assertTrue('<URI-R>\n  ;rel="original"' in p1)
+        self.assertTrue('URI-M01' in p1 and 'URI-M10' in p1 and 'URI-M11' not in p1)
+        self.assertTrue(re.search(r'''<URI-TM\?page=1>\n  ;rel="self"\n  ;from="Thu, 01 Feb 2001 04:05:06 GMT"\n  ;type="application/link-format"\n  ;until="Sat, 10 Feb 2001 04:05:06 GMT"''', p1))
+        self.assertTrue(re.search(r'''<URI-TM\?page=2>\n  ;rel="timemap"\n  ;from="Sun, 11 Feb 2001 04:05:06 GMT"''', p1))
+        self.assertFalse('page=0' in p1)
+        p2 = tm.serialize_link_format(page=2)
+        self.assertTrue('URI-M10' not in p2 and 'URI-M11' in p2 and 'URI-M20' in p2 and 'URI-M21' not in p2)
+        self.assertTrue(re.search(r'''<URI-TM\?page=1>\n  ;rel="timemap"\n  ;from="Thu, 01 Feb 2001 04:05:06 GMT"\n  ;type="application/link-format"\n  ;until="Sat, 10 Feb 2001 04:05:06 GMT"''', p2))
+        self.assertTrue(re.search(r'''<URI-TM\?page=3>\n  ;rel="timemap"\n  ;from="Wed, 21 Feb 2001 04:05:06 GMT"\n  ;type="application/link-format"\n  ;until="Sun, 25 Feb 2001 04:05:06 GMT"''', p2))
+        p3 = tm.serialize_link_format(page=3)
+        self.assertTrue('URI-M21' in p3 and 'URI-M25' in p3)
+        self.assertFalse('page=4' in p3)
+        self.assertRaises(BadTimeMap, tm.serialize_link_format, page=4)
+        self.assertRaises(BadTimeMap, tm.serialize_link_format, page=0)
+        tm.page_size = None
+        self.assertRaises(BadTimeMap, tm.serialize_link_format, page=1)
+
+    def test18_timestamp_to_epoch(self):
+        """Test timestamp conversion for records."""
+        self.assertEqual(timestamp_to_epoch('20170808020808'), 1502158088)
+        self.assertEqual(timestamp_to_epoch(' 20170808020808\n'), 1502158088)
+        self.assertEqual(timestamp_to_epoch('1502158088'), 1502158088)
+        self.assertEqual(timestamp_to_epoch(1502158088), 1502158088)
+        self.assertEqual(timestamp_to_epoch(1502158088.9), 1502158088)
+        self.assertEqual(timestamp_to_epoch(datetime(2017, 8, 8, 2, 8, 8, tzinfo=utc())), 1502158088)
+        self.assertEqual(timestamp_to_epoch('Tue, 08 Aug 2017 02:08:08 GMT'), 1502158088)
+        self.assertRaises(ValueError, timestamp_to_epoch, '20171308020808')
+        self.assertRaises(ValueError, timestamp_to_epoch, 'junk')
+
+    def test19_from_records(self):
+        """Test bulk loading of TimeMap."""
+        records = [('URI-M2', '20170808050808'), ('URI-M1', 1502158088),
+                   ('URI-M3', '20170808080808'), ('URI-M2b', '20170808050808')]
+        for compact in (False, True):
+            tm = TimeMap.from_records(records, original='URI-R', compact=compact, batch_size=3)
+            self.assertEqual(tm.original, 'URI-R')
+            self.assertEqual(len(tm.mementos), 3)
+            self.assertEqual(tm.mementos[datetime(2017, 8, 8, 5, 8, 8, tzinfo=utc())], 'URI-M2b')
+            dt = datetime(2017, 8, 8, 6, tzinfo=utc())
+            self.assertEqual(tm.best_version(dt), 'URI-M2b')
+            self.assertEqual(tm.best_version(dt, TimeMap.CLOSEST), 'URI-M2b')
+            tm.add_memento('URI-M4', 'Tue, 08 Aug 2017 05:50:00 GMT')
+            self.assertEqual(tm.best_version(dt), 'URI-M4')
+        # file formats
+        tm = TimeMap.from_records(io.StringIO(u'URI-M1,20170808020808\n"URI-M2,x",20170808050808\n'),
+                                  format='csv')
+        self.assertEqual(sorted(tm.mementos.values()), ['URI-M1', 'URI-M2,x'])
+        tm = TimeMap.from_records(io.StringIO(u'{"uri": "URI-M1", "timestamp": 1502158088}\n\n'
+                                              u'{"uri": "URI-M2", "timestamp": "20170808050808"}\n'),
+                                  format='jsonl')
+        self.assertEqual(tm.mementos[datetime(2017, 8, 8, 5, 8, 8, tzinfo=utc())], 'URI-M2')
+        cdx = io.StringIO(u' CDX N b a m s k r M S V g\n'
+                          u'org,example)/ 20170808050808 http://example.org/ text/html 200 X - - 1 2 a.warc.gz\n'
+                          u'org,example)/ 20170808020808 http://example.org/ text/html 200 Y - - 1 2 a.warc.gz\n')
+        tm = TimeMap.from_records(cdx, format='cdx', uri_format='http://a.example.org/%(timestamp)s/%(original)s',
+                                  compact=True)
+        self.assertEqual(list(tm.mementos.values()),
+                         ['http://a.example.org/20170808020808/http://example.org/',
+                          'http://a.example.org/20170808050808/http://example.org/'])
+        self.assertRaises(ValueError, TimeMap.from_records, [], format='cdx')
+        self.assertRaises(ValueError, TimeMap.from_records, [], format='unknown')
+
+    def test20_best_versions(self):
+        """Test batch resolution of datetimes matches best_version."""
+        records = [('URI-M%d' % n, 1500000000 + 1000 * n * n) for n in range(20)]
+        dts = [datetime.fromtimestamp(1499999000 + 7777 * n, utc()) for n in range(60)]
+        dts.reverse()
+        now = datetime(2017, 8, 8, 5, 8, 8)
+        for compact in (False, True):
+            for original in (None, 'URI-R'):
+                tm = TimeMap.from_records(records, original=original, compact=compact)
+                for method in (TimeMap.PREVIOUS, TimeMap.CLOSEST, TimeMap.LAST):
+                    expected = [tm.best_version(dt, method, now) for dt in dts]
+                    self.assertEqual(tm.best_versions(dts, method, now), expected)
+                    self.assertEqual(tm.best_versions([], method, now), [])
+                    # and without NumPy
+                    saved = memento.numpy
+                    memento.numpy = None
+                    try:
+                        self.assertEqual(tm.best_versions(dts, method, now), expected)
+                    finally:
+                        memento.numpy = saved
+        self.assertRaises(BadTimeMap, TimeMap().best_versions, dts)
@@ -0,0 +1,109 @@
+"""Middleware tests.
+
+negotiator2.middleware uses async def and the ASGI tests use asyncio.run(),
+so these tests are skipped before Python 3.7. The coroutines are in
+tests/asgi_helpers.py which is only imported then.
+"""
+import inspect
+import sys
+import unittest
+
+from negotiator2 import AcceptParameters, ContentType, Language, CompiledContentNegotiator
+
+if sys.version_info >= (3, 7):
+    from negotiator2 import middleware
+    from negotiator2.middleware import ASGINegotiationMiddleware, WSGINegotiationMiddleware, vary_header
+    from .asgi_helpers import ASGIRecorder
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "Middleware tests require Python 3.7")
+class TestAll(unittest.TestCase):
+    """TestAll class to run tests."""
+
+    def setUp(self):
+        """Negotiators and applications recording what they are called with."""
+        self.html = AcceptParameters(ContentType("text/html"), Language("en"))
+        self.json = AcceptParameters(ContentType("application/json"), Language("en"))
+        self.cn = CompiledContentNegotiator(self.html, [self.html, self.json], cache_size=16)
+        self.de = AcceptParameters(ContentType("text/html"), Language("de"))
+        self.lang_cn = CompiledContentNegotiator(self.html, [self.html, self.de])
+        self.calls = []
+        self.sent = []
+        self.asgi = ASGIRecorder(self.calls, self.sent)
+
+    def wsgi_app(self, environ, start_response):
+        """WSGI application recording the environ."""
+        self.calls.append(environ)
+        start_response('200 OK', [('Content-Length', '0')])
+        return [b'']
+
+    def test01_vary_header(self):
+        """Test Vary header lists only dimensions that vary."""
+        self.assertEqual(vary_header(self.cn), 'Accept')
+        self.assertEqual(vary_header(self.lang_cn), 'Accept-Language')
+        gz = AcceptParameters(ContentType("text/html"), Language("de"), encoding="gzip")
+        self.assertEqual(vary_header(CompiledContentNegotiator(None, [self.html, self.json, self.de, gz])),
+                         'Accept, Accept-Language, Accept-Encoding')
+        self.assertEqual(vary_header(CompiledContentNegotiator(None, [self.html])), None)
+
+    def test02_asgi(self):
+        """Test ASGI middleware."""
+        mw = ASGINegotiationMiddleware(self.asgi.app, self.cn, routes={'/de': self.lang_cn, '/raw': None})
+        self.assertTrue(inspect.iscoroutinefunction(mw.__call__))
+        headers = [(b'host', b'example.org'),
+                   (b'accept', b'application/json, text/html;q=0.5'),
+                   (b'accept-language', b'de, en;q=0.5')]
+        scope = {'type': 'http', 'path': '/', 'headers': headers}
+        self.asgi.request(mw, scope)
+        self.assertTrue(self.calls[0]['negotiator2.result'] is self.json)
+        self.assertFalse('negotiator2.result' in scope)
+        self.assertEqual(self.sent[0]['headers'], [(b'content-length', b'0'), (b'vary', b'Accept')])
+        # route with a different negotiator, repeated headers combined
+        headers = [(b'accept-language', b'fr'), (b'accept-language', b'de;q=0.5')]
+        self.asgi.request(mw, {'type': 'http', 'path': '/de', 'headers': headers})
+        self.assertTrue(self.calls[1]['negotiator2.result'] is self.de)
+        self.assertEqual(self.sent[1]['headers'][-1], (b'vary', b'Accept-Language'))
+        # no negotiation for route to None, or other connection types
+        for scope in ({'type': 'http', 'path': '/raw', 'headers': []},
+                      {'type': 'websocket', 'path': '/', 'headers': []}):
+            self.asgi.request(mw, scope)
+            self.assertTrue(self.calls[-1] is scope)
+            self.assertEqual(self.sent[-1]['headers'], [(b'content-length', b'0')])
+        # no headers or bad headers give the default
+        for headers in ([], [(b'accept', b'html')]):
+            self.asgi.request(mw, {'type': 'http', 'path': '/', 'headers': headers})
+            self.assertTrue(self.calls[-1]['negotiator2.result'] is self.html)
+        self.asgi.request(mw, {'type': 'http', 'path': '/', 'headers': [(b'accept', b'image/png')]})
+        self.assertEqual(self.calls[-1]['negotiator2.result'], None)
+        # results are remembered for each negotiator and headers, up to MAX_RESULTS
+        self.assertEqual(len(mw._results), 5)
+        self.asgi.request(mw, {'type': 'http', 'path': '/', 'headers': []})
+        self.assertEqual(len(mw._results), 5)
+        try:
+            middleware.MAX_RESULTS = 5
+            self.asgi.request(mw, {'type': 'http', 'path': '/', 'headers': [(b'accept', b'text/*')]})
+        finally:
+            middleware.MAX_RESULTS = 1024
+        self.assertEqual(len(mw._results), 1)
+
+    def test03_wsgi(self):
+        """Test WSGI middleware."""
+        mw = WSGINegotiationMiddleware(self.wsgi_app, routes={'/de': self.lang_cn})
+
+        def start_response(status, headers, exc_info=None):
+            self.sent.append(headers)
+
+        environ = {'PATH_INFO': '/de', 'HTTP_ACCEPT_LANGUAGE': 'de, en;q=0.5', 'HTTP_ACCEPT': 'text/html'}
+        self.assertEqual(mw(environ, start_response), [b''])
+        self.assertTrue(environ['negotiator2.result'] is self.de)
+        self.assertEqual(self.sent[0], [('Content-Length', '0'), ('Vary', 'Accept-Language')])
+        # no default negotiator
+        environ = {'PATH_INFO': '/', 'HTTP_ACCEPT': 'text/html'}
+        mw(environ, start_response)
+        self.assertFalse('negotiator2.result' in environ)
+        self.assertEqual(self.sent[1], [('Content-Length', '0')])
+        mw = WSGINegotiationMiddleware(self.wsgi_app, self.cn)
+        environ = {'PATH_INFO': '/', 'HTTP_ACCEPT': 'application/json'}
+        mw(environ, start_response)
+        self.assertTrue(environ['negotiator2.result'] is self.json)
+        self.assertEqual(self.sent[2][-1], ('Vary', 'Accept'))
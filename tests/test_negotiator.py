@@ -1,7 +1,12 @@
 """Negotiator tests."""
+import logging
+import pickle
+import sys
 import unittest
 
-from negotiator2 import AcceptParameters, ContentType, Language, ContentNegotiator
+from negotiator2 import AcceptParameters, ContentType, Language, ContentNegotiator, CompiledContentNegotiator
+from negotiator2 import negotiator
+from negotiator2.negotiator import intern_pool, parse_cache, tokenize_accept_header
 
 
 class TestAll(unittest.TestCase):
@@ -249,3 +254,516 @@ class TestAll(unittest.TestCase):
         ap = cn.negotiate(accept=accept, accept_language=accept_lang)
         self.assertEqual(str(ap.content_type), 'text/plain')
         self.assertEqual(str(ap.language), 'en')
+
+    def test04_compiled_negotiator(self):
+        """COMPILED NEGOTIATOR gives same results as ContentNegotiator."""
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/html"), Language("fr")),
+                  AcceptParameters(ContentType("text/html"), Language("en-gb")),
+                  AcceptParameters(ContentType("application/atom+xml;type=feed"), Language("de")),
+                  AcceptParameters(ContentType("application/json")),
+                  AcceptParameters(ContentType("image/*")),
+                  AcceptParameters(language=Language("*")),
+                  AcceptParameters(ContentType("text/plain"), Language("cz"), packaging="http://p.example.org/zip")]
+        accepts = [None, "text/html", "text/*", "*/*", "image/png", "application/atom+xml",
+                   "application/atom+xml;type=entry", "application/json;q=0.5, text/html;q=0.4",
+                   "text/plain, application/json;q=0.9, */*;q=0.1", "video/mp4"]
+        langs = [None, "en", "en-gb", "en-us", "fr;q=0.3, de;q=0.7", "*", "cz, en;q=0.1", "no"]
+        packagings = [None, "http://p.example.org/zip"]
+        for ilv in (False, True):
+            cn = ContentNegotiator(acceptable=server, ignore_language_variants=ilv)
+            ccn = CompiledContentNegotiator(acceptable=server, ignore_language_variants=ilv)
+            for accept in accepts:
+                for lang in langs:
+                    for packaging in packagings:
+                        self.assertEqual(
+                            str(ccn.negotiate(accept, lang, accept_packaging=packaging)),
+                            str(cn.negotiate(accept, lang, accept_packaging=packaging)))
+        # configuration is immutable
+        self.assertRaises(AttributeError, setattr, ccn, 'acceptable', [])
+        self.assertRaises(AttributeError, setattr, ccn, 'weights', {})
+        self.assertEqual(ccn.acceptable, tuple(server))
+        result = ccn.negotiate("text/html", "de")
+        ccn.weights['content_type'] = 0.0
+        self.assertEqual(ccn.weights['content_type'], 1.0)
+        self.assertTrue(ccn.negotiate("text/html", "de") is result)
+
+    def test05_list_acceptable(self):
+        """PREFERENCE COMBINATIONS generated in descending weighted q."""
+        cn = ContentNegotiator(weights={'content_type': 1.0, 'language': 0.5})
+        accept = cn._analyse_accept("text/html, text/json;q=1.0, application/pdf;q=0.5")
+        lang = cn._analyse_language("en;q=0.5, de, cz, fr")
+        levels = list(cn._list_acceptable(cn.weights, accept, lang))
+        self.assertEqual(len(levels), 8)
+        qs = [q for (q, possibilities) in levels]
+        self.assertEqual(qs, sorted(qs, reverse=True))
+        self.assertEqual(levels[0][0], 1.375)
+        self.assertEqual(sorted(str(ap) for ap in levels[0][1]),
+                         ['AcceptParameters:: Content Type: text/html;Language: de;',
+                          'AcceptParameters:: Content Type: text/json;Language: de;'])
+        self.assertEqual(sum(len(possibilities) for (q, possibilities) in levels), 12)
+        # generation is lazy, the first level is available without the rest
+        gen = cn._list_acceptable(cn.weights, accept, lang)
+        self.assertEqual(next(gen)[0], 1.375)
+
+    def test06_cache(self):
+        """RESULT CACHE."""
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/plain"), Language("de"))]
+        cn = ContentNegotiator(acceptable=server, cache_size=2)
+        ap = cn.negotiate(accept="text/plain, text/html;q=0.5")
+        self.assertEqual(str(ap.content_type), 'text/plain')
+        self.assertTrue(cn.negotiate(accept="text/plain, text/html;q=0.5") is ap)
+        self.assertEqual(cn.negotiate(accept="image/png"), None)
+        self.assertEqual(cn.negotiate(accept="image/png"), None)
+        info = cn.cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (2, 2, 2))
+        cn.negotiate(accept="text/html")
+        self.assertEqual(cn.cache_info()['evictions'], 1)
+        # changing configuration invalidates cache
+        cn.acceptable = [AcceptParameters(ContentType("text/html"), Language("en"))]
+        self.assertEqual(cn.cache_info()['size'], 0)
+        ap = cn.negotiate(accept="text/plain, text/html;q=0.5")
+        self.assertEqual(str(ap.content_type), 'text/html')
+        cn.negotiate(accept="text/html")
+        cn.weights = {'content_type': 1.0, 'language': 2.0}
+        self.assertEqual(cn.cache_info()['size'], 0)
+        cn.negotiate(accept="text/html")
+        cn.default_accept_parameters = AcceptParameters(ContentType("text/html"))
+        self.assertEqual(cn.cache_info()['size'], 0)
+        # compiled negotiator with cache
+        ccn = CompiledContentNegotiator(acceptable=server, cache_size=10)
+        ap = ccn.negotiate(accept="text/plain, text/html;q=0.5")
+        self.assertTrue(ccn.negotiate(accept="text/plain, text/html;q=0.5") is ap)
+        self.assertEqual(ccn.cache_info()['hits'], 1)
+
+    def test07_parse_cache(self):
+        """PARSE CACHE shared across negotiators."""
+        parse_cache.clear()
+        cn1 = ContentNegotiator(acceptable=[AcceptParameters(ContentType("text/html"))])
+        cn2 = ContentNegotiator(acceptable=[AcceptParameters(ContentType("text/plain"))])
+        accept = "text/html;q=0.9, text/plain, */*;q=0.1"
+        a1 = cn1._analyse_accept(accept)
+        self.assertEqual(len(a1), 3)
+        self.assertEqual(a1[0][0], 0.95)
+        self.assertEqual(str(a1[0][1][0]), 'text/plain')
+        self.assertTrue(cn2._analyse_accept(accept) is a1)
+        l1 = cn1._analyse_language("en, de;q=0.5")
+        self.assertTrue(cn2._analyse_language("en, de;q=0.5") is l1)
+        self.assertEqual(str(cn1.negotiate(accept=accept).content_type), 'text/html')
+        self.assertEqual(str(cn2.negotiate(accept=accept).content_type), 'text/plain')
+        self.assertTrue(parse_cache.info()['hits'] >= 4)
+        # bad headers are not cached
+        self.assertRaises(ValueError, cn1._analyse_accept, "garbage")
+        self.assertFalse(('accept', 'garbage') in parse_cache)
+
+    def test08_negotiate_many(self):
+        """BATCH NEGOTIATION."""
+        default = AcceptParameters(ContentType("text/html"), Language("en"))
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/plain"), Language("de")),
+                  AcceptParameters(ContentType("application/json"), Language("en"))]
+        headers = [{'accept': "text/plain, text/html;q=0.5"},
+                   {'Accept': "application/json", 'Accept-Language': "de", 'User-Agent': "x"},
+                   {},
+                   {'ACCEPT': "image/png"},
+                   {'accept': "text/plain, text/html;q=0.5"},
+                   {'accept_language': "de", 'accept': "*/*"}] * 7
+        for cn in (ContentNegotiator(default, server), CompiledContentNegotiator(default, server)):
+            expected = [cn.negotiate(accept=h.get('accept', h.get('Accept', h.get('ACCEPT'))),
+                                     accept_language=h.get('accept_language', h.get('Accept-Language')))
+                        for h in headers]
+            results = cn.negotiate_many(iter(headers))
+            self.assertFalse(isinstance(results, list))
+            self.assertEqual(list(results), expected)
+            self.assertEqual(list(cn.negotiate_many(headers, cache_size=0)), expected)
+            results = list(cn.negotiate_many(headers, processes=2, chunk_size=4))
+            self.assertEqual(results, expected)
+            # results are the negotiator's own objects
+            self.assertTrue(results[0] is server[1])
+            self.assertTrue(results[2] is default)
+            self.assertEqual(list(cn.negotiate_many([], processes=2)), [])
+        # worker loads the pickled negotiator once
+        pickled = pickle.dumps(cn, pickle.HIGHEST_PROTOCOL)
+        self.assertEqual(negotiator._negotiate_many_chunk(pickled, [("text/plain",) + (None,) * 4]), [1])
+        worker_negotiator = negotiator._worker_negotiator
+        self.assertEqual(negotiator._negotiate_many_chunk(pickled, [(None,) * 5]), [-1])
+        self.assertTrue(negotiator._worker_negotiator is worker_negotiator)
+        # without concurrent.futures negotiation is in this process
+        futures = sys.modules.get('concurrent.futures')
+        sys.modules['concurrent.futures'] = None
+        try:
+            self.assertEqual(list(cn.negotiate_many(headers, processes=2)), expected)
+        finally:
+            if futures is None:
+                del sys.modules['concurrent.futures']
+            else:
+                sys.modules['concurrent.futures'] = futures
+
+    def test09_trace(self):
+        """NEGOTIATION TRACE and logging."""
+        default = AcceptParameters(ContentType("text/html"), Language("en"))
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/plain"), Language("de"))]
+        cn = ContentNegotiator(default, server, cache_size=10)
+        accept = "image/png, text/html;q=0.5, text/plain;q=0.5"
+        trace = cn.negotiate(accept=accept, accept_language="de", trace=True)
+        self.assertEqual(trace.headers['accept'], accept)
+        self.assertEqual(trace.headers['accept_language'], "de")
+        self.assertEqual(trace.headers['accept_encoding'], None)
+        self.assertEqual(len(trace.analysed['content_type']), 2)
+        self.assertEqual(trace.analysed['encoding'], None)
+        self.assertTrue(trace.result is server[1])
+        self.assertEqual(len(trace.levels), 2)
+        self.assertEqual(trace.levels[0][2], ())
+        self.assertEqual(trace.levels[1][2], (1,))
+        self.assertEqual(repr(trace), "NegotiationTrace(result=AcceptParameters:: Content Type: text/plain;Language: de;, levels=2, tie_break='client')")
+        # trace does not use the cache
+        self.assertEqual(cn.cache_info()['size'], 0)
+        trace = cn.negotiate(trace=True)
+        self.assertTrue(trace.result is default)
+        self.assertEqual(trace.levels, [])
+        # logging still available when enabled
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('negotiator2.negotiator')
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            cn.negotiate(accept=accept, accept_language="de")
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertTrue('Accept: ' + accept in [r.getMessage() for r in records])
+
+    def test10_explain(self):
+        """EXPLAIN negotiation."""
+        default = AcceptParameters(ContentType("text/html"), Language("en"))
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/plain"), Language("de")),
+                  AcceptParameters(ContentType("text/plain"), Language("en"))]
+        for cn in (ContentNegotiator(default, server), CompiledContentNegotiator(default, server)):
+            # equal client preference for two variants, server order decides
+            trace = cn.explain(accept="text/plain", accept_language="en;q=0.5, de;q=0.5")
+            self.assertTrue(trace.result is server[1])
+            self.assertEqual(trace.tie_break, 'server')
+            self.assertEqual([level[2] for level in trace.levels], [(2, 1)])
+            self.assertEqual(set(trace.timings), set(['parse', 'combine', 'match', 'total']))
+            self.assertTrue(trace.timings['total'] >= trace.timings['parse'] >= 0.0)
+            self.assertTrue(trace.timings['combine'] >= 0.0 and trace.timings['match'] >= 0.0)
+            d = trace.as_dict()
+            self.assertEqual(d['result'], 'AcceptParameters:: Content Type: text/plain;Language: de;')
+            self.assertEqual(d['tie_break'], 'server')
+            self.assertEqual(d['analysed']['language'], [[0.5, ["en", "de"]]])
+            self.assertEqual(d['analysed']['charset'], None)
+            self.assertEqual(d['levels'][0]['positions'], [2, 1])
+            self.assertEqual(len(d['levels'][0]['combinations']), 2)
+            # negotiate(trace=True) gives the same
+            self.assertEqual(cn.negotiate(accept="text/plain", accept_language="en;q=0.5, de;q=0.5", trace=True).as_dict()['levels'],
+                             d['levels'])
+            # no agreement and defaults
+            trace = cn.explain(accept="image/png")
+            self.assertEqual((trace.result, trace.tie_break), (None, None))
+            self.assertEqual(cn.explain().tie_break, 'default')
+
+    def test11_value_types(self):
+        """IMMUTABLE VALUE TYPES."""
+        ct = ContentType("application/atom+xml;type=entry")
+        self.assertEqual((ct.type, ct.subtype, ct.params), ("application", "atom+xml", "type=entry"))
+        self.assertEqual(ct, ContentType(type="application", subtype="atom+xml", params="type=entry"))
+        self.assertEqual(ContentType.from_mimetype("text/html"), ContentType("text/html"))
+        self.assertNotEqual(ct, ContentType("application/atom+xml"))
+        self.assertNotEqual(ct, "application/atom+xml;type=entry")
+        self.assertEqual(Language("en-gb"), Language(language="en", variant="gb"))
+        self.assertNotEqual(Language("en-gb"), Language("en"))
+        self.assertNotEqual(Language("en"), "en")
+        ap1 = AcceptParameters(ContentType("text/html"), Language("en"), "gzip")
+        ap2 = AcceptParameters(ContentType("text/html"), Language("en"), "gzip")
+        self.assertEqual(ap1, ap2)
+        self.assertFalse(ap1 != ap2)
+        self.assertNotEqual(ap1, AcceptParameters(ContentType("text/html"), Language("en")))
+        self.assertNotEqual(ap1, None)
+        # hashable
+        self.assertEqual(len(set([ap1, ap2, ct, ContentType("application/atom+xml;type=entry"),
+                                  Language("en"), Language("en")])), 3)
+        self.assertEqual({ap1: 1}[ap2], 1)
+        # immutable and compact
+        self.assertRaises(AttributeError, setattr, ct, 'type', 'text')
+        self.assertRaises(AttributeError, setattr, ap1, 'language', Language("de"))
+        self.assertRaises(AttributeError, setattr, ap1, 'other', 1)
+        self.assertRaises(AttributeError, delattr, Language("en"), 'variant')
+        self.assertRaises(AttributeError, setattr, ct, '_key', ('a', 'b', None))
+        self.assertFalse(hasattr(ap1, '__dict__'))
+        # picklable
+        for v in (ct, Language("en-gb"), ap1, AcceptParameters()):
+            v2 = pickle.loads(pickle.dumps(v))
+            self.assertEqual(v2, v)
+            self.assertEqual(hash(v2), hash(v))
+            self.assertEqual(str(v2), str(v))
+
+    def test12_intern_pool(self):
+        """INTERNING of parsed values."""
+        cn = ContentNegotiator(acceptable=[AcceptParameters(ContentType("text/html"), Language("en"))])
+        intern_pool.clear()
+        a1 = cn._parse_accept("text/html, application/json;q=0.5")
+        a2 = cn._parse_accept("application/xml, text/html;q=0.9")
+        self.assertTrue(a1[0][1][0] is a2[1][1][0])
+        self.assertEqual(str(a1[0][1][0]), 'text/html')
+        l1 = cn._parse_language("en-gb, de;q=0.5")
+        l2 = cn._parse_language("en-gb;q=0.1")
+        self.assertTrue(l1[0][1][0] is l2[0][1][0])
+        self.assertTrue(Language.interned("de") is l1[1][1][0])
+        self.assertTrue(ContentType.interned("text", "html") is a1[0][1][0])
+        self.assertFalse(ContentType.interned("text", "html") is ContentType("text/html"))
+        info = intern_pool.info()
+        self.assertEqual(info['size'], 5)
+        self.assertEqual(info['maxsize'], 1024)
+        # pool is bounded
+        intern_pool.resize(2)
+        try:
+            self.assertEqual(len(intern_pool), 2)
+            cn._parse_accept("a/b, c/d, e/f")
+            self.assertEqual(len(intern_pool), 2)
+            self.assertEqual(str(cn.negotiate(accept="text/html", accept_language="en")),
+                             'AcceptParameters:: Content Type: text/html;Language: en;')
+        finally:
+            intern_pool.resize(1024)
+
+    def test13_match_table(self):
+        """MATCH TABLE memoized per negotiator."""
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/plain"), Language("de"))]
+        cn = ContentNegotiator(acceptable=server)
+        self.assertEqual(str(cn.negotiate(accept="text/plain, */*;q=0.1", accept_language="de")),
+                         'AcceptParameters:: Content Type: text/plain;Language: de;')
+        index = cn._variant_index()
+        self.assertEqual(index.content_type_table[ContentType("text/plain")], frozenset([1]))
+        self.assertEqual(index.language_table[Language("de")], frozenset([1]))
+        cn.negotiate(accept="*/*", accept_language="de")
+        self.assertTrue(cn._variant_index() is index)
+        self.assertEqual(index.content_type_table[ContentType("*/*")], frozenset([0, 1]))
+        # changes in place to acceptable are picked up
+        server.insert(0, AcceptParameters(ContentType("text/plain"), Language("de")))
+        self.assertTrue(cn.negotiate(accept="text/plain", accept_language="de") is server[0])
+        self.assertFalse(cn._variant_index() is index)
+        # clear_cache discards the table
+        index = cn._variant_index()
+        cn.clear_cache()
+        self.assertFalse(cn._variant_index() is index)
+        # table is bounded
+        ccn = CompiledContentNegotiator(acceptable=server)
+        index = ccn._variant_index()
+        index.table_size = 2
+        for t in ("a/a", "b/b", "c/c", "text/plain"):
+            ccn.negotiate(accept=t)
+        self.assertEqual(len(index.content_type_table), 2)
+        self.assertTrue(ccn.negotiate(accept="text/plain") is server[0])
+        self.assertTrue(ccn._variant_index() is index)
+        ccn.clear_cache()
+        self.assertFalse(ccn._variant_index() is index)
+        self.assertTrue(ccn.negotiate(accept="text/plain") is server[0])
+        # index is looked up once per negotiation, not for each candidate
+        calls = []
+        variant_index = cn._variant_index
+        cn._variant_index = lambda: calls.append(1) or variant_index()
+        self.assertTrue(cn.negotiate(accept="a/a, b/b;q=0.9, c/c;q=0.8, text/plain;q=0.7") is server[0])
+        self.assertEqual(len(calls), 1)
+
+    def test14_engines(self):
+        """MATCHING ENGINES give the same results."""
+        server = [AcceptParameters(ContentType(t), Language(lang))
+                  for t in ("text/html", "text/plain", "application/json", "image/*")
+                  for lang in ("en", "en-gb", "de", "*")]
+        cases = [("text/plain, */*;q=0.1", "de"), ("image/png", "fr"), ("*/*", "en-us"),
+                 ("application/json;q=0.5, text/*;q=0.5", "en-gb;q=0.5, de;q=0.5"),
+                 ("audio/mpeg", "en"), (None, "de")]
+        expected = [ContentNegotiator(acceptable=server, engine='scan').negotiate(a, al) for (a, al) in cases]
+        self.assertEqual(str(expected[0]), 'AcceptParameters:: Content Type: text/plain;Language: de;')
+        self.assertEqual(expected[4], None)
+        for cls in (ContentNegotiator, CompiledContentNegotiator):
+            for engine in ('sets', 'bitmask'):
+                cn = cls(acceptable=server, engine=engine)
+                self.assertEqual(cn.engine, engine)
+                self.assertEqual([cn.negotiate(a, al) for (a, al) in cases], expected)
+        index = cn._variant_index()
+        self.assertEqual(index.content_type_table[ContentType("image/png")], 0xf000)
+        self.assertEqual(index.match_position(AcceptParameters(ContentType("image/png"), Language("de"))), 14)
+        self.assertRaises(ValueError, ContentNegotiator, acceptable=server, engine='quantum')
+        self.assertRaises(AttributeError, setattr, cn, 'engine', 'sets')
+        cn = ContentNegotiator(acceptable=server)
+        cn.engine = 'scan'
+        self.assertEqual([cn.negotiate(a, al) for (a, al) in cases], expected)
+
+    def test15_tokenize_accept_header(self):
+        """TOKENIZE ACCEPT HEADERS."""
+        def tokens(header):
+            return list(tokenize_accept_header(header))
+        self.assertEqual(tokens("text/html"), [("text/html", None, None, 1)])
+        self.assertEqual(tokens("text/html;level=1;q=0.5, */*;q=0.1"),
+                         [("text/html", "level=1", 0.5, 1), ("*/*", None, 0.1, 2)])
+        self.assertEqual(tokens(" text/html ; a=1 ;b=2 ; Q = 0.5 ; ext=1 ,text/plain"),
+                         [("text/html", "a=1;b=2", 0.5, 1), ("text/plain", None, None, 2)])
+        # quoted strings may contain commas and semicolons
+        self.assertEqual(tokens('a/b;p="x, y;q=1";q=0.3, c/d'),
+                         [("a/b", 'p="x, y;q=1"', 0.3, 1), ("c/d", None, None, 2)])
+        self.assertEqual(tokens('a/b;p="\\"", c/d'),
+                         [("a/b", 'p="\\""', None, 1), ("c/d", None, None, 2)])
+        # empty elements are skipped
+        self.assertEqual(tokens(", en,, de;q=0.5,"), [("en", None, None, 1), ("de", None, 0.5, 2)])
+        self.assertEqual(tokens(""), [])
+        self.assertRaises(ValueError, tokens, "text/html;q=high")
+        # parsing uses the tokenizer
+        cn = ContentNegotiator()
+        self.assertEqual(cn._parse_accept("text/html;level=1;q=0.5, text/plain;q=0"),
+                         ((0.5, (ContentType("text/html;level=1"),)), (0.0, (ContentType("text/plain"),))))
+        self.assertRaises(ValueError, cn._parse_accept, "html")
+        # nothing acceptable
+        cn = ContentNegotiator(acceptable=[AcceptParameters(ContentType("text/html"))])
+        self.assertEqual(cn.negotiate(accept="text/html;q=0"), None)
+        self.assertEqual(cn.negotiate(accept=" , "), None)
+        self.assertEqual(cn._parse_language("en-gb-oed;q=0.5, fr, *;q=0"),
+                         ((0.75, (Language("fr"),)), (0.5, (Language("en-gb-oed"),)), (0.0, (Language("*"),))))
+        # q=0 refuses what it matches for less specific ranges
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("text/plain"), Language("en")),
+                  AcceptParameters(ContentType("text/html"), Language("de"))]
+        cases = [(("text/html;q=0, */*;q=0.1", None), server[1]),
+                 ((None, "en;q=0, *;q=0.5"), server[2]),
+                 (("text/*;q=0, text/plain", None), server[1]),
+                 (("*/*;q=0", "*;q=0, en"), None),
+                 (("text/html;q=0, */*;q=0.1", "en;q=0, *;q=0.5"), None),
+                 (("text/html;q=0, */*", "en;q=0, de, *;q=0.5"), None),
+                 (("text/*, text/plain;q=0", "de;q=0, en"), server[0])]
+        for engine in ('scan', 'sets', 'bitmask'):
+            cn = ContentNegotiator(acceptable=server, engine=engine)
+            for ((accept, accept_language), expected) in cases:
+                self.assertTrue(cn.negotiate(accept, accept_language) is expected, (engine, accept, accept_language))
+
+    def test16_limits(self):
+        """LIMITS on header length, entries and combinations."""
+        default = AcceptParameters(ContentType("text/plain"))
+        server = [AcceptParameters(ContentType("text/html"), Language("en")),
+                  AcceptParameters(ContentType("application/json"), Language("de"))]
+        many = ", ".join("x/y%d;q=0.1" % n for n in range(1000))
+        # default limits bound a long header without changing normal results
+        cn = ContentNegotiator(default, server, cache_size=10)
+        self.assertEqual(cn.negotiate(accept=many + ", text/html"), None)
+        low = ", ".join("x/y%d;q=0.5" % n for n in range(100))
+        self.assertEqual(cn.negotiate(accept=low + ", text/html;q=0.9, " + many), server[0])
+        self.assertEqual(cn.limit_info(), {'header_length': 2, 'entries': 2, 'combinations': 0})
+        self.assertEqual(cn.cache_info()['size'], 0)
+        self.assertEqual(cn.negotiate(accept="application/json", accept_language="de"), server[1])
+        self.assertEqual(cn.limit_info()['header_length'], 2)
+        # header length truncates at a comma
+        cn = ContentNegotiator(default, server, max_header_length=20)
+        self.assertEqual(cn._limit_header_length(("text/html, application/json", "de, en", None, None, "p" * 30)),
+                         ("text/html", "de, en", None, None, "p" * 30))
+        self.assertEqual(cn.negotiate(accept="application/json, text/html", accept_language="en"), None)
+        self.assertEqual(cn.negotiate(accept="text/html, application/json", accept_language="en"), server[0])
+        # a header with no comma within the limit is treated as missing
+        self.assertEqual(cn._limit_header_length(("application/json;level=1", "en", None, None, None)),
+                         (None, "en", None, None, None))
+        self.assertEqual(cn.negotiate(accept="application/json;level=1", accept_language="en"), server[0])
+        self.assertTrue(cn.negotiate(accept="application/json;level=1") is default)
+        # refusals cut off are kept
+        self.assertEqual(cn._limit_header_length(("*/*;q=0.1, a/a, b/bbbbbbbbbb, text/html;q=0", None, None, None, None)),
+                         ("*/*;q=0.1, a/a, text/html;q=0", None, None, None, None))
+        self.assertEqual(cn.negotiate(accept="*/*;q=0.1, a/a, b/bbbbbbbbbb, text/html;q=0"), server[1])
+        self.assertEqual(cn._limit_header_length(("text/html;level=1;q=0", None, None, None, None)),
+                         ("text/html;level=1;q=0", None, None, None, None))
+        # entries keeps highest q
+        cn = ContentNegotiator(default, server, max_entries=2)
+        self.assertEqual(cn.negotiate(accept="a/a;q=0.9, text/html;q=0.8, application/json;q=0.7, b/b;q=0.1"), server[0])
+        self.assertEqual(cn.negotiate(accept="a/a, b/b, text/html"), None)
+        # refusals are kept and not counted
+        refusing = "text/html;q=0, */*;q=0.1, image/a"
+        self.assertEqual(ContentNegotiator(default, server).negotiate(accept=refusing), server[1])
+        self.assertEqual(cn.negotiate(accept=refusing), server[1])
+        self.assertEqual(cn._limit_entries(cn._analyse_accept(refusing))[-1], (0.0, (ContentType("text/html"),)))
+        # combinations
+        cn = ContentNegotiator(default, server, max_combinations=3)
+        self.assertEqual(cn.negotiate(accept="a/a, b/b, text/html", accept_language="en"), server[0])
+        self.assertEqual(cn.negotiate(accept="a/a, b/b, c/c, text/html", accept_language="en"), None)
+        self.assertEqual(cn.limit_info(), {'header_length': 0, 'entries': 0, 'combinations': 1})
+        # default action
+        cn = CompiledContentNegotiator(default, server, max_combinations=3, limit_action='default')
+        self.assertTrue(cn.negotiate(accept="a/a, b/b, c/c, text/html", accept_language="en") is default)
+        trace = cn.explain(accept="a/a, b/b, c/c, text/html", accept_language="en")
+        self.assertEqual((trace.result, trace.tie_break), (default, 'limit'))
+        self.assertEqual(cn.limit_info()['combinations'], 2)
+        cn = ContentNegotiator(default, server, max_header_length=5, limit_action='default')
+        self.assertTrue(cn.negotiate(accept="text/html") is default)
+        self.assertEqual(cn.explain(accept="text/html").tie_break, 'limit')
+        # no limits
+        cn = ContentNegotiator(default, server, max_header_length=None, max_entries=None, max_combinations=None)
+        self.assertEqual(cn.negotiate(accept=many + ", text/html"), server[0])
+        self.assertEqual(cn.limit_info(), {'header_length': 0, 'entries': 0, 'combinations': 0})
+        self.assertRaises(ValueError, ContentNegotiator, limit_action='ignore')
+        self.assertRaises(AttributeError, setattr, CompiledContentNegotiator(), 'max_entries', 10)
+
+    def test17_encoding_and_charset(self):
+        """ACCEPT-ENCODING AND ACCEPT-CHARSET."""
+        html = ContentType("text/html")
+        server = [AcceptParameters(html, encoding="br"),
+                  AcceptParameters(html, encoding="gzip"),
+                  AcceptParameters(html)]
+        cases = [(None, server[2]), ("gzip, deflate, br", server[0]), ("GZIP", server[1]),
+                 ("zstd", server[2]), ("", server[2]), ("gzip;q=0.5, identity", server[2]),
+                 ("*, br;q=0", server[1]), ("identity;q=0", None), ("*;q=0", None),
+                 ("zstd, *;q=0.1", server[0])]
+        for cls in (ContentNegotiator, CompiledContentNegotiator):
+            for engine in ('sets', 'bitmask', 'scan'):
+                cn = cls(acceptable=server, engine=engine)
+                for (accept_encoding, expected) in cases:
+                    self.assertEqual(cn.negotiate(accept="text/html", accept_encoding=accept_encoding), expected)
+        cn = ContentNegotiator(acceptable=server)
+        self.assertEqual(cn._analyse_encoding("gzip;q=0.5, zstd"), ((0.5, ("gzip",)), (0.25, (None,))))
+        self.assertEqual(cn._parse_codings("gzip;q=0.5, *;q=0, Identity"),
+                         (((1.0, ("identity",)), (0.5, ("gzip",))), 0.0, frozenset(["gzip", "identity"])))
+        # header ignored if the server offers no encodings or charsets, unless identity is refused
+        cn = ContentNegotiator(acceptable=[AcceptParameters(html)])
+        self.assertEqual(cn._analyse_encoding("gzip"), None)
+        self.assertEqual(cn._analyse_charset("utf-8"), None)
+        self.assertEqual(cn.negotiate(accept="text/html", accept_encoding="*;q=0, identity"), cn.acceptable[0])
+        for cls in (ContentNegotiator, CompiledContentNegotiator):
+            for accept_encoding in ("identity;q=0", "gzip, *;q=0"):
+                cn2 = cls(AcceptParameters(html), [AcceptParameters(html)])
+                self.assertEqual(cn2.negotiate(accept="text/html", accept_encoding=accept_encoding), None)
+                self.assertEqual(cn2.negotiate(accept_encoding=accept_encoding), None)
+        # as for no headers if only ignored headers are given
+        for cls in (ContentNegotiator, CompiledContentNegotiator):
+            cn2 = cls(AcceptParameters(html), [AcceptParameters(html), AcceptParameters(ContentType("text/plain"))])
+            self.assertTrue(cn2.negotiate(accept_encoding="gzip") is cn2.default_accept_parameters)
+            self.assertTrue(cn2.negotiate(accept_charset="utf-8") is cn2.default_accept_parameters)
+            self.assertTrue(cn2.negotiate(accept_encoding="gzip, br", accept_charset="utf-8") is cn2.default_accept_parameters)
+            self.assertEqual(cn2.explain(accept_encoding="gzip").tie_break, 'default')
+        # server encoding changes picked up
+        cn.acceptable.insert(0, AcceptParameters(html, encoding="gzip"))
+        self.assertEqual(cn.negotiate(accept="text/html", accept_encoding="gzip"), cn.acceptable[0])
+        # levels memoized with the offered encodings, fixed for a compiled negotiator
+        self.assertEqual(cn._offered().encoding_table["gzip"], ((1.0, ("gzip",)), (0.5, (None,))))
+        ccn = CompiledContentNegotiator(acceptable=cn.acceptable)
+        offered = ccn._offered()
+        self.assertEqual(ccn.negotiate(accept="text/html", accept_encoding="gzip"), cn.acceptable[0])
+        self.assertTrue(ccn._offered() is offered)
+        self.assertEqual(list(offered.encoding_table), ["gzip"])
+        # charsets, None is not applicable so always acceptable
+        server = [AcceptParameters(html, charset="UTF-8"),
+                  AcceptParameters(html, charset="iso-8859-1"),
+                  AcceptParameters(ContentType("image/png"))]
+        cn = ContentNegotiator(acceptable=server)
+        self.assertEqual(cn.negotiate(accept="text/html", accept_charset="iso-8859-1, utf-8;q=0.5"), server[1])
+        self.assertEqual(cn.negotiate(accept="text/html", accept_charset="utf-8"), server[0])
+        self.assertEqual(cn.negotiate(accept="text/html", accept_charset="koi8-r"), None)
+        self.assertEqual(cn.negotiate(accept="image/png", accept_charset="koi8-r"), server[2])
+        self.assertEqual(cn._analyse_charset("koi8-r;q=0.5, *;q=0.1"),
+                         ((0.5, (None,)), (0.1, ("UTF-8", "iso-8859-1"))))
+        # variant and encoding chosen together, weights apply
+        server = [AcceptParameters(ContentType(t), encoding=e)
+                  for t in ("application/json", "text/html") for e in ("gzip", None)][1:]
+        cn = ContentNegotiator(acceptable=server)
+        self.assertEqual(cn.negotiate(accept="application/json, text/html;q=0.9", accept_encoding="gzip"), server[1])
+        cn = ContentNegotiator(acceptable=server, weights={'encoding': 0.01})
+        self.assertEqual(cn.negotiate(accept="application/json, text/html;q=0.9", accept_encoding="gzip"), server[0])
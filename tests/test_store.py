@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""TimeMap store tests."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from negotiator2 import TimeMap, memento_parse_datetime
+from negotiator2.store import TimeMapStore, write_timemap_store
+
+
+@unittest.skipIf(sys.version_info[0] < 3, "TimeMapStore requires Python 3")
+class TestAll(unittest.TestCase):
+    """TestAll class to run tests."""
+
+    def setUp(self):
+        """Make temporary directory for store files."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'timemaps.store')
+
+    def tearDown(self):
+        """Remove temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def _timemaps(self):
+        tm1 = TimeMap(original='http://a.example.org/', timegate='http://tg.example.org/a',
+                      timemap='http://tm.example.org/a')
+        tm1.add_memento('http://m.example.org/a1', 'Tue, 20 Mar 2001 20:35:00 GMT')
+        tm1.add_memento('http://m.example.org/a2', 'Thu, 31 May 2007 20:35:00 GMT')
+        tm1.add_memento('http://m.example.org/a0', 'Tue, 15 Sep 2000 11:28:26 GMT')
+        tm2 = TimeMap(original='http://b.example.org/é', compact=True)
+        tm2.set_original('http://b.example.org/é', 'Wed, 30 May 2007 18:47:52 GMT')
+        tm2.add_memento('http://m.example.org/b1', 'Tue, 20 Mar 2001 13:36:10 GMT')
+        tm3 = TimeMap(original='http://c.example.org/')
+        return [tm2, tm3, tm1]
+
+    def test01_write_and_read(self):
+        """Test round trip through store file."""
+        timemaps = self._timemaps()
+        write_timemap_store(self.filename, timemaps)
+        store = TimeMapStore(self.filename)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store), ['http://a.example.org/', 'http://b.example.org/é',
+                                       'http://c.example.org/'])
+        self.assertTrue('http://c.example.org/' in store)
+        self.assertFalse('http://d.example.org/' in store)
+        self.assertFalse('http://0.example.org/' in store)
+        self.assertEqual(store.get('http://d.example.org/'), None)
+        self.assertRaises(KeyError, store.__getitem__, 'http://d.example.org/')
+        for tm in timemaps:
+            stored = store[tm.original]
+            self.assertEqual(stored.original, tm.original)
+            self.assertEqual(stored.timegate, tm.timegate)
+            self.assertEqual(stored.timemap, tm.timemap)
+            self.assertEqual(stored.original_datetime, tm.original_datetime)
+            self.assertEqual(list(stored.mementos.items()), sorted(tm.mementos.items()))
+            self.assertEqual(stored.serialize_link_format(), tm.serialize_link_format())
+
+    def test02_best_version(self):
+        """Test best_version on stored TimeMaps matches in-memory TimeMaps."""
+        timemaps = self._timemaps()
+        write_timemap_store(self.filename, timemaps)
+        with TimeMapStore(self.filename) as store:
+            for tm in timemaps:
+                stored = store[tm.original]
+                for s in ('Tue, 20 Mar 2001 20:35:00 GMT', 'Mon, 01 Jan 1990 00:00:00 GMT',
+                          'Wed, 30 May 2007 18:47:52 GMT', 'Mon, 01 Jan 2018 00:00:00 GMT'):
+                    dt = memento_parse_datetime(s)
+                    for method in (TimeMap.PREVIOUS, TimeMap.CLOSEST, TimeMap.LAST):
+                        self.assertEqual(stored.best_version(dt, method), tm.best_version(dt, method))
+                del stored
+        # stored TimeMaps are read-only
+        store = TimeMapStore(self.filename)
+        stored = store['http://a.example.org/']
+        self.assertRaises(TypeError, stored.add_memento, 'http://m.example.org/x',
+                          'Mon, 01 Jan 2018 00:00:00 GMT')
+
+    def test03_bad(self):
+        """Test bad inputs."""
+        self.assertRaises(ValueError, write_timemap_store, self.filename, [TimeMap()])
+        self.assertRaises(ValueError, write_timemap_store, self.filename,
+                          [TimeMap(original='http://a.example.org/'),
+                           TimeMap(original='http://a.example.org/')])
+        with open(self.filename, 'wb') as fh:
+            fh.write(b'not a store' * 10)
+        self.assertRaises(ValueError, TimeMapStore, self.filename)
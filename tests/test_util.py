@@ -1,7 +1,12 @@
 """Negotiator utility tests."""
+import os
+import shutil
+import tempfile
 import unittest
 
-from negotiator2 import conneg_on_accept, negotiate_on_datetime, TimeMap, BadTimeMap
+from negotiator2 import (conneg_on_accept, make_conneg_on_accept, precompressed_on_accept,
+                         negotiate_on_datetime, negotiate_on_datetimes, TimeMap, BadTimeMap)
+from negotiator2.util import _accept_datetime_cache, _conneg_registry, _precompressed_results
 
 
 class TestAll(unittest.TestCase):
@@ -86,3 +91,94 @@ class TestAll(unittest.TestCase):
         self.assertEqual(negotiate_on_datetime(tm, 'anything'), "URI-M3")
         self.assertEqual(negotiate_on_datetime(tm, 'anything', method=TimeMap.PREVIOUS), "URI-M3")
         self.assertEqual(negotiate_on_datetime(tm, 'anything', method=TimeMap.CLOSEST), "URI-M3")
+
+    def test03_make_conneg_on_accept(self):
+        """Test negotiation function for fixed types."""
+        conneg = make_conneg_on_accept(['text/plain', 'text/html'])
+        self.assertEqual(conneg(None), 'text/plain')
+        self.assertEqual(conneg(''), 'text/plain')
+        self.assertEqual(conneg('garbage'), 'text/plain')
+        self.assertEqual(conneg('application/atom+xml;q=0.6, application/rdf+xml;q=0.9, text/html'), 'text/html')
+        self.assertEqual(conneg('application/atom+xml;q=0.6, application/rdf+xml;q=0.9, text/html'), 'text/html')
+        self.assertEqual(conneg('text/*'), 'text/plain')
+        # bad types give default behavior
+        self.assertEqual(make_conneg_on_accept(['a'])('text/html'), 'a')
+        self.assertRaises(IndexError, make_conneg_on_accept, [])
+
+    def test04_conneg_on_accept_registry(self):
+        """Test conneg_on_accept reuses negotiation functions."""
+        types = ['application/json', 'text/html']
+        self.assertEqual(conneg_on_accept(types, 'text/html'), 'text/html')
+        conneg = _conneg_registry.get(tuple(types))
+        self.assertTrue(conneg is not None)
+        self.assertEqual(conneg_on_accept(list(types), 'text/plain'), 'application/json')
+        self.assertTrue(_conneg_registry.get(tuple(types)) is conneg)
+
+    def test05_precompressed_on_accept(self):
+        """Test selection of precompressed siblings of a static file."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'app.js')
+            for filename in (path, path + '.gz', path + '.br'):
+                with open(filename, 'w') as fh:
+                    fh.write('x')
+            self.assertEqual(precompressed_on_accept(path, 'gzip, deflate, br'), (path + '.br', 'br'))
+            self.assertEqual(precompressed_on_accept(path, 'gzip'), (path + '.gz', 'gzip'))
+            self.assertEqual(precompressed_on_accept(path, 'zstd'), (path, None))
+            self.assertEqual(precompressed_on_accept(path, None), (path, None))
+            self.assertEqual(precompressed_on_accept(path, 'gzip;q=0.5, br;q=junk'), (path, None))
+            self.assertEqual(precompressed_on_accept(path, 'identity;q=0, br;q=0, zstd'), None)
+            # results and files are remembered until the ttl expires
+            hits = _precompressed_results.hits
+            os.remove(path + '.br')
+            self.assertEqual(precompressed_on_accept(path, 'gzip, deflate, br'), (path + '.br', 'br'))
+            self.assertEqual(_precompressed_results.hits, hits + 1)
+            self.assertEqual(precompressed_on_accept(path, 'br, gzip;q=0.5', ttl=0), (path + '.gz', 'gzip'))
+            self.assertEqual(precompressed_on_accept(path, 'gzip, deflate, br', ttl=0), (path + '.gz', 'gzip'))
+            self.assertEqual(precompressed_on_accept(path, 'gzip, deflate, br'), (path + '.gz', 'gzip'))
+            with open(path + '.zst', 'w') as fh:
+                fh.write('x')
+            self.assertEqual(precompressed_on_accept(path, 'zstd', ttl=0), (path + '.zst', 'zstd'))
+            os.remove(path)
+            self.assertEqual(precompressed_on_accept(path, None, ttl=0), None)
+            self.assertEqual(precompressed_on_accept(path, 'gzip', ttl=0), (path + '.gz', 'gzip'))
+            self.assertEqual(precompressed_on_accept(os.path.join(tmpdir, 'none.js'), 'gzip'), None)
+            # file without precompressed siblings
+            plain = os.path.join(tmpdir, 'plain.js')
+            with open(plain, 'w') as fh:
+                fh.write('x')
+            for header in ('gzip, deflate, br', 'br;q=1.0, gzip;q=0.8, *;q=0.1', None, '*;q=0, identity', 'gzip;q=junk'):
+                self.assertEqual(precompressed_on_accept(plain, header), (plain, None))
+            for header in ('gzip, identity;q=0', 'gzip, *;q=0'):
+                self.assertEqual(precompressed_on_accept(plain, header), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test12_negotiate_on_datetime_cache(self):
+        """Test Accept-Datetime values are cached."""
+        tm = TimeMap()
+        tm.add_memento("URI-M1", 'Thu, 08 Aug 2017 02:08:08 GMT')
+        tm.add_memento("URI-M2", 'Thu, 08 Aug 2017 05:08:08 GMT')
+        _accept_datetime_cache.clear()
+        hits = _accept_datetime_cache.hits
+        self.assertEqual(negotiate_on_datetime(tm, 'Thu, 08 Aug 2017 04:08:08 GMT'), "URI-M1")
+        self.assertEqual(negotiate_on_datetime(tm, 'Thu, 08 Aug 2017 04:08:08 GMT'), "URI-M1")
+        self.assertEqual(_accept_datetime_cache.hits, hits + 1)
+        self.assertFalse('junk' in _accept_datetime_cache)
+        self.assertEqual(negotiate_on_datetime(tm, 'junk'), "URI-M2")
+        self.assertFalse('junk' in _accept_datetime_cache)
+
+    def test13_negotiate_on_datetimes(self):
+        """Test negotiation for a sequence of Accept-Datetime headers."""
+        tm = TimeMap()
+        tm.add_memento("URI-M1", 'Thu, 08 Aug 2017 02:08:08 GMT')
+        tm.add_memento("URI-M2", 'Thu, 08 Aug 2017 05:08:08 GMT')
+        tm.set_original("URI-R3", 'Thu, 08 Aug 2017 08:08:08 GMT')
+        headers = ['Thu, 08 Aug 2017 04:08:08 GMT', 'junk', 'Thu, 02 Nov 2017 16:29:00 GMT',
+                   None, 'Thu, 08 Aug 1991 01:01:01 GMT', 'Thu, 08 Aug 2017 08:08:07 GMT']
+        self.assertEqual(negotiate_on_datetimes(tm, headers),
+                         ["URI-M1", "URI-R3", "URI-R3", "URI-R3", "URI-M1", "URI-M2"])
+        self.assertEqual(negotiate_on_datetimes(tm, headers, method=TimeMap.CLOSEST),
+                         ["URI-M2", "URI-R3", "URI-R3", "URI-R3", "URI-M1", "URI-R3"])
+        self.assertEqual(negotiate_on_datetimes(tm, []), [])
+        self.assertRaises(BadTimeMap, negotiate_on_datetimes, TimeMap(), ['junk'])